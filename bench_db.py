@@ -0,0 +1,75 @@
+"""
+bench_db.py — DBCursorWrapper.execute のマイクロベンチマーク
+PostgreSQL向けSQL変換の1回あたりのオーバーヘッドを、変換キャッシュ導入前の実装と比較する。
+DBへは接続せず、何もしないダミーカーソルに対して実行するので純粋にPython側のコストだけを測る。
+
+実行方法:
+  python bench_db.py
+"""
+
+import time
+
+import database
+
+QUERIES = [
+    ("SELECT * FROM goods_info WHERE 1=1 AND title = ? ORDER BY date DESC, created_at DESC, id DESC LIMIT ?", ("t", 51)),
+    ("SELECT id FROM users WHERE email=?", ("a@example.com",)),
+    ("SELECT anime_title FROM favorites WHERE user_id=?", (1,)),
+    ("INSERT INTO favorites (user_id, anime_title) VALUES (?, ?)", (1, "t")),
+]
+
+
+class _NullCursor:
+    """psycopg カーソルの代わり（execute/fetchone は何もしない）"""
+
+    def execute(self, query, params=None, prepare=None):
+        pass
+
+    def fetchone(self):
+        return {"id": 1}
+
+
+def _legacy_execute(cursor, query, params=None):
+    """変換キャッシュ導入前の DBCursorWrapper.execute（PostgreSQL分岐）"""
+    query = query.replace("?", "%s")
+    query = query.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "SERIAL PRIMARY KEY")
+    query = query.replace("datetime('now','localtime')", "CURRENT_TIMESTAMP")
+    query = query.replace("INSERT OR IGNORE", "INSERT")
+    is_insert = query.strip().upper().startswith("INSERT")
+    if is_insert and " RETURNING " not in query.upper():
+        query += " RETURNING id"
+    if params:
+        cursor.execute(query, params)
+    else:
+        cursor.execute(query)
+    if is_insert and "RETURNING id" in query:
+        try:
+            cursor.fetchone()[0]
+        except Exception:
+            pass
+
+
+def _bench(label, func, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for query, params in QUERIES:
+            func(query, params)
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / (rounds * len(QUERIES)) * 1e6
+    print(f"{label:<28} {per_call_us:7.2f} µs/call")
+    return per_call_us
+
+
+def main(rounds=50000):
+    raw = _NullCursor()
+    wrapper = database.DBCursorWrapper(raw, True)
+    print(f"[BENCH] {len(QUERIES)}種類のクエリ x {rounds}回")
+    baseline = _bench("null cursor (下限)", raw.execute, rounds)
+    legacy = _bench("legacy translate", lambda q, p: _legacy_execute(raw, q, p), rounds)
+    cached = _bench("cached translate", wrapper.execute, rounds)
+    print(f"[BENCH] 変換オーバーヘッド: {legacy - baseline:.2f} µs → {cached - baseline:.2f} µs")
+    print(f"[BENCH] SQL変換キャッシュ: {database.to_postgres_sql.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+caches.py — プロセス内キャッシュ
+- LRUCache: スレッドセーフな件数上限付きLRU（エントリごとの有効期限つき）
+- GnewsDecodeCache: Google News の中間URL → 元記事URL の対応表
+  メモリ上のLRUを先に引き、無ければ gnews_decode_cache テーブルを引く。
+  デコードできた結果は永続（記事ごとに一生に1回だけデコードする）、
+  失敗は GNEWS_NEGATIVE_TTL 秒だけ覚えておき、その間は再試行しない。
+- OgpCache: 記事URL → サムネイル画像URL（期限付き）とドメイン別の成功率統計
+  連続して画像が取れないドメインはしばらく取得しない。
+
+確認方法:
+  python caches.py ogp [件数]   … キャッシュ件数とドメイン別統計
+  python caches.py ogp <URL>   … そのURLのキャッシュ内容
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import database
+from urlnorm import url_hash
+
+# 「キャッシュに無い」を表す番兵（None は「失敗を記録済み」の意味で使う）
+MISS = object()
+
+GNEWS_LRU_SIZE = int(os.environ.get("GNEWS_LRU_SIZE", "10000"))
+GNEWS_NEGATIVE_TTL = int(os.environ.get("GNEWS_NEGATIVE_TTL", str(6 * 3600)))
+
+OGP_LRU_SIZE = int(os.environ.get("OGP_LRU_SIZE", "10000"))
+OGP_CACHE_TTL = int(os.environ.get("OGP_CACHE_TTL", str(30 * 86400)))       # 画像が取れた結果
+OGP_NEGATIVE_TTL = int(os.environ.get("OGP_NEGATIVE_TTL", str(86400)))      # 画像なし・取得失敗
+OGP_DOMAIN_SKIP_FAILURES = int(os.environ.get("OGP_DOMAIN_SKIP_FAILURES", "5"))
+OGP_DOMAIN_SKIP_SECONDS = int(os.environ.get("OGP_DOMAIN_SKIP_SECONDS", str(86400)))
+# ドメイン統計のメモリ上の保持秒数（スキップ判定のたびにDBを引かないため）
+OGP_DOMAIN_STATS_TTL = 60
+
+class LRUCache:
+    """件数上限付きLRU。put 時に ttl を渡したエントリはその秒数で期限切れになる"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data = OrderedDict()   # key -> (value, expires_at or None)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISS):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.time():
+                    self.data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, ttl: float = None):
+        with self.lock:
+            self.data[key] = (value, time.time() + ttl if ttl is not None else None)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+class GnewsDecodeCache:
+    """Google News URL のデコード結果キャッシュ（メモリLRU → DB の2段）"""
+
+    def __init__(self, maxsize: int = GNEWS_LRU_SIZE, negative_ttl: int = GNEWS_NEGATIVE_TTL):
+        self.lru = LRUCache(maxsize)
+        self.negative_ttl = negative_ttl
+
+    def get(self, gnews_url: str):
+        """
+        Returns: 元記事URL / None（失敗を記録済みで再試行待ち） / MISS（未デコード）
+        ?oc=5 などの違いは正規化後のハッシュで吸収する。
+        """
+        key = url_hash(gnews_url)
+        cached = self.lru.get(key)
+        if cached is not MISS:
+            return cached
+        row = database.get_gnews_decoded(key)
+        if row is None:
+            return MISS
+        if row["decoded_url"]:
+            self.lru.put(key, row["decoded_url"])
+            return row["decoded_url"]
+        remaining = row["checked_at"] + self.negative_ttl - time.time()
+        if remaining <= 0:
+            return MISS
+        self.lru.put(key, None, ttl=remaining)
+        return None
+
+    def put(self, gnews_url: str, decoded_url: str = None):
+        """デコード結果を記録する（decoded_url が None なら失敗として記録）"""
+        key = url_hash(gnews_url)
+        if decoded_url:
+            self.lru.put(key, decoded_url)
+        else:
+            self.lru.put(key, None, ttl=self.negative_ttl)
+        database.save_gnews_decoded(key, gnews_url, decoded_url)
+
+class OgpCache:
+    """記事URLごとのOGP画像取得結果（メモリLRU → DB の2段）とドメイン別のスキップ判定"""
+
+    def __init__(self, maxsize: int = OGP_LRU_SIZE):
+        self.lru = LRUCache(maxsize)
+        self.domains = LRUCache(1000)
+
+    def get(self, url: str):
+        """Returns: 画像URL（'' は画像なしを記録済み） / MISS"""
+        key = url_hash(url)
+        cached = self.lru.get(key)
+        if cached is not MISS:
+            return cached
+        now = time.time()
+        row = database.get_ogp_cached(key, now)
+        if row is None:
+            return MISS
+        self.lru.put(key, row["image_url"], ttl=row["expires_at"] - now)
+        return row["image_url"]
+
+    def domain_skipped(self, domain: str) -> bool:
+        """連続失敗でスキップ中のドメインか"""
+        stats = self.domains.get(domain)
+        if stats is MISS:
+            stats = database.get_ogp_domain(domain) or {}
+            self.domains.put(domain, stats, ttl=OGP_DOMAIN_STATS_TTL)
+        return (stats.get("skip_until") or 0) > time.time()
+
+    def put(self, url: str, final_url: str, domain: str, image_url: str, strategy: str, elapsed_ms: float):
+        """取得結果を記録し、ドメイン統計を更新する"""
+        ttl = OGP_CACHE_TTL if image_url else OGP_NEGATIVE_TTL
+        entries = {url_hash(u): u for u in (url, final_url) if u}
+        for key in entries:
+            self.lru.put(key, image_url or "", ttl=ttl)
+        database.save_ogp_result(list(entries.items()), domain, image_url, strategy, elapsed_ms,
+                                 ttl, OGP_DOMAIN_SKIP_FAILURES, OGP_DOMAIN_SKIP_SECONDS)
+        # 次回のスキップ判定で最新の統計を読むように
+        self.domains.pop(domain)
+
+gnews_decode = GnewsDecodeCache()
+ogp = OgpCache()
+
+def _print_ogp_stats(limit: int):
+    stats = database.get_ogp_stats(limit)
+    cache = stats["cache"]
+    print(f"[Cache] OGPキャッシュ: {cache['entries']}件（画像あり {cache['with_image'] or 0}件 / 期限切れ {cache['expired'] or 0}件）")
+    print(f"{'domain':<32} {'試行':>5} {'成功率':>6} {'平均ms':>7} {'og':>4} {'tw':>4} {'img':>4} {'連続失敗':>6}  状態")
+    now = time.time()
+    for d in stats["domains"]:
+        rate = d["successes"] / d["attempts"] * 100 if d["attempts"] else 0
+        avg_ms = d["total_ms"] / d["attempts"] if d["attempts"] else 0
+        state = "skip" if (d["skip_until"] or 0) > now else ""
+        print(f"{d['domain'][:32]:<32} {d['attempts']:>5} {rate:>5.0f}% {avg_ms:>7.0f} "
+              f"{d['og_hits']:>4} {d['twitter_hits']:>4} {d['img_hits']:>4} {d['consecutive_failures']:>6}  {state}")
+
+if __name__ == "__main__":
+    import sys
+    database.init_db()
+    args = sys.argv[1:]
+    if args[:1] == ["ogp"] and len(args) > 1 and "://" in args[1]:
+        row = database.get_ogp_cached(url_hash(args[1]), 0)
+        print(f"[Cache] {args[1]}: {row if row else '(キャッシュなし)'}")
+    elif args[:1] == ["ogp"]:
+        _print_ogp_stats(int(args[1]) if len(args) > 1 else 30)
+    else:
+        print("usage: python caches.py ogp [件数 | URL]")
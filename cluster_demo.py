@@ -0,0 +1,232 @@
+"""
+cluster_demo.py — クラスタモード（crawler.py --cluster）のローカル動作確認
+Google News RSS の代わりにスタブHTTPサーバーを立て、一時DBに登録したターゲットを
+台数を変えた crawler.py --cluster で巡回させて次を表示する。
+- 全ターゲットを巡回し終えるまでの時間とターゲット/秒（台数に比例して伸びるか）
+- 同じクエリへのリクエストが重複していないか（同時に2台が同じターゲットを巡回していないか）
+- 最後に1台を強制終了し、残りの台がそのシャードを引き継いで巡回を終えられるか
+
+スタブへのレートはワーカープロセスごとに http_client の PUBLISHER_RATE で制限される（実運用の1台1IPに相当）。
+
+実行方法:
+  python cluster_demo.py [ターゲット数] [台数 ...]   例: python cluster_demo.py 40 1 2 4
+"""
+
+import os
+import sys
+import time
+import signal
+import shutil
+import tempfile
+import threading
+import subprocess
+import urllib.parse
+from collections import Counter
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+import database
+
+# スタブの応答遅延（秒）と1フィードあたりの記事数
+STUB_LATENCY = 0.2
+STUB_ITEMS = 3
+# 1回の巡回が終わるのを待つ上限（秒）
+RUN_TIMEOUT = 180
+
+# ワーカープロセスでは DB_PATH を一時DBに差し替えてから crawler.py を __main__ として実行する
+WORKER_CODE = """
+import sys, runpy
+sys.path.insert(0, {base!r})
+import database
+database.DB_PATH = {db!r}
+sys.argv = ["crawler.py", "--cluster"]
+runpy.run_path({crawler!r}, run_name="__main__")
+"""
+
+# ─── スタブHTTPサーバー ───────────────────────────────────────
+class StubNews:
+    """RSS検索と記事ページを返すスタブ。クエリごとのリクエスト数を数える"""
+
+    def __init__(self):
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.serial = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urllib.parse.urlsplit(self.path)
+                if parsed.path != "/rss/search":
+                    self.send_error(404)
+                    return
+                query = urllib.parse.parse_qs(parsed.query).get("q", [""])[0]
+                time.sleep(STUB_LATENCY)
+                body = stub.feed(query).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/rss+xml; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 強制終了したワーカーからのリクエスト
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def feed(self, query: str) -> str:
+        with self.lock:
+            self.requests[query] += 1
+            start, self.serial = self.serial, self.serial + STUB_ITEMS
+        items = []
+        for n in range(start, start + STUB_ITEMS):
+            items.append(
+                f"<item><title>{escape(query[:20])} 新作グッズ予約開始 #{n}</title>"
+                f"<link>{self.base_url}/article/{n}</link>"
+                f"<pubDate>{formatdate(usegmt=True)}</pubDate><source>Stub</source>"
+                f'<media:content url="{self.base_url}/img/{n}.jpg"/></item>'
+            )
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<rss xmlns:media="http://search.yahoo.com/mrss/"><channel>'
+                + "".join(items) + "</channel></rss>")
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+
+# ─── ワーカーの起動・停止 ─────────────────────────────────────
+def start_worker(name: str, stub: StubNews, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ,
+               CRAWLER_WORKER_ID=name,
+               GNEWS_RSS_URL=f"{stub.base_url}/rss/search",
+               CRAWL_INTERVAL="0",
+               CLUSTER_HEARTBEAT="0.5",
+               CLUSTER_LEASE_SECONDS="3",
+               TARGET_CLAIM_SECONDS="5",
+               CRAWLER_METRICS_PORT="0",
+               PYTHONUNBUFFERED="1")
+    code = WORKER_CODE.format(base=BASE_DIR, db=database.DB_PATH, crawler=os.path.join(BASE_DIR, "crawler.py"))
+    log = open(os.path.join(workdir, f"{name}.log"), "w")
+    return subprocess.Popen([sys.executable, "-c", code], env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def stop_workers(procs: list):
+    for p in procs:
+        if p.poll() is None:
+            p.send_signal(signal.SIGINT)
+    for p in procs:
+        try:
+            p.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+# ─── DB操作 ─────────────────────────────────────────────────
+def seed_targets(count: int):
+    def job(conn):
+        c = conn.cursor()
+        c.executemany("INSERT OR IGNORE INTO anime_targets (name_ja) VALUES (?)",
+                      [(f"デモ作品{i:03d}",) for i in range(count)])
+    database.run_write(job)
+
+def reset_schedule():
+    """全ターゲットをすぐ巡回対象に戻し、巡回回数を数え直す"""
+    def job(conn):
+        c = conn.cursor()
+        c.execute("UPDATE anime_targets SET next_due_at = 0, crawl_count = 0")
+    database.run_write(job)
+
+def crawled_counts() -> tuple:
+    """(巡回済みターゲット数, 2回以上巡回されたターゲット数)"""
+    conn = database.get_db_connection(readonly=True)
+    try:
+        c = conn.cursor()
+        c.execute("SELECT SUM(CASE WHEN crawl_count > 0 THEN 1 ELSE 0 END), "
+                  "SUM(CASE WHEN crawl_count > 1 THEN 1 ELSE 0 END) FROM anime_targets")
+        done, twice = c.fetchone()
+        return done or 0, twice or 0
+    finally:
+        conn.close()
+
+def wait_until_crawled(count: int, on_progress=None) -> float:
+    started = time.monotonic()
+    while time.monotonic() - started < RUN_TIMEOUT:
+        done, _ = crawled_counts()
+        if on_progress:
+            on_progress(done)
+        if done >= count:
+            break
+        time.sleep(0.2)
+    return time.monotonic() - started
+
+# ─── 計測 ──────────────────────────────────────────────────
+def run(stub: StubNews, workdir: str, targets: int, workers: int, kill_one: bool = False) -> dict:
+    reset_schedule()
+    stub.reset()
+    procs = [start_worker(f"demo-{workers}-{i}", stub, workdir) for i in range(workers)]
+    killed = []
+
+    def on_progress(done):
+        # 3分の1ほど巡回したところで1台を SIGKILL（離脱処理なし = ハートビート途絶）
+        if kill_one and not killed and done >= targets // 3:
+            procs[0].kill()
+            killed.append(procs[0].args)
+            print(f"   … {done}件巡回した時点で demo-{workers}-0 を強制終了")
+
+    try:
+        elapsed = wait_until_crawled(targets, on_progress)
+        done, twice = crawled_counts()
+        with stub.lock:
+            duplicated = sum(n - 1 for n in stub.requests.values() if n > 1)
+    finally:
+        stop_workers(procs)
+    return {"workers": workers, "done": done, "elapsed": elapsed, "twice": twice, "duplicated": duplicated}
+
+def print_result(r: dict):
+    rate = r["done"] / r["elapsed"] if r["elapsed"] else 0
+    print(f"  {r['workers']}台: {r['done']}ターゲット / {r['elapsed']:5.1f}秒 = {rate:5.2f}ターゲット/秒"
+          f"  （再巡回 {r['twice']}件, 重複リクエスト {r['duplicated']}件）")
+
+def main():
+    args = [int(a) for a in sys.argv[1:]]
+    targets = args[0] if args else 40
+    worker_counts = args[1:] or [1, 2, 4]
+
+    workdir = tempfile.mkdtemp(prefix="cluster_demo_")
+    database.DB_PATH = os.path.join(workdir, "demo.db")
+    database.init_db()
+    seed_targets(targets)
+    stub = StubNews()
+    stub.start()
+    print(f"[Demo] DB: {database.DB_PATH} / スタブ: {stub.base_url} / ターゲット {targets}件")
+
+    try:
+        print("[Demo] 台数ごとの巡回時間")
+        results = [run(stub, workdir, targets, n) for n in worker_counts]
+        for r in results:
+            print_result(r)
+        base = results[0]["done"] / results[0]["elapsed"] / results[0]["workers"]
+        for r in results[1:]:
+            speedup = r["done"] / r["elapsed"] / base
+            print(f"  {r['workers']}台: 1台換算で {speedup:.2f} 台分の処理速度")
+
+        workers = max(worker_counts[-1], 2)
+        print(f"[Demo] {workers}台で巡回中に1台が落ちた場合")
+        print_result(run(stub, workdir, targets, workers, kill_one=True))
+        print("  （落ちた台が巡回途中だったターゲットは TARGET_CLAIM_SECONDS 後に別の台が巡回し直すので、重複リクエストが数件出る）")
+    finally:
+        stub.server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -4,62 +4,136 @@ crawler.py — 無限サーチ常駐ワーカー
 Google News RSS等を用いてグッズ情報を収集しDBに登録し続ける。
 """
 
-import urllib.request
 import urllib.parse
 import xml.etree.ElementTree as ET
 import time
-import sqlite3
-import re
 import datetime
+import hashlib
+import unicodedata
 import os
 import sys
-try:
-    import requests as req_lib
-    HAS_REQUESTS = True
-except ImportError:
-    HAS_REQUESTS = False
-
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, BASE_DIR)
 import database
+import scheduler
 import filter as goods_filter
+import http_client
+import ogp
+import caches
+import metrics
+
+# 鮮度スコアの再計算間隔（秒）。区分の境目は日単位なので頻繁に回す必要はない
+RESCORE_INTERVAL = int(os.environ.get("RESCORE_INTERVAL", "3600"))
+# 検索キューのリース保持者ID（複数台で動かすときに区別できるよう環境変数で上書き可）
+WORKER_ID = os.environ.get("CRAWLER_WORKER_ID") or database.default_worker_id()
+# asyncio モードで同時に処理するターゲット数（HTTPの同時数は http_client 側でも制限される）
+ASYNC_WORKERS = int(os.environ.get("CRAWLER_ASYNC_WORKERS", "8"))
+# asyncio モードで1巡した後の待機秒数
+ROUND_INTERVAL = int(os.environ.get("CRAWLER_ROUND_INTERVAL", "60"))
+# 常駐モードで1件処理するごとの待機秒数（検索キューを処理した後は短め）
+CRAWL_INTERVAL = float(os.environ.get("CRAWL_INTERVAL", "15"))
+QUEUE_CRAWL_INTERVAL = float(os.environ.get("QUEUE_CRAWL_INTERVAL", "8"))
+# 例外が続いたときの待機秒数の上限（1回の失敗では通常の間隔のまま続ける）
+ERROR_BACKOFF_MAX = float(os.environ.get("CRAWL_ERROR_BACKOFF_MAX", "300"))
+# クラスタモードのハートビート間隔（database.CLUSTER_LEASE_SECONDS の1/3程度にする）
+CLUSTER_HEARTBEAT = float(os.environ.get("CLUSTER_HEARTBEAT", "15"))
+# /metrics を公開するポート（未設定・0 なら公開しない。Prometheus から取るときは 9108 など）と待ち受けアドレス。
+# 外部から取らせるときは CRAWLER_METRICS_HOST=0.0.0.0 と METRICS_TOKEN を両方設定する
+CRAWLER_METRICS_PORT = int(os.environ.get("CRAWLER_METRICS_PORT") or "0")
+CRAWLER_METRICS_HOST = os.environ.get("CRAWLER_METRICS_HOST", "127.0.0.1")
+# 新着の少ない作品をまとめて1回の RSS 検索で巡回するときの最大作品数（1 でまとめない）と、クエリ長の上限
+CRAWL_BATCH_MAX = int(os.environ.get("CRAWL_BATCH_MAX", "5"))
+GNEWS_QUERY_MAX_CHARS = int(os.environ.get("GNEWS_QUERY_MAX_CHARS", "256"))
+# まとめ検索の記事を作品に振り分けるときの別名の最短文字数（短い英語名などの誤一致を避ける）
+ALIAS_MIN_CHARS = 2
+# Google News RSS 検索のURL（動作確認用のスタブサーバーに向けるときに上書きする）
+GNEWS_RSS_URL = os.environ.get("GNEWS_RSS_URL", "https://news.google.com/rss/search")
+
+class FeedFetchError(RuntimeError):
+    """RSSを取得できなかった（再試行し尽くした 5xx・タイムアウト・接続失敗・XMLの解析失敗）。記事0件とは区別する"""
 
 def decode_google_news_url(gnews_url: str) -> str:
-    """Google Newsの間接URLを実際の記事URLにデコードする"""
+    """
+    Google Newsの間接URLを実際の記事URLにデコードする。
+    結果は caches.gnews_decode（メモリLRU＋DB）に記録し、同じ記事を二度デコードしない。
+    """
     if "news.google.com" not in gnews_url:
         return gnews_url
+    cached = caches.gnews_decode.get(gnews_url)
+    if cached is not caches.MISS:
+        # None は直近に失敗したURL（期限が切れるまで再試行しない）
+        metrics.GNEWS_DECODE.inc(result="hit" if cached else "negative")
+        return cached or gnews_url
+
+    metrics.GNEWS_DECODE.inc(result="miss")
+    try:
+        with metrics.stage("gnews_decode"):
+            decoded = _decode_google_news_url_uncached(gnews_url)
+    except http_client.CircuitOpenError:
+        # Google News に送れない間の結果は失敗として記録しない（回復後にデコードし直す）
+        return gnews_url
+    caches.gnews_decode.put(gnews_url, decoded if decoded != gnews_url else None)
+    return decoded
+
+
+def _decode_google_news_url_uncached(gnews_url: str) -> str:
     try:
         from googlenewsdecoder import new_decoderv1
-        decoded_res = new_decoderv1(gnews_url)
+        # デコーダ内部でも news.google.com へアクセスするのでレート制限の枠を共有する
+        with http_client.throttle(http_client.GNEWS_HOST):
+            decoded_res = new_decoderv1(gnews_url)
         if decoded_res.get("status") and decoded_res.get("decoded_url"):
             return decoded_res["decoded_url"]
     except Exception:
         pass
-    # フォールバック: requestsでリダイレクト先を追う
-    if HAS_REQUESTS:
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-            r = req_lib.get(gnews_url, headers=headers, timeout=8, allow_redirects=True)
-            if "news.google.com" not in r.url:
-                return r.url
-        except Exception:
-            pass
+    # フォールバック: リダイレクト先を追う
+    try:
+        r = http_client.get(gnews_url, timeout=8, allow_redirects=True)
+        if "news.google.com" not in r.url:
+            return r.url
+    except http_client.CircuitOpenError:
+        raise
+    except Exception:
+        pass
     return gnews_url
 
 
-def fetch_google_news(query: str) -> list:
-    """Google News RSS から指定キーワードのニュースを取得"""
+def fetch_google_news(query: str, enrich: bool = True, feed_state: dict = None) -> list:
+    """
+    Google News RSS から指定キーワードのニュースを取得。
+    enrich=False なら記事ページへのアクセス（画像取得）は行わず、RSSの内容だけを返す。
+    feed_state（database.get_feed_state の戻り値）を渡すと ETag/Last-Modified で条件付きリクエストを送り、
+    304 なら None を返す。feed_state の etag/last_modified は今回の応答の値に書き換える。
+    取得に失敗したら FeedFetchError（Google News への送信を止めている間は http_client.CircuitOpenError）を送出する。
+    空リストを返すのは 200 で記事が0件だったときだけ。
+    """
     encoded_query = urllib.parse.quote(query)
-    url = f"https://news.google.com/rss/search?q={encoded_query}&hl=ja&gl=JP&ceid=JP:ja"
-    req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+    url = f"{GNEWS_RSS_URL}?q={encoded_query}&hl=ja&gl=JP&ceid=JP:ja"
 
     # media名前空間の定義
     MEDIA_NS = "http://search.yahoo.com/mrss/"
 
+    headers = {}
+    if feed_state:
+        if feed_state.get("etag"):
+            headers["If-None-Match"] = feed_state["etag"]
+        if feed_state.get("last_modified"):
+            headers["If-Modified-Since"] = feed_state["last_modified"]
+
     results = []
     try:
-        with urllib.request.urlopen(req, timeout=10) as response:
-            xml_data = response.read()
+        with http_client.get(url, headers=headers, timeout=10) as response:
+            if feed_state is not None and response.status_code == 304:
+                return None
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}")
+            if feed_state is not None:
+                feed_state["etag"] = response.headers.get("ETag") or ""
+                feed_state["last_modified"] = response.headers.get("Last-Modified") or ""
+            xml_data = response.content
             ET.register_namespace('media', MEDIA_NS)
             root = ET.fromstring(xml_data)
             for item in root.findall('./channel/item'):
@@ -68,7 +142,9 @@ def fetch_google_news(query: str) -> list:
                 pubDate = item.find('pubDate').text if item.find('pubDate') is not None else ""
                 source = item.find('source').text if item.find('source') is not None else "Google News"
 
-                # dateをパース (RFC822形式)
+                # dateをパース (RFC822形式、Google News は GMT)。pubDate が無い・読めない記事は
+                # 取得時刻（GMTに揃えてUTC）で代用し、date_estimated を立てる（前回の最新日時の更新には使わない）
+                date_estimated = False
                 try:
                     parts = pubDate.split()
                     if len(parts) >= 4:
@@ -79,9 +155,11 @@ def fetch_google_news(query: str) -> list:
                         d = parts[1].zfill(2)
                         parsed_date = f"{y}-{m}-{d} {parts[4]}"
                     else:
-                        parsed_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        parsed_date = _utc_now_str()
+                        date_estimated = True
                 except:
-                    parsed_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    parsed_date = _utc_now_str()
+                    date_estimated = True
 
                 # --- 画像取得: RSSのmedia:contentを最優先 ---
                 rss_image = ""
@@ -106,14 +184,7 @@ def fetch_google_news(query: str) -> list:
                         if img and 'google' not in img.lower():
                             rss_image = img
 
-                # RSS画像がなければ実際の記事URLを取得してog:imageを探す
                 image_url = rss_image
-                if not image_url and link:
-                    # Google News URLをデコードして実際の記事URLを取得
-                    real_url = decode_google_news_url(link)
-                    # デコードできた場合のみ画像を取得（news.google.comのままならGEアイコンになるのでスキップ）
-                    if "news.google.com" not in real_url:
-                        image_url = fetch_ogp_image(real_url)
 
                 results.append({
                     "title": title,
@@ -122,202 +193,477 @@ def fetch_google_news(query: str) -> list:
                     "date": parsed_date,
                     "source_url": link,
                     "source_type": "Google",
-                    "image_url": image_url
+                    "image_url": image_url,
+                    "date_estimated": date_estimated,
                 })
+    except http_client.CircuitOpenError:
+        # Google News に送れない状態（連続失敗・Retry-After）は「0件」ではないので呼び出し側に伝える
+        raise
     except Exception as e:
+        # 失敗を0件として返すと「新着なし」と区別できない（巡回履歴・検索キューの再試行が狂う）
         print(f"[Crawler Error] RSS Fetch failed for '{query}': {e}")
+        raise FeedFetchError(f"RSS取得に失敗: {e}") from e
 
+    if enrich:
+        enrich_images(results)
     return results
 
 
+def _utc_now_str() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def feed_items_hash(items: list) -> str:
+    """フィードの記事リンク集合のハッシュ（並び順やビルド日時の違いは無視する）"""
+    links = sorted({item.get("source_url", "") for item in items})
+    return hashlib.sha1("\n".join(links).encode("utf-8")).hexdigest()
+
+
+def enrich_images(items: list) -> list:
+    """RSS画像がないアイテムについて、実際の記事URLを取得してog:imageを探す（1件あたりHTTP 2〜3回）"""
+    for item in items:
+        link = item.get("source_url", "")
+        if item.get("image_url") or not link:
+            continue
+        # Google News URLをデコードして実際の記事URLを取得
+        real_url = decode_google_news_url(link)
+        # デコードできた場合のみ画像を取得（news.google.comのままならGEアイコンになるのでスキップ）
+        if "news.google.com" not in real_url:
+            item["image_url"] = fetch_ogp_image(real_url)
+    return items
+
+
 def fetch_ogp_image(url: str) -> str:
     """指定URLのPageからOGP(og:image)タグの画像URLを取得する。
     フォールバック順: og:image → twitter:image → 記事内最初のimgタグ
+    ページは </head> まで（見つからなければ本文の <img> まで）しか読まない（ogp.py）
     """
-    # Google News / GoogleコメントのURLはスキップ（GEアイコンになるので必ず除外）
+    # Google Newsの中間URLは元記事URLにデコードする（キャッシュ共有）。
+    # デコードできなければスキップ（GEアイコンになるので必ず除外）
+    if url and "news.google.com" in url:
+        url = decode_google_news_url(url)
     if not url or "news.google.com" in url or url.lower().startswith("https://news.google"):
         return ""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
-        'Accept-Language': 'ja,en;q=0.9',
-    }
-    original_url = url
+
+    # 同じ記事は期限内なら再取得しない（画像なしの結果も覚えておく）
+    cached = caches.ogp.get(url)
+    if cached is not caches.MISS:
+        metrics.OGP_FETCH.inc(result="cache_hit")
+        return cached
+    # 連続して画像が取れないドメインはしばらく見送る
+    domain = http_client.host_of(url)
+    if caches.ogp.domain_skipped(domain):
+        metrics.OGP_FETCH.inc(result="skipped")
+        return ""
+
+    started = time.monotonic()
+    image_url, strategy, final_url = "", "", url
     try:
-        # Google Newsの中間URL(CBMi...)の場合は、本物の記事URLにデコードする
-        if "news.google.com" in url:
-            try:
-                from googlenewsdecoder import new_decoderv1
-                decoded_res = new_decoderv1(url)
-                if decoded_res.get("status") and decoded_res.get("decoded_url"):
-                    url = decoded_res["decoded_url"]
-            except Exception:
-                pass  # パッケージ無しやエラー時はそのままフォールバック
-
-        if HAS_REQUESTS:
-            r = req_lib.get(url, headers=headers, timeout=8, allow_redirects=True)
-            html = r.text
-            # 実際のリダイレクト先URLを取得（相対URL解決に使う）
-            final_url = r.url
+        with metrics.stage("ogp_fetch"):
+            result = ogp.fetch_ogp(url, timeout=8)
+        image_url, strategy, final_url = result["image_url"], result["strategy"], result["final_url"]
+        metrics.OGP_FETCH.inc(result=strategy or "none")
+    except http_client.CircuitOpenError:
+        # 配信元が落ちている間は送らずに済ませる（記事の失敗としては記録しない = 回復後に取り直す）
+        metrics.OGP_FETCH.inc(result="skipped")
+        return ""
+    except Exception:
+        # 画像取得失敗はサイレントにスキップ（失敗としてドメイン統計には記録する）
+        metrics.OGP_FETCH.inc(result="error")
+    caches.ogp.put(url, final_url, domain, image_url, strategy, (time.monotonic() - started) * 1000)
+    return image_url
+
+def claim_next_targets(shards=None) -> list:
+    """
+    巡回予定時刻を過ぎたターゲットを期限の早い順に1件確保する（無ければ空リスト）。
+    それが最近新着の少ない作品なら、同じく新着の少ない期限到来済みの作品を CRAWL_BATCH_MAX 件まで
+    追加で確保し、1回のまとめ検索で巡回する（どれをまとめるかは scheduler.is_batchable が決める）。
+    shards を渡すと担当シャードのターゲットだけから選ぶ（クラスタモード）。
+    """
+    targets = database.claim_due_targets(1, shards=shards)
+    if targets and CRAWL_BATCH_MAX > 1 and scheduler.is_batchable(targets[0]):
+        targets += database.claim_due_targets(CRAWL_BATCH_MAX - 1, shards=shards, batchable=True)
+    return targets
+
+SEARCH_KEYWORDS = "(グッズ OR コラボ OR 一番くじ OR カフェ OR ポップアップ OR 予約 OR アニメ OR フィギュア)"
+
+def build_search_query(titles: list) -> str:
+    """
+    検索クエリ構築: タイトルを含みつつ、グッズ・コラボ・アニメなどのいずれかが入っている記事を探す
+    Google Newsでは "AND" は不要（スペースでAND扱いされる）。また広く拾うために「アニメ」「フィギュア」も追加。
+    複数タイトルなら ("A" OR "B" ...) でまとめる。
+    """
+    if len(titles) == 1:
+        return f'"{titles[0]}" {SEARCH_KEYWORDS}'
+    return "(" + " OR ".join(f'"{t}"' for t in titles) + f") {SEARCH_KEYWORDS}"
+
+def pack_batches(targets: list) -> list:
+    """ターゲットを GNEWS_QUERY_MAX_CHARS に収まるまとめ検索の組に分ける（1件で超えるものは単独）"""
+    batches = []
+    for t in targets:
+        if batches and len(build_search_query([b["name_ja"] for b in batches[-1]] + [t["name_ja"]])) <= GNEWS_QUERY_MAX_CHARS:
+            batches[-1].append(t)
         else:
-            req_obj = urllib.request.Request(url, headers=headers)
-            with urllib.request.urlopen(req_obj, timeout=8) as resp:
-                html = resp.read().decode('utf-8', errors='ignore')
-                final_url = resp.url
+            batches.append([t])
+    return batches
 
-        # ベースURLを取得（相対URLの解決用）
-        try:
-            from urllib.parse import urlparse, urljoin
-            parsed = urlparse(final_url)
-            base_url = f"{parsed.scheme}://{parsed.netloc}"
-        except Exception:
-            base_url = ""
-
-        def normalize_img_url(img_url: str) -> str:
-            """画像URLを正規化（相対URLを絶対URLに変換）"""
-            img_url = img_url.strip()
-            if img_url.startswith('http'):
-                return img_url
-            elif img_url.startswith('//'):
-                return 'https:' + img_url
-            elif img_url.startswith('/') and base_url:
-                return base_url + img_url
-            return ""
-
-        # --- 1. og:image を試みる ---
-        match = re.search(
-            r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\'](.*?)["\']',
-            html, re.IGNORECASE
-        )
-        if not match:
-            match = re.search(
-                r'<meta[^>]+content=["\'](.*?)["\'][^>]+property=["\']og:image["\']',
-                html, re.IGNORECASE
-            )
-        if match:
-            img_url = normalize_img_url(match.group(1))
-            if img_url and "google.com" not in img_url:
-                return img_url
-
-        # --- 2. twitter:image を試みる ---
-        match = re.search(
-            r'<meta[^>]+name=["\']twitter:image["\'][^>]+content=["\'](.*?)["\']',
-            html, re.IGNORECASE
-        )
-        if not match:
-            match = re.search(
-                r'<meta[^>]+content=["\'](.*?)["\'][^>]+name=["\']twitter:image["\']',
-                html, re.IGNORECASE
-            )
-        if match:
-            img_url = normalize_img_url(match.group(1))
-            if img_url and "google.com" not in img_url:
-                return img_url
-
-        # --- 3. 記事本文内の最初の<img>タグを試みる ---
-        # Google広告・アイコン・1px用トラッキングピクセル等を除外するため
-        # src が http(s)で始まり、サイズが小さすぎないものを優先
-        img_matches = re.findall(
-            r'<img[^>]+src=["\']([^"\'<>]+)["\'][^>]*>',
-            html, re.IGNORECASE
-        )
-        for src in img_matches:
-            img_url = normalize_img_url(src)
-            if not img_url:
-                continue
-            # 除外条件: トラッキングピクセル・アイコン・google系を除く
-            lower = img_url.lower()
-            if any(skip in lower for skip in ['google', 'gstatic', 'doubleclick', 'adsystem',
-                                               'blank', 'spacer', 'pixel', '1x1', 'icon',
-                                               'favicon', 'logo', 'avatar', 'gravatar']):
-                continue
-            # 拡張子チェック（画像らしいURLを優先）
-            if any(lower.endswith(ext) for ext in ['.jpg', '.jpeg', '.png', '.webp', '.gif']):
-                return img_url
-            # 拡張子がなくても画像ホスティングサービスのURLはOK
-            if any(host in lower for host in ['images.', 'img.', 'cdn.', 'media.', 'assets.',
-                                               'photo', 'image', 'pics', 'static']):
-                return img_url
+def normalize_alias(text: str) -> str:
+    """別名照合用の正規化（NFKC で全角英数・半角カナを揃え、大文字小文字と空白の違いを無視する）"""
+    return "".join(unicodedata.normalize("NFKC", text or "").casefold().split())
 
-    except Exception:
-        pass  # 画像取得失敗はサイレントにスキップ
-    return ""
-
-def get_random_target():
-    """テーブルからランダム（または古い順等）に収集ターゲットを取得"""
-    conn = database.get_db_connection()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT name_ja FROM anime_targets WHERE enabled=1 ORDER BY RANDOM() LIMIT 1")
-    row = c.fetchone()
-    conn.close()
-    return row["name_ja"] if row else None
-
-def process_target(title: str):
-    """指定されたタイトルで検索し、フィルタ＆DB保存を行う"""
-    print(f"\n[Crawler] 🔍 対象: {title}")
-    
-    # 検索クエリ構築: タイトルを含みつつ、グッズ・コラボ・アニメなどのいずれかが入っている記事を探す
-    # Google Newsでは "AND" は不要（スペースでAND扱いされる）。また広く拾うために「アニメ」「フィギュア」も追加。
-    search_query = f'"{title}" (グッズ OR コラボ OR 一番くじ OR カフェ OR ポップアップ OR 予約 OR アニメ OR フィギュア)'
-    
-    raw_items = fetch_google_news(search_query)
+def target_aliases(target: dict) -> list:
+    """作品の照合用の別名（name_ja / name_en、短すぎて誤一致しやすいものは除く）"""
+    aliases = {normalize_alias(target.get(k)) for k in ("name_ja", "name_en")}
+    return [a for a in aliases if len(a) >= ALIAS_MIN_CHARS]
+
+def demux_items(items: list, targets: list) -> list:
+    """まとめ検索の各記事について、タイトル・本文に別名が含まれる作品名のリストを返す（items と同じ並び）"""
+    aliases = [(t["name_ja"], target_aliases(t)) for t in targets]
+    matched = []
+    for item in items:
+        text = normalize_alias(f"{item.get('title', '')} {item.get('content', '')}")
+        matched.append([name for name, names in aliases if any(a in text for a in names)])
+    return matched
+
+@metrics.stage("process_target")
+def process_batch(targets: list) -> dict:
+    """
+    ターゲット（name_ja / name_en を持つ dict）を1回のRSS検索で巡回し、フィルタ＆DB保存を行う。
+    複数作品のまとめ検索では、記事を別名の一致で作品ごとに振り分けて通知・新着件数の集計に使う
+    （どの作品とも一致しない記事も保存はする）。前回状態（feed_state）は単独検索のときだけ使う。
+    Returns: {"fetched": RSS取得件数, "saved": 新規保存件数, "per_title": {作品名: 新規保存件数}}
+    """
+    titles = [t["name_ja"] for t in targets]
+    batched = len(titles) > 1
+    print(f"\n[Crawler] 🔍 対象: {' / '.join(titles)}" + (f"（{len(titles)}作品まとめ検索）" if batched else ""))
+    search_query = build_search_query(titles)
+    per_title = dict.fromkeys(titles, 0)
+
+    def save_state():
+        if not batched:
+            database.save_feed_state(feed_state)
+
+    # 1. RSSを解析（記事ページにはまだアクセスしない）。前回から変わっていなければここで終わり
+    feed_state = database.get_feed_state(search_query) if not batched else \
+        {"feed_key": search_query, "etag": "", "last_modified": "", "items_hash": "", "newest_pubdate": ""}
+    with metrics.stage("rss_fetch"):
+        raw_items = fetch_google_news(search_query, enrich=False, feed_state=feed_state)
+    if raw_items is None:
+        print("   -> RSS変更なし（304）")
+        metrics.TARGETS.inc(result="not_modified")
+        save_state()
+        return {"fetched": 0, "saved": 0, "per_title": per_title}
     print(f"   -> RSS結果: {len(raw_items)} 件")
+    metrics.ITEMS.inc(len(raw_items), result="fetched")
     
     if not raw_items:
-        return
-        
-    filtered = goods_filter.filter_items(raw_items)
+        metrics.TARGETS.inc(result="empty")
+        return {"fetched": 0, "saved": 0, "per_title": per_title}
+
+    items_hash = feed_items_hash(raw_items)
+    if items_hash == feed_state["items_hash"]:
+        print("   -> RSS変更なし（記事リンクが前回と同一）")
+        metrics.TARGETS.inc(result="unchanged")
+        save_state()
+        return {"fetched": len(raw_items), "saved": 0, "per_title": per_title}
+
+    # 前回見た最新の公開日時より古い記事は処理済みとみなす（同時刻は念のため通す）。
+    # 公開日時を取得時刻で代用した記事は最新日時の更新に使わず、絞り込みでも落とさない
+    watermark = feed_state["newest_pubdate"] or ""
+    feed_state["items_hash"] = items_hash
+    feed_state["newest_pubdate"] = max([watermark] + [i["date"] for i in raw_items if not i.get("date_estimated")])
+    candidates = [i for i in raw_items if i.get("date_estimated") or i["date"] >= watermark]
+    if len(candidates) < len(raw_items):
+        print(f"   -> 前回以降の記事: {len(candidates)} 件")
+
+    # 2. 保存済みの記事を url_hash の一括照会で除外（再巡回ではほとんどがここで落ちる）
+    with metrics.stage("known_lookup"):
+        new_raw = database.filter_unknown_items(candidates)
+    print(f"   -> 未保存: {len(new_raw)} 件")
+    metrics.ITEMS.inc(len(raw_items) - len(new_raw), result="known")
+    if not new_raw:
+        metrics.TARGETS.inc(result="no_new")
+        save_state()
+        return {"fetched": len(raw_items), "saved": 0, "per_title": per_title}
+
+    # 3. フィルタ → 4. 通過したものだけ画像を取得
+    with metrics.stage("filter"):
+        filtered = goods_filter.filter_items(new_raw)
     print(f"   -> フィルタ通過: {len(filtered)} 件")
+    metrics.ITEMS.inc(len(new_raw) - len(filtered), result="filtered_out")
+    with metrics.stage("enrich_images"):
+        enrich_images(filtered)
     
     from scorer import score_item
     
-    saved = 0
-    for item in filtered:
-        # スコアリング
-        scored_item = score_item(dict(item))
-        # DB保存
-        if database.insert_item(scored_item):
-            saved += 1
-            # 新規保存時：お気に入りユーザーへ通知フックを発火
-            database.notify_favorited_users(title, scored_item)
-            
-    print(f"   -> DB新規保存: {saved} 件")
+    # スコアリングしてから1トランザクションでまとめてDB保存
+    # お気に入りユーザーへの通知は同じトランザクションでアウトボックスに積む（送信は notifier.py）
+    scored_items = [score_item(dict(item)) for item in filtered]
+    matched = demux_items(scored_items, targets) if batched else [titles] * len(scored_items)
+    with metrics.stage("db_insert"):
+        new_items = database.insert_items(scored_items, notify_titles=matched)
+    # 保存まで終わってから状態を進める（途中で落ちたら次回もう一度処理する）
+    save_state()
+
+    print(f"   -> DB新規保存: {len(new_items)} 件")
+    for item, names in zip(scored_items, matched):
+        if "id" in item:
+            for name in names:
+                per_title[name] += 1
+    if batched:
+        unmatched = sum(1 for item, names in zip(scored_items, matched) if "id" in item and not names)
+        print(f"   -> 作品別: {per_title}" + (f"（作品名の一致なし {unmatched} 件）" if unmatched else ""))
+    metrics.ITEMS.inc(len(new_items), result="saved")
+    metrics.ITEMS.inc(len(scored_items) - len(new_items), result="duplicate")
+    metrics.TARGETS.inc(len(titles), result="crawled")
+    return {"fetched": len(raw_items), "saved": len(new_items), "per_title": per_title}
+
+def process_target(title: str) -> dict:
+    """
+    指定されたタイトルで検索し、フィルタ＆DB保存を行う。
+    Returns: {"fetched": RSS取得件数, "saved": 新規保存件数, "per_title": {title: 新規保存件数}}
+    """
+    return process_batch([{"name_ja": title}])
+
+def process_queued(query: str) -> dict:
+    """検索キューから確保したクエリを処理し、結果をキューに記録する"""
+    print(f"\n[Queue Priority] 🚨 ユーザー検索: {query}")
+    try:
+        result = process_target(query)
+    except http_client.CircuitOpenError as e:
+        # Google News に送っていないので試行回数には数えず、送信を再開できる頃に回す
+        database.defer_queue(query, str(e), max(e.remaining, 1), WORKER_ID)
+        raise
+    except Exception as e:
+        # RSS取得の失敗（FeedFetchError）を含めて再試行に回す（上限を超えたら dead）。
+        # 中断・クラッシュ時はリース切れで回収される
+        database.mark_queue_failed(query, str(e), WORKER_ID)
+        raise
+    database.mark_queue_done(query, WORKER_ID)
+    return result
+
+def crawl_targets(targets: list) -> dict:
+    """
+    確保したターゲットを巡回し（複数ならクエリ長の上限に収まる組ごとにまとめ検索）、
+    作品ごとの新規件数から次回の巡回予定を決める。
+    RSSを取得できなかったら未巡回のターゲットを scheduler.retry_interval() 後に回して例外を送出する。
+    """
+    total = {"fetched": 0, "saved": 0}
+    batches = pack_batches(targets)
+    for i, batch in enumerate(batches):
+        try:
+            result = process_batch(batch)
+        except (FeedFetchError, http_client.CircuitOpenError):
+            # 取得できなかった巡回は「新着0件」として記録しない（障害で間隔が伸びないように）。
+            # 残りの組も同じ Google News 宛てなので送らずに、まとめて少し後に巡回し直す
+            names = [t["name_ja"] for b in batches[i:] for t in b]
+            due = database.defer_targets(names, scheduler.retry_interval())
+            print(f"   -> 取得失敗: {len(names)}作品を {datetime.datetime.fromtimestamp(due).strftime('%H:%M')} に再巡回")
+            raise
+        total["fetched"] += result["fetched"]
+        total["saved"] += result["saved"]
+        for name, saved in result["per_title"].items():
+            due = database.record_target_crawl(name, saved)
+            if due:
+                print(f"   -> 次回巡回 {name}: {datetime.datetime.fromtimestamp(due).strftime('%m/%d %H:%M')}")
+    return total
+
+# ─── クラスタモード ──────────────────────────────────────────
+class ClusterMembership:
+    """
+    クラスタへの参加と担当シャードの保持。ハートビートは別スレッドで送るので、
+    1件の巡回に時間がかかってもリースが切れない。
+    """
+
+    def __init__(self, worker_id: str, interval: float = CLUSTER_HEARTBEAT):
+        self.worker_id = worker_id
+        self.interval = interval
+        self.shards = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def heartbeat(self):
+        shards = database.cluster_heartbeat(self.worker_id)
+        with self.lock:
+            if shards != self.shards:
+                print(f"[Cluster] {self.worker_id}: 担当シャード {len(shards)}個 {shards}")
+            self.shards = shards
+
+    def current_shards(self) -> list:
+        with self.lock:
+            return list(self.shards)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"[Cluster Exception] {e}")
+
+    def start(self):
+        self.heartbeat()
+        self.thread = threading.Thread(target=self._run, name="cluster-heartbeat", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        database.cluster_leave(self.worker_id)
+        print(f"[Cluster] {self.worker_id}: クラスタから離脱")
 
-def run_crawler():
+def run_crawler(membership: ClusterMembership = None):
+    """
+    常駐クローラ。membership を渡すとクラスタモードになり、担当シャードのターゲットだけを巡回する
+    （ターゲット単位の確保もあるので、シャードの引き継ぎ中でも同じターゲットを2台が同時に巡回することはない）。
+    """
     print("="*60)
-    print(" 🚀 無限サーチ（常駐クローラ）起動")
+    print(" 🚀 無限サーチ（常駐クローラ）起動" + (f"（クラスタモード: {membership.worker_id}）" if membership else ""))
     print("="*60)
+    last_rescore = 0.0
+    error_streak = 0
     
     while True:
         try:
+            # 0. 鮮度区分の境目を越えた行だけスコアを更新（/api/items はDBの値をそのまま返す）
+            #    クラスタモードではシャード0の担当ワーカーだけが行う
+            owns_rescore = membership is None or 0 in membership.current_shards()
+            if owns_rescore and time.time() - last_rescore >= RESCORE_INTERVAL:
+                database.rescore_stale()
+                last_rescore = time.time()
+
             # 1. まず優先検索キューをチェック
-            queued_query = database.get_next_from_queue()
+            queued_query = database.get_next_from_queue(WORKER_ID)
             if queued_query:
-                print(f"\n[Queue Priority] 🚨 ユーザー検索: {queued_query}")
-                process_target(queued_query)
-                database.mark_queue_done(queued_query)
+                process_queued(queued_query)
             else:
-                # 2. キューが空なら既存ターゲットからランダムで巡回
-                target = get_random_target()
-                if target:
-                    process_target(target)
+                # 2. キューが空なら巡回予定時刻を過ぎたターゲットを期限の早い順に巡回
+                targets = claim_next_targets(membership.current_shards() if membership else None)
+                if targets:
+                    crawl_targets(targets)
                 else:
-                    print("[Crawler] ターゲットがいません。10秒待機...")
+                    print("[Crawler] 巡回予定のターゲットがありません。待機...")
             
+            error_streak = 0
             # APIやRSSのレート制限を避けるためスリープ（キュー処理後は少し短め）
-            time.sleep(8 if queued_query else 15)
+            time.sleep(QUEUE_CRAWL_INTERVAL if queued_query else CRAWL_INTERVAL)
             
         except KeyboardInterrupt:
             print("\n[Crawler] 終了します。")
             break
         except Exception as e:
+            # HTTPの失敗は http_client がホスト単位で再試行・遮断しているので、ここでは全体を止めない。
+            # DB障害などで例外が続くときだけ間隔を倍々に伸ばす
             print(f"\n[Crawler Exception] {e}")
-            time.sleep(30)
+            metrics.TARGETS.inc(result="error")
+            error_streak += 1
+            time.sleep(min(ERROR_BACKOFF_MAX, CRAWL_INTERVAL * 2 ** (error_streak - 1)))
+
+# ─── asyncio モード ──────────────────────────────────────────
+class CrawlStats:
+    """処理件数の集計（複数ワーカースレッドから更新される）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.targets = 0
+        self.fetched = 0
+        self.saved = 0
+        self.errors = 0
+
+    def add(self, result: dict = None, error: bool = False):
+        with self.lock:
+            self.targets += 1
+            if error:
+                self.errors += 1
+            elif result:
+                self.fetched += result["fetched"]
+                self.saved += result["saved"]
+
+    def report(self, label: str = ""):
+        minutes = max(time.monotonic() - self.started, 1e-6) / 60
+        with self.lock:
+            per_request = self.saved / self.targets if self.targets else 0
+            print(f"[Crawler] {label}{self.targets}ターゲット / {minutes * 60:.1f}秒: "
+                  f"取得 {self.fetched / minutes:.1f}件/分, 新規保存 {self.saved / minutes:.1f}件/分, "
+                  f"ターゲット {self.targets / minutes:.1f}件/分, 新規 {per_request:.2f}件/リクエスト, "
+                  f"エラー {self.errors}件")
+
+async def _crawl_worker(stats: CrawlStats):
+    """
+    1ワーカー分のループ。ユーザー検索キューを優先し、無ければ巡回予定時刻を過ぎたターゲットを1件確保する。
+    process_target はブロッキング処理なのでスレッドで実行する（同時数はワーカー数で決まる）。
+    """
+    while True:
+        queued = await asyncio.to_thread(database.get_next_from_queue, WORKER_ID)
+        if queued:
+            job = (process_queued, queued)
+        else:
+            targets = await asyncio.to_thread(claim_next_targets)
+            if not targets:
+                return
+            job = (crawl_targets, targets)
+        try:
+            stats.add(await asyncio.to_thread(*job))
+        except Exception as e:
+            print(f"\n[Crawler Exception] {job[1]}: {e}")
+            metrics.TARGETS.inc(result="error")
+            stats.add(error=True)
+
+async def crawl_round(workers: int = ASYNC_WORKERS) -> CrawlStats:
+    """巡回予定時刻を過ぎたターゲットが無くなるまで workers 並列で巡回する"""
+    stats = CrawlStats()
+    await asyncio.gather(*(_crawl_worker(stats) for _ in range(workers)))
+    return stats
+
+async def run_crawler_async(workers: int = ASYNC_WORKERS, once: bool = False):
+    print("="*60)
+    print(f" 🚀 無限サーチ（asyncio モード, {workers}並列）起動")
+    print("="*60)
+    # to_thread の実行スレッド数をワーカー数に合わせる
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=workers + 2, thread_name_prefix="crawl"))
+    total = CrawlStats()
+    while True:
+        await asyncio.to_thread(database.rescore_stale)
+        stats = await crawl_round(workers)
+        with total.lock:
+            total.targets += stats.targets
+            total.fetched += stats.fetched
+            total.saved += stats.saved
+            total.errors += stats.errors
+        stats.report("1巡: ")
+        total.report("累計: ")
+        if once:
+            break
+        await asyncio.sleep(ROUND_INTERVAL)
 
 if __name__ == "__main__":
     # goods_infoのDBセットアップ
     database.init_db()
+    # SQLite使用時は書き込みを専用スレッドに集約（gunicorn側の読み込みを待たせない）
+    database.start_sqlite_writer()
     
     # Python実行時のエンコーディングエラー回避
     sys.stdout.reconfigure(encoding='utf-8')
-    run_crawler()
+    # 処理段階ごとの時間・件数を Prometheus 形式で公開
+    database.register_metric_gauges()
+    if CRAWLER_METRICS_PORT:
+        metrics.start_http_server(CRAWLER_METRICS_PORT, host=CRAWLER_METRICS_HOST)
+    if "--async" in sys.argv:
+        # python crawler.py --async [--once]  … 期限の来たターゲットを並列に巡回（件数/分を表示）
+        try:
+            asyncio.run(run_crawler_async(once="--once" in sys.argv))
+        except KeyboardInterrupt:
+            print("\n[Crawler] 終了します。")
+    elif "--cluster" in sys.argv:
+        # python crawler.py --cluster  … 複数台で動かすとき。シャードをリースして担当分だけ巡回する
+        membership = ClusterMembership(WORKER_ID)
+        membership.start()
+        try:
+            run_crawler(membership)
+        finally:
+            membership.stop()
+    else:
+        run_crawler()
@@ -1,39 +1,77 @@
 import sqlite3
+import base64
 import csv
+import io
+import json
 import os
+import queue
+import threading
+import time
+import warnings
+from concurrent.futures import Future
 from datetime import datetime
+from functools import lru_cache
+
+from urlnorm import canonicalize_url, url_hash
+import scorer
+import scheduler
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "goods_info.db")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# ─── 接続プール設定 ──────────────────────────────────────────
+# gunicornワーカー1つあたりの最大接続数。DBの max_connections / ワーカー数 を目安に調整する
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+# 全接続が使用中の場合に空きを待つ秒数
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# この秒数以上アイドルだった接続は貸し出し前に SELECT 1 で生存確認する
+DB_POOL_CHECK_INTERVAL = float(os.getenv("DB_POOL_CHECK_INTERVAL", "30"))
+# この秒数を超えて使われた接続は作り直す（サーバ側のアイドル切断・メモリ肥大対策）
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+
+# ─── SQL変換キャッシュ / プリペアドステートメント ─────────────
+# 変換後SQLを保持する件数（クエリ文字列の種類数より十分大きければよい）
+SQL_CACHE_SIZE = int(os.getenv("SQL_CACHE_SIZE", "512"))
+# 同じ接続で同じSQLがこの回数実行されたらサーバー側プリペアドステートメントにする。
+# "none" で無効化（PgBouncerのトランザクションプーリング配下など）
+_prepare_threshold = os.getenv("DB_PREPARE_THRESHOLD", "3").strip().lower()
+DB_PREPARE_THRESHOLD = None if _prepare_threshold in ("", "none") else int(_prepare_threshold)
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def to_postgres_sql(query: str) -> str:
+    """SQLite文法からPostgreSQL文法への簡易変換（クエリ文字列ごとにキャッシュ）"""
+    query = query.replace("?", "%s")
+    query = query.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "SERIAL PRIMARY KEY")
+    query = query.replace("datetime('now','localtime')", "CURRENT_TIMESTAMP")
+    query = query.replace("INSERT OR IGNORE", "INSERT")
+    return query
+
+@lru_cache(maxsize=SQL_CACHE_SIZE)
+def _postgres_sql_returning_id(query: str) -> str:
+    query = to_postgres_sql(query)
+    if " RETURNING " not in query.upper():
+        query += " RETURNING id"
+    return query
+
 class DBCursorWrapper:
     def __init__(self, cursor, is_postgres):
         self.cursor = cursor
         self.is_postgres = is_postgres
         self.lastrowid = None
         
-    def execute(self, query, params=None):
+    def execute(self, query, params=None, return_id=False, prepare=None):
+        """
+        SQLite文法のSQLを実行する。
+        return_id=True のときだけ PostgreSQL で RETURNING id を付けて lastrowid を埋める。
+        prepare=True でPostgreSQLのプリペアドステートメントを即座に使う（None は閾値に従う）。
+        """
         if self.is_postgres:
-            # SQLite文法からPostgreSQL文法への簡易変換
-            query = query.replace("?", "%s")
-            query = query.replace("INTEGER PRIMARY KEY AUTOINCREMENT", "SERIAL PRIMARY KEY")
-            query = query.replace("datetime('now','localtime')", "CURRENT_TIMESTAMP")
-            query = query.replace("INSERT OR IGNORE", "INSERT")
-            
-            is_insert = query.strip().upper().startswith("INSERT")
-            if is_insert and " RETURNING " not in query.upper():
-                query += " RETURNING id"
-                
-            if params:
-                self.cursor.execute(query, params)
+            if return_id:
+                self.cursor.execute(_postgres_sql_returning_id(query), params or None, prepare=prepare)
+                row = self.cursor.fetchone()
+                self.lastrowid = row["id"] if row else None
             else:
-                self.cursor.execute(query)
-                
-            if is_insert and "RETURNING id" in query:
-                try:
-                    self.lastrowid = self.cursor.fetchone()[0]
-                except Exception:
-                    pass
+                self.cursor.execute(to_postgres_sql(query), params or None, prepare=prepare)
         else:
             if params is not None:
                 self.cursor.execute(query, params)
@@ -41,16 +79,36 @@ class DBCursorWrapper:
                 self.cursor.execute(query)
             self.lastrowid = getattr(self.cursor, 'lastrowid', None)
 
+    def executemany(self, query, seq_of_params, returning=False):
+        """
+        複数パラメータで同じ文を実行する。
+        PostgreSQLでは returning=True でパイプライン実行し、各行の RETURNING を nextset() で読める。
+        """
+        if self.is_postgres:
+            query = to_postgres_sql(query)
+            self.cursor.executemany(query, seq_of_params, returning=returning)
+        else:
+            self.cursor.executemany(query, seq_of_params)
+
+    def nextset(self):
+        return self.cursor.nextset()
+
     def fetchone(self):
         return self.cursor.fetchone()
 
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
     def fetchall(self):
         return self.cursor.fetchall()
 
 class DBConnectionWrapper:
-    def __init__(self, conn, is_postgres):
+    def __init__(self, conn, is_postgres, release=None):
         self.conn = conn
         self.is_postgres = is_postgres
+        # プール管理下の接続は close() で実際には閉じずにプールへ返却する
+        self._release = release
+        self._closed = False
 
     @property
     def row_factory(self):
@@ -72,27 +130,425 @@ class DBConnectionWrapper:
             
     def commit(self):
         self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
         
     def close(self):
-        self.conn.close()
+        if self._closed:
+            return
+        self._closed = True
+        if self._release is not None:
+            self._release(self.conn)
+        else:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        # ここで返却はしない（GCはどのスレッドでも走るので、スレッドごとのSQLite接続を別スレッドから触ってしまう）。
+        # 呼び出し側は必ず close() するか with で使う
+        if not getattr(self, "_closed", True):
+            warnings.warn("DB接続が close() されずに破棄されました（プールの枠が返却されません）",
+                          ResourceWarning, stacklevel=2)
+
+# ─── 接続プール ──────────────────────────────────────────────
+class PoolTimeout(Exception):
+    """DB_POOL_TIMEOUT 秒待っても空き接続が得られなかった"""
+
+
+class _PoolEntry:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """
+    PostgreSQL接続プール。
+    - 上限 max_size 本まで接続を作り、使い終わった接続はLIFOで再利用する
+    - 一定時間アイドルだった接続は貸し出し前に SELECT 1 で生存確認する
+    - gunicornのpre-fork後は親プロセスの接続を共有しないよう、PID変化を検知して作り直す
+    """
+
+    def __init__(self, connect, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 check_interval=DB_POOL_CHECK_INTERVAL, max_lifetime=DB_POOL_MAX_LIFETIME):
+        self._connect = connect
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.max_lifetime = max_lifetime
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._in_use = 0
+        self._stats = {
+            "created": 0, "reused": 0, "discarded": 0,
+            "health_check_failures": 0, "waits": 0, "timeouts": 0,
+        }
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # fork前の接続はソケットを親と共有しているので close() せずに参照だけ捨てる
+            self._reset()
+
+    def _is_healthy(self, entry) -> bool:
+        conn = entry.conn
+        if conn.closed or getattr(conn, "broken", False):
+            return False
+        now = time.monotonic()
+        if now - entry.created_at > self.max_lifetime:
+            return False
+        if now - entry.last_used > self.check_interval:
+            try:
+                conn.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                return False
+        return True
+
+    def _discard(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._stats["discarded"] += 1
+
+    def _release_slot(self):
+        with self._cond:
+            self._in_use -= 1
+            self._cond.notify()
+
+    def acquire(self):
+        """接続を1本借りる。空きがなければ timeout 秒まで待つ"""
+        self._check_fork()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            entry = None
+            with self._cond:
+                waited = False
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"{self.max_size}本の接続がすべて使用中です（{self.timeout}秒待機）")
+                    if not waited:
+                        self._stats["waits"] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+                if self._idle:
+                    entry = self._idle.pop()
+                self._in_use += 1
+
+            if entry is None:
+                try:
+                    entry = _PoolEntry(self._connect())
+                except Exception:
+                    self._release_slot()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+                return entry
+
+            # ヘルスチェック（ネットワーク往復があるのでロック外で行う）
+            if self._is_healthy(entry):
+                with self._cond:
+                    self._stats["reused"] += 1
+                return entry
+            self._discard(entry)
+            self._release_slot()
+
+    def release(self, entry):
+        """借りた接続を返却する。未確定のトランザクションはロールバックしてから戻す"""
+        if self._pid != os.getpid():
+            return  # fork前に借りた接続はこのプロセスのプールに戻さない
+        conn = entry.conn
+        reusable = not conn.closed and not getattr(conn, "broken", False)
+        if reusable:
+            try:
+                from psycopg.pq import TransactionStatus
+                if conn.info.transaction_status != TransactionStatus.IDLE:
+                    conn.rollback()
+            except Exception:
+                reusable = False
+        if not reusable:
+            self._discard(entry)
+            self._release_slot()
+            return
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._in_use -= 1
+            self._cond.notify()
+
+    def close_all(self):
+        """アイドル中の接続をすべて閉じる（シャットダウン用）"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self) -> dict:
+        self._check_fork()
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+            })
+        return stats
+
+
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
 
-def get_db_connection():
+def _pg_connect(autocommit=False):
+    import psycopg
+    from urllib.parse import urlparse, unquote
+    url = urlparse(DATABASE_URL)
+    conn = psycopg.connect(
+        host=url.hostname,
+        port=url.port or 5432,
+        dbname=url.path.lstrip('/'),
+        user=url.username,
+        password=unquote(url.password or ''),
+        sslmode='require',
+        autocommit=autocommit
+    )
+    conn.prepare_threshold = DB_PREPARE_THRESHOLD
+    return conn
+
+def _get_pg_pool() -> ConnectionPool:
+    global _pg_pool
+    if _pg_pool is None:
+        with _pg_pool_lock:
+            if _pg_pool is None:
+                _pg_pool = ConnectionPool(_pg_connect)
+    return _pg_pool
+
+# ─── SQLite運用モード ────────────────────────────────────────
+# クローラ（書き込み）とgunicorn（読み込み）が同じDBファイルを使うため、
+# WALにして読み込みが書き込みを待たないようにする
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")   # WALではNORMALでも破損しない
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+def _sqlite_connect(readonly=False):
+    """PRAGMAを設定済みのSQLite接続を作る。readonly=True なら読み取り専用で開く"""
+    timeout = SQLITE_BUSY_TIMEOUT_MS / 1000
+    if readonly and os.path.exists(DB_PATH):
+        from urllib.request import pathname2url
+        conn = sqlite3.connect(f"file:{pathname2url(DB_PATH)}?mode=ro", uri=True, timeout=timeout)
+    else:
+        readonly = False
+        conn = sqlite3.connect(DB_PATH, timeout=timeout)
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    if not readonly:
+        conn.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+# SQLiteはスレッドごとに（読み書き用・読み取り専用それぞれ）1本の接続を使い回す
+# （sqlite3の接続はスレッド間で共有できないため）
+_sqlite_local = threading.local()
+_sqlite_stats = {"created": 0, "reused": 0, "nested": 0}
+_sqlite_stats_lock = threading.Lock()
+
+def _count_sqlite(key):
+    with _sqlite_stats_lock:
+        _sqlite_stats[key] += 1
+
+def _release_sqlite(conn, readonly):
+    if conn.in_transaction:
+        conn.rollback()
+    conn.row_factory = None
+    _sqlite_local.in_use.discard(readonly)
+
+def _get_sqlite_connection(readonly=False):
+    local = _sqlite_local
+    if getattr(local, "pid", None) != os.getpid() or getattr(local, "path", None) != DB_PATH:
+        local.pid = os.getpid()
+        local.path = DB_PATH
+        local.conns = {}
+        local.in_use = set()
+    if readonly in local.in_use:
+        # 同一スレッド内で入れ子に取得された場合は、外側のトランザクションを
+        # 巻き込まないよう使い捨ての接続を返す
+        _count_sqlite("nested")
+        return DBConnectionWrapper(_sqlite_connect(readonly), False)
+    conn = local.conns.get(readonly)
+    if conn is None:
+        conn = local.conns[readonly] = _sqlite_connect(readonly)
+        _count_sqlite("created")
+    else:
+        _count_sqlite("reused")
+    local.in_use.add(readonly)
+    return DBConnectionWrapper(conn, False, release=lambda c: _release_sqlite(c, readonly))
+
+def get_db_connection(readonly=False):
+    """
+    プールから接続を借りる。呼び出し側は try/finally で必ず close() するか with で使う
+    （実際には閉じずにプールへ返却される。close() し忘れた接続は返却されない）。
+    readonly=True はSQLiteで読み取り専用接続を使う（WAL下では書き込み中でも待たされない）。
+    """
     if DATABASE_URL:
-        import psycopg
-        from urllib.parse import urlparse, unquote
-        url = urlparse(DATABASE_URL)
-        conn = psycopg.connect(
-            host=url.hostname,
-            port=url.port or 5432,
-            dbname=url.path.lstrip('/'),
-            user=url.username,
-            password=unquote(url.password or ''),
-            sslmode='require'
-        )
-        return DBConnectionWrapper(conn, True)
+        pool = _get_pg_pool()
+        entry = pool.acquire()
+        return DBConnectionWrapper(entry.conn, True, release=lambda _conn: pool.release(entry))
     else:
-        conn = sqlite3.connect(DB_PATH)
-        return DBConnectionWrapper(conn, False)
+        return _get_sqlite_connection(readonly)
+
+# ─── SQLite書き込みスレッド ──────────────────────────────────
+class SQLiteWriter:
+    """
+    SQLiteへの書き込みを専用スレッド1本に直列化する。
+    キューに溜まった書き込みは最大 max_batch 件まで1トランザクションにまとめてコミットする。
+    各ジョブは SAVEPOINT で区切るので、1件の失敗が同じバッチの他のジョブを巻き込まない。
+    """
+
+    def __init__(self, max_batch=100):
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self.batches = 0
+        self.jobs = 0
+
+    def start(self):
+        if self.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, fn) -> Future:
+        """fn(conn) を書き込みスレッドで実行する。コミット後に結果が Future に入る"""
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def _run(self):
+        conn = DBConnectionWrapper(_sqlite_connect(), False)
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._run_batch(conn, batch)
+        conn.close()
+
+    def _run_batch(self, conn, batch):
+        outcomes = []
+        try:
+            conn.conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                conn.conn.execute("SAVEPOINT writer_job")
+                try:
+                    outcomes.append((future, fn(conn), None))
+                    conn.conn.execute("RELEASE SAVEPOINT writer_job")
+                except Exception as e:
+                    conn.conn.execute("ROLLBACK TO SAVEPOINT writer_job")
+                    conn.conn.execute("RELEASE SAVEPOINT writer_job")
+                    outcomes.append((future, None, e))
+                finally:
+                    # ジョブが設定した row_factory を次のジョブに持ち越さない（プールへの返却時と同じ状態に戻す）
+                    conn.row_factory = None
+            conn.commit()
+        except Exception as e:
+            if conn.conn.in_transaction:
+                conn.rollback()
+            outcomes = [(future, None, e) for _, future in batch]
+        self.batches += 1
+        self.jobs += len(batch)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+_sqlite_writer = None
+
+def start_sqlite_writer() -> bool:
+    """SQLite使用時に書き込みスレッドを起動する（クローラ等の書き込み主体のプロセス用）"""
+    global _sqlite_writer
+    if DATABASE_URL:
+        return False
+    if _sqlite_writer is None:
+        _sqlite_writer = SQLiteWriter()
+    _sqlite_writer.start()
+    return True
+
+def stop_sqlite_writer():
+    if _sqlite_writer is not None:
+        _sqlite_writer.stop()
+
+def run_write(fn):
+    """
+    書き込み処理 fn(conn) を1トランザクションで実行してコミットし、戻り値を返す。
+    SQLite書き込みスレッドが起動していればそちらに直列化して実行する。
+    """
+    if not DATABASE_URL and _sqlite_writer is not None and _sqlite_writer.is_alive():
+        return _sqlite_writer.submit(fn).result()
+    conn = get_db_connection()
+    try:
+        result = fn(conn)
+        conn.commit()
+        return result
+    finally:
+        conn.close()
+
+def get_pool_stats() -> dict:
+    """接続プールの統計（プールサイズ調整用。/metrics では db_pool として出力する）"""
+    if DATABASE_URL:
+        stats = _get_pg_pool().stats()
+        stats["backend"] = "postgresql"
+        return stats
+    with _sqlite_stats_lock:
+        stats = dict(_sqlite_stats)
+    stats["backend"] = "sqlite"
+    stats["journal_mode"] = SQLITE_JOURNAL_MODE
+    if _sqlite_writer is not None:
+        stats["writer_alive"] = _sqlite_writer.is_alive()
+        stats["writer_queue"] = _sqlite_writer.queue_size()
+        stats["writer_batches"] = _sqlite_writer.batches
+        stats["writer_jobs"] = _sqlite_writer.jobs
+    return stats
 
 def get_integrity_error():
     if DATABASE_URL:
@@ -102,160 +558,192 @@ def get_integrity_error():
         return sqlite3.IntegrityError
 
 def init_db():
-    """データベースの初期化（テーブル作成）"""
-    if DATABASE_URL:
-        # PostgreSQLの場合：autocommit=TrueでDDLを直接実行（トランザクション中断を防ぐ）
-        import psycopg
-        from urllib.parse import urlparse, unquote
-        url = urlparse(DATABASE_URL)
-        conn = psycopg.connect(
-            host=url.hostname,
-            port=url.port or 5432,
-            dbname=url.path.lstrip('/'),
-            user=url.username,
-            password=unquote(url.password or ''),
-            sslmode='require',
-            autocommit=True
-        )
-        cur = conn.cursor()
-        tables = [
-            '''CREATE TABLE IF NOT EXISTS goods_info (
-                id SERIAL PRIMARY KEY,
-                title TEXT, content TEXT, author TEXT, source_url TEXT,
-                source_type TEXT, category TEXT, date TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                freshness_score INTEGER DEFAULT 0, rarity_score INTEGER DEFAULT 0,
-                reliability_score INTEGER DEFAULT 0, total_score INTEGER DEFAULT 0,
-                priority_level TEXT DEFAULT '', image_url TEXT DEFAULT ''
-            )''',
-            '''CREATE TABLE IF NOT EXISTS search_queue (
-                id SERIAL PRIMARY KEY,
-                query TEXT UNIQUE, status TEXT DEFAULT 'pending',
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )''',
-            '''CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                email TEXT UNIQUE, password_hash TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )''',
-            '''CREATE TABLE IF NOT EXISTS favorites (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER, anime_title TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, anime_title)
-            )''',
-            '''CREATE TABLE IF NOT EXISTS push_subscriptions (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER, subscription_json TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, subscription_json)
-            )''',
-            '''CREATE TABLE IF NOT EXISTS anime_targets (
-                id SERIAL PRIMARY KEY,
-                name_ja TEXT UNIQUE, name_en TEXT, genre TEXT, reason TEXT
-            )''',
-        ]
-        for sql in tables:
-            cur.execute(sql)
-        # image_urlカラム追加（既存テーブルへの移行）
-        try:
-            cur.execute("ALTER TABLE goods_info ADD COLUMN image_url TEXT DEFAULT ''")
-        except Exception:
-            pass  # 既にある場合は無視
-        conn.close()
-    else:
-        # SQLiteの場合：従来の処理
-        conn = get_db_connection()
+    """データベースの初期化（未適用のスキーマ・マイグレーションを適用する。最新なら何もしない）"""
+    import migrations
+    migrations.migrate()
+    # スコア未保存の行（スコア列の追加前から残っている行）があれば埋める。無ければ索引を1回引くだけ
+    if _has_unscored():
+        backfill_scores()
+    print("[DB] 初期化完了")
+
+def _has_unscored() -> bool:
+    conn = get_db_connection(readonly=True)
+    try:
         c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS goods_info (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT, content TEXT, author TEXT, source_url TEXT,
-                source_type TEXT, category TEXT, date TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                freshness_score INTEGER DEFAULT 0, rarity_score INTEGER DEFAULT 0,
-                reliability_score INTEGER DEFAULT 0, total_score INTEGER DEFAULT 0,
-                priority_level TEXT DEFAULT '', image_url TEXT DEFAULT ''
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS search_queue (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                query TEXT UNIQUE, status TEXT DEFAULT 'pending',
-                created_at TEXT DEFAULT (datetime('now','localtime'))
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT UNIQUE, password_hash TEXT,
-                created_at TEXT DEFAULT (datetime('now','localtime'))
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS favorites (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER, anime_title TEXT,
-                created_at TEXT DEFAULT (datetime('now','localtime')),
-                UNIQUE(user_id, anime_title)
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS push_subscriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER, subscription_json TEXT,
-                created_at TEXT DEFAULT (datetime('now','localtime')),
-                UNIQUE(user_id, subscription_json)
-            )
-        ''')
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS anime_targets (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name_ja TEXT UNIQUE, name_en TEXT, genre TEXT, reason TEXT
-            )
-        ''')
-        try:
-            c.execute("ALTER TABLE goods_info ADD COLUMN image_url TEXT DEFAULT ''")
-        except Exception:
-            pass
-        conn.commit()
+        c.execute("SELECT 1 FROM goods_info WHERE freshness_due IS NULL LIMIT 1")
+        return c.fetchone() is not None
+    finally:
         conn.close()
-    print("[DB] 初期化完了")
 
-def insert_item(item: dict) -> bool:
+_GOODS_INSERT_SQL = """
+    INSERT INTO goods_info (date, title, content, author, source_url, source_type, category, created_at, image_url, url_hash,
+                            freshness_score, rarity_score, reliability_score, total_score, priority_level, freshness_due)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(url_hash) DO NOTHING
+"""
+
+def _url_key(source_url) -> str:
+    """重複判定キー（正規化URLのハッシュ）。URLの無いアイテムは None にして、一意インデックスで衝突させない"""
+    return url_hash(source_url) if canonicalize_url(source_url or "") else None
+
+def _goods_row(item: dict, created_at: str) -> tuple:
+    # スコア未計算のアイテムはここで付与して、スコア列ごと保存する
+    if "total_score" not in item or "freshness_due" not in item:
+        scorer.score_item(item)
+    return (
+        item.get("date") or "",   # NULL はキーセットページングの行値比較から漏れるので空文字にする
+        item.get("title", ""),
+        item.get("content", ""),
+        item.get("author", ""),
+        item.get("source_url", ""),
+        item.get("source_type", ""),
+        item.get("category", ""),
+        created_at,
+        item.get("image_url", ""),
+        _url_key(item.get("source_url")),
+        item["freshness_score"],
+        item["rarity_score"],
+        item["reliability_score"],
+        item["total_score"],
+        item["priority_level"],
+        item["freshness_due"],
+    )
+
+def _insert_goods_rows(conn, rows: list) -> list:
     """
-    1件挿入。重複URL の場合は無視して False を返す。
-    item keys: date, title, content, author, source_url, source_type, category
+    goods_info へ複数行を挿入し、各行の新規ID（重複で無視された行は None）を返す。
+    コミットは呼び出し側で行う。
     """
-    conn = get_db_connection()
     c = conn.cursor()
+    ids = []
+    if conn.is_postgres:
+        # executemany(returning=True) はパイプラインで送信されるので往復は1回で済む
+        c.executemany(_GOODS_INSERT_SQL + " RETURNING id", rows, returning=True)
+        while True:
+            row = c.fetchone()
+            ids.append(row["id"] if row else None)
+            if not c.nextset():
+                break
+    else:
+        # SQLiteはプロセス内実行なので1トランザクション内の逐次実行で十分速い。
+        # rowcount で行ごとに新規/重複を判定できるよう executemany は使わない
+        for row in rows:
+            c.execute(_GOODS_INSERT_SQL, row)
+            ids.append(c.lastrowid if c.cursor.rowcount == 1 else None)
+    _bump_facet_counts(c, [row for row, new_id in zip(rows, ids) if new_id is not None])
+    return ids
+
+# ─── ファセット集計（/api/titles, /api/categories） ─────────────
+# facet名 -> goods_info の列（_goods_row のタプル位置）
+FACETS = {"title": 1, "category": 6}
+
+_FACET_UPSERT_SQL = """
+    INSERT INTO facet_counts (facet, value, item_count) VALUES (?, ?, ?)
+    ON CONFLICT(facet, value) DO UPDATE SET item_count = facet_counts.item_count + excluded.item_count
+"""
+
+def _bump_facet_counts(c, new_rows: list):
+    """新規に挿入された行の分だけ facet_counts を加算する（挿入と同じトランザクション内で呼ぶ）"""
+    counts = {}
+    for row in new_rows:
+        for facet, pos in FACETS.items():
+            key = (facet, row[pos] or "")
+            counts[key] = counts.get(key, 0) + 1
+    if counts:
+        c.executemany(_FACET_UPSERT_SQL, [(f, v, n) for (f, v), n in sorted(counts.items())])
+
+def rebuild_facet_counts(c):
+    """facet_counts を goods_info から作り直す（マイグレーション・重複圧縮の後に呼ぶ）"""
+    c.execute("DELETE FROM facet_counts")
+    for facet in FACETS:
+        c.execute(f"""
+            INSERT INTO facet_counts (facet, value, item_count)
+            SELECT ?, COALESCE({facet}, ''), COUNT(*) FROM goods_info GROUP BY COALESCE({facet}, '')
+        """, (facet,))
+
+def get_facet_counts(facet: str) -> list:
+    """ファセットの値ごとの件数 [{"value": ..., "count": ...}]（値の昇順）"""
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
     try:
+        c = conn.cursor()
         c.execute("""
-            INSERT INTO goods_info (date, title, content, author, source_url, source_type, category, created_at, image_url)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            item.get("date", ""),
-            item.get("title", ""),
-            item.get("content", ""),
-            item.get("author", ""),
-            item.get("source_url", ""),
-            item.get("source_type", ""),
-            item.get("category", ""),
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            item.get("image_url", "")
-        ))
-        conn.commit()
-        return True
-    except get_integrity_error():
-        return False  # 重複URL
+            SELECT value, item_count FROM facet_counts
+            WHERE facet = ? AND item_count > 0 ORDER BY value
+        """, (facet,), prepare=True)
+        return [{"value": r["value"], "count": r["item_count"]} for r in c.fetchall()]
     finally:
         conn.close()
 
-def get_all_items(title_filter=None, source_filter=None, category_filter=None) -> list:
-    """全件取得。フィルタ引数が指定されていれば絞り込む。"""
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row if getattr(conn, 'is_postgres', False) is False else None
-    c = conn.cursor()
+def insert_items(items: list, notify_title: str = None, notify_titles: list = None) -> list:
+    """
+    複数件を1トランザクションでまとめて挿入する。
+    正規化URLのハッシュが既存行と一致するものは ON CONFLICT DO NOTHING で読み飛ばす。
+    notify_title を渡すと、その作品をお気に入り登録しているユーザー宛ての通知を
+    同じトランザクションで notification_outbox に積む（送信は notifier.py が行う）。
+    notify_titles（items と同じ並びの作品名リストのリスト）なら記事ごとに通知先の作品を変える（まとめ検索用）。
+    Returns: 新規に保存されたアイテムのリスト（各要素に "id" を付与）。重複で無視されたものは含まない。
+    """
+    if not items:
+        return []
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = [_goods_row(item, created_at) for item in items]
+
+    def job(conn):
+        ids = _insert_goods_rows(conn, rows)
+        if notify_title:
+            _enqueue_notifications(conn.cursor(), notify_title, [i for i in ids if i is not None], created_at)
+        if notify_titles:
+            by_title = {}
+            for new_id, titles in zip(ids, notify_titles):
+                if new_id is not None:
+                    for t in titles:
+                        by_title.setdefault(t, []).append(new_id)
+            for t, t_ids in by_title.items():
+                _enqueue_notifications(conn.cursor(), t, t_ids, created_at)
+        return ids
+    ids = run_write(job)
+
+    saved = []
+    for item, new_id in zip(items, ids):
+        if new_id is not None:
+            item["id"] = new_id
+            saved.append(item)
+    return saved
+
+def get_known_url_hashes(hashes: list) -> set:
+    """渡した url_hash のうち goods_info に保存済みのものを返す（一意インデックスへの IN 照会）"""
+    hashes = list(dict.fromkeys(h for h in hashes if h))
+    known = set()
+    if not hashes:
+        return known
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        for i in range(0, len(hashes), EXPORT_CHUNK_SIZE):
+            chunk = hashes[i:i + EXPORT_CHUNK_SIZE]
+            c.execute(f"SELECT url_hash FROM goods_info WHERE url_hash IN ({','.join('?' * len(chunk))})", chunk)
+            known.update(r["url_hash"] for r in c.fetchall())
+    finally:
+        conn.close()
+    return known
+
+def filter_unknown_items(items: list) -> list:
+    """source_url（正規化後）がまだ保存されていないアイテムだけを返す"""
+    hashes = [_url_key(item.get("source_url")) for item in items]
+    known = get_known_url_hashes(hashes)
+    return [item for item, h in zip(items, hashes) if h not in known]
+
+def insert_item(item: dict) -> bool:
+    """
+    1件挿入。重複URL（正規化後のURLハッシュが一致）の場合は無視して False を返す。
+    item keys: date, title, content, author, source_url, source_type, category
+    """
+    return bool(insert_items([item]))
+
+def _items_query(title_filter=None, source_filter=None, category_filter=None):
+    """一覧系クエリの SELECT とフィルタ条件を組み立てる"""
     query = "SELECT * FROM goods_info WHERE 1=1"
     params = []
     if title_filter:
@@ -267,88 +755,998 @@ def get_all_items(title_filter=None, source_filter=None, category_filter=None) -
     if category_filter:
         query += " AND category = ?"
         params.append(category_filter)
-    query += " ORDER BY date DESC, created_at DESC"
-    c.execute(query, params)
-    rows = [dict(r) for r in c.fetchall()]
-    conn.close()
-    return rows
+    return query, params
+
+def get_all_items(title_filter=None, source_filter=None, category_filter=None) -> list:
+    """全件取得。フィルタ引数が指定されていれば絞り込む。"""
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row if getattr(conn, 'is_postgres', False) is False else None
+    try:
+        c = conn.cursor()
+        query, params = _items_query(title_filter, source_filter, category_filter)
+        query += " ORDER BY date DESC, created_at DESC"
+        c.execute(query, params)
+        return [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
+
+# ─── キーセットページング ──────────────────────────────────
+ITEMS_PAGE_DEFAULT = 50
+ITEMS_PAGE_MAX = 200
+
+# sort -> ページングキー（すべて降順）。id は同値時のタイブレーク
+_PAGE_KEYS = {
+    "date":  ("date", "created_at", "id"),
+    "score": ("total_score", "date", "created_at", "id"),
+}
+
+class InvalidCursor(ValueError):
+    """next_cursor として発行した形式ではないカーソルが渡された"""
+
+def _encode_cursor(row, keys) -> str:
+    payload = json.dumps([row[k] for k in keys], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str, keys) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except Exception:
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(keys) \
+            or not all(v is None or isinstance(v, (str, int, float)) for v in values):
+        raise InvalidCursor(cursor)
+    return values
+
+def get_items_page(title_filter=None, source_filter=None, category_filter=None,
+                   sort="date", limit=None, cursor=None):
+    """
+    一覧を1ページ分取得する（キーセットページング）。
+    Returns: (items, next_cursor)  次ページが無ければ next_cursor は None
+    """
+    keys = _PAGE_KEYS.get(sort, _PAGE_KEYS["date"])
+    limit = min(max(int(limit or ITEMS_PAGE_DEFAULT), 1), ITEMS_PAGE_MAX)
+
+    query, params = _items_query(title_filter, source_filter, category_filter)
+    if cursor:
+        values = _decode_cursor(cursor, keys)
+        query += f" AND ({', '.join(keys)}) < ({', '.join('?' * len(keys))})"
+        params.extend(values)
+    query += " ORDER BY " + ", ".join(f"{k} DESC" for k in keys)
+    query += " LIMIT ?"
+    params.append(limit + 1)  # 1件多く取って次ページの有無を判定する
+
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute(query, params, prepare=True)
+        rows = [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1], keys)
+    return rows, next_cursor
+
+# ─── 優先度上位（/api/urgent） ────────────────────────────────
+URGENT_SCORE_DEFAULT = 55   # scorer.compute_priority_level の「高」以上
+
+def get_urgent_items(limit=None, threshold=URGENT_SCORE_DEFAULT) -> list:
+    """
+    total_score が threshold 以上のアイテムを高い順に最大 limit 件返す。
+    保存済みスコアは idx_goods_info_score を逆順に引いて上位 limit 件で打ち切るので、
+    テーブルが大きくなっても応答時間はほぼ一定。
+    スコア未保存の行は init_db() が起動時に backfill_scores() で埋めるので、ここでは読まない。
+    """
+    limit = min(max(int(limit or ITEMS_PAGE_DEFAULT), 1), ITEMS_PAGE_MAX)
+    keys = _PAGE_KEYS["score"]
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute(f"""
+            SELECT * FROM goods_info
+            WHERE total_score >= ? AND freshness_due IS NOT NULL
+            ORDER BY {', '.join(f'{k} DESC' for k in keys)}
+            LIMIT ?
+        """, (threshold, limit), prepare=True)
+        return [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
+
+# ─── 全文検索 ──────────────────────────────────────────────
+# PostgreSQLの pg_trgm インデックス対象式（migrations.m005 と検索クエリで同じ式を使うこと）
+PG_SEARCH_EXPR = "coalesce(title, '') || ' ' || coalesce(content, '') || ' ' || coalesce(author, '')"
+# trigramインデックスで引ける最小文字数（これより短い語は LIKE で絞り込む）
+TRIGRAM_MIN_CHARS = 3
+
+def _like_pattern(term: str) -> str:
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def _sqlite_has_fts(c) -> bool:
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'goods_fts'")
+    return c.fetchone() is not None
+
+def _pg_has_trgm(c) -> bool:
+    c.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    return c.fetchone() is not None
+
+def _keyset_predicate(order: list) -> str:
+    """
+    order（[(列, "ASC"/"DESC")]）の並びでカーソル行より後ろの行を選ぶ条件。
+    昇順と降順が混ざるので行値比較ではなく (a > ?) OR (a = ? AND b < ?) ... と展開する。
+    パラメータはカーソルの値を _keyset_params で並べたもの。
+    """
+    clauses = []
+    for i, (col, direction) in enumerate(order):
+        op = ">" if direction == "ASC" else "<"
+        clauses.append("(" + " AND ".join([f"{c} = ?" for c, _ in order[:i]] + [f"{col} {op} ?"]) + ")")
+    return "(" + " OR ".join(clauses) + ")"
+
+def _keyset_params(values: list) -> list:
+    params = []
+    for i in range(len(values)):
+        params.extend(values[:i + 1])
+    return params
+
+def search_items(q: str, limit=None, cursor=None):
+    """
+    title/content/author の全文検索（空白区切りの語はすべて含むものを AND 検索）。
+    SQLiteは FTS5 trigram + bm25 で、PostgreSQLは pg_trgm の word_similarity で関連度順に並べる。
+    ページングはキーセット（カーソルは最後の行の (関連度, date, id)）なので、深いページでも遅くならず、
+    ページの間に行が追加されても結果がずれない。
+    Returns: (items, next_cursor)
+    """
+    terms = [t for t in (q or "").split() if t]
+    if not terms:
+        return [], None
+    limit = min(max(int(limit or ITEMS_PAGE_DEFAULT), 1), ITEMS_PAGE_MAX)
+
+    long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN_CHARS]
+    short_terms = [t for t in terms if len(t) < TRIGRAM_MIN_CHARS]
+
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        params = []
+        if conn.is_postgres:
+            query = "SELECT g.*"
+            if _pg_has_trgm(c):
+                query += f", word_similarity(?, {PG_SEARCH_EXPR}) AS search_rank"
+                params.append(" ".join(terms))
+                order = [("search_rank", "DESC"), ("date", "DESC"), ("id", "DESC")]
+            else:
+                order = [("date", "DESC"), ("id", "DESC")]
+            query += " FROM goods_info g WHERE 1=1"
+            for t in terms:
+                # ILIKE '%語%' は3文字以上なら pg_trgm の GIN インデックスで引ける
+                query += f" AND ({PG_SEARCH_EXPR}) ILIKE ? ESCAPE '\\'"
+                params.append(_like_pattern(t))
+        elif long_terms and _sqlite_has_fts(c):
+            match = " AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms)
+            query = ("SELECT g.*, bm25(goods_fts, 10.0, 2.0, 1.0) AS search_rank"
+                     " FROM goods_fts JOIN goods_info g ON g.id = goods_fts.rowid"
+                     " WHERE goods_fts MATCH ?")
+            params.append(match)
+            # bm25 は小さいほど関連度が高い
+            order = [("search_rank", "ASC"), ("date", "DESC"), ("id", "DESC")]
+            terms = short_terms  # 残りの短い語は LIKE で絞り込む
+            for t in terms:
+                query += " AND (g.title LIKE ? ESCAPE '\\' OR g.content LIKE ? ESCAPE '\\' OR g.author LIKE ? ESCAPE '\\')"
+                params.extend([_like_pattern(t)] * 3)
+        else:
+            query = "SELECT g.* FROM goods_info g WHERE 1=1"
+            order = [("date", "DESC"), ("id", "DESC")]
+            for t in terms:
+                query += " AND (g.title LIKE ? ESCAPE '\\' OR g.content LIKE ? ESCAPE '\\' OR g.author LIKE ? ESCAPE '\\')"
+                params.extend([_like_pattern(t)] * 3)
+
+        keys = [col for col, _ in order]
+        # 関連度は計算列なので、検索結果を副問い合わせにしてから列名でキーセット条件を掛ける
+        query = f"SELECT * FROM ({query}) s WHERE 1=1"
+        if cursor:
+            values = _decode_cursor(cursor, keys)
+            query += " AND " + _keyset_predicate(order)
+            params.extend(_keyset_params(values))
+        query += " ORDER BY " + ", ".join(f"{col} {direction}" for col, direction in order) + " LIMIT ?"
+        params.append(limit + 1)
+        c.execute(query, params)
+        rows = [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1], keys)
+    for r in rows:
+        r.pop("search_rank", None)
+    return rows, next_cursor
+
+# ─── CSVエクスポート（ストリーミング） ──────────────────────
+EXPORT_CHUNK_SIZE = 500
+
+def iter_items(title_filter=None, source_filter=None, category_filter=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    一覧と同じ並び順で全件を少しずつ返すジェネレータ（全件をメモリに載せない）。
+    PostgreSQLはサーバーサイド（名前付き）カーソル、SQLiteは fetchmany で chunk_size 件ずつ読む。
+    """
+    query, params = _items_query(title_filter, source_filter, category_filter)
+    query += " ORDER BY date DESC, created_at DESC, id DESC"
+    conn = get_db_connection(readonly=True)
+    try:
+        if conn.is_postgres:
+            from psycopg.rows import dict_row
+            cur = conn.conn.cursor(name=f"export_{os.getpid()}_{threading.get_ident()}", row_factory=dict_row)
+            cur.itersize = chunk_size
+            cur.execute(to_postgres_sql(query), params)
+        else:
+            conn.row_factory = sqlite3.Row
+            cur = conn.conn.cursor()
+            cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            for r in rows:
+                yield dict(r)
+        cur.close()
+    finally:
+        conn.close()
+
+def iter_csv(title_filter=None, source_filter=None, category_filter=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    CSV（UTF-8 BOM付き）を chunk_size 行ずつの bytes として返すジェネレータ。
+    データが0件なら何も返さない。
+    """
+    buf = io.StringIO()
+    writer = None
+    pending = 0
+    for item in iter_items(title_filter, source_filter, category_filter, chunk_size):
+        if writer is None:
+            buf.write("\ufeff")  # Excelで文字化けしないようBOMを付ける
+            writer = csv.DictWriter(buf, fieldnames=list(item.keys()))
+            writer.writeheader()
+        writer.writerow(item)
+        pending += 1
+        if pending >= chunk_size:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
 
 def export_csv(filepath: str = None):
     """全データをCSVエクスポート"""
     if filepath is None:
         filepath = os.path.join(os.path.dirname(__file__), "export.csv")
-    items = get_all_items()
-    if not items:
+    written = 0
+    with open(filepath, "wb") as f:
+        for chunk in iter_csv():
+            f.write(chunk)
+            written += 1
+    if not written:
+        os.remove(filepath)
         print("[DB] エクスポートするデータがありません")
         return
-    with open(filepath, "w", newline="", encoding="utf-8-sig") as f:
-        writer = csv.DictWriter(f, fieldnames=items[0].keys())
-        writer.writeheader()
-        writer.writerows(items)
-    print(f"[DB] CSVをエクスポートしました: {filepath} ({len(items)}件)")
+    print(f"[DB] CSVをエクスポートしました: {filepath}")
 
-# ─── 通知（モック）機能 ──────────────────────────────────────────
-def notify_favorited_users(query_title: str, item: dict):
+# ─── 重複行の圧縮 ──────────────────────────────────────────
+def compact_goods_urls(c, batch_size: int = 500) -> dict:
     """
-    お気に入り登録しているユーザーを検索し、新着情報のプッシュ/メール通知をシミュレーション（ログ出力）する
+    url_hash 導入前に溜まった重複行を1件にまとめ、全行の url_hash を埋める（migrations.m015 と compact コマンド）。
+    同じ正規化URLの行のうち最も古い id を残し、残す行に画像がなければ重複側の画像を引き継ぐ。
+    URLの無い行は url_hash を NULL にして、まとめずに残す。コミットは呼び出し側で行う。
     """
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''
-        SELECT u.email FROM favorites f
-        JOIN users u ON f.user_id = u.id
-        WHERE f.anime_title = ?
-    ''', (query_title,))
-    users = c.fetchall()
-    conn.close()
-    
-    if users:
-        print(f"\n[Notification Hook] 🌟 『{query_title}』のお気に入りユーザー({len(users)}名)に通知を送信します！")
-        for u in users:
-            email = u[0]
-            print(f"   📧 [Web Push & Email Sent to {email}]")
-            print(f"      To: {email}")
-            print(f"      Subject: 『{query_title}』の新しいグッズ情報が届きました！")
-            print(f"      Message: {item.get('title')}")
-            # ※ここで実際のWeb Push API（pywebpush等）やSendGrid APIを叩く想定
+    sqlite_row_factory = None if c.is_postgres else c.cursor.row_factory
+    if not c.is_postgres:
+        c.cursor.row_factory = sqlite3.Row
+    try:
+        c.execute("SELECT id, source_url, url_hash, image_url FROM goods_info ORDER BY id")
+        keepers = {}      # hash -> [id, 現在のurl_hash, image_url, 画像を引き継ぐか]
+        duplicate_ids = []
+        unlinked_ids = []  # URLが無いのに url_hash が入っている行
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                h = _url_key(row["source_url"])
+                if h is None:
+                    if row["url_hash"] is not None:
+                        unlinked_ids.append(row["id"])
+                    continue
+                keeper = keepers.get(h)
+                if keeper is None:
+                    keepers[h] = [row["id"], row["url_hash"], row["image_url"] or "", False]
+                    continue
+                duplicate_ids.append(row["id"])
+                if not keeper[2] and row["image_url"]:
+                    keeper[2] = row["image_url"]
+                    keeper[3] = True
+    finally:
+        if not c.is_postgres:
+            c.cursor.row_factory = sqlite_row_factory
 
-# ─── 検索キュー機能 ──────────────────────────────────────────
-def add_to_search_queue(query: str):
-    conn = get_db_connection()
-    c = conn.cursor()
+    for i in range(0, len(duplicate_ids), batch_size):
+        chunk = duplicate_ids[i:i + batch_size]
+        c.execute(f"DELETE FROM goods_info WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
+    stale = [(h, k[0]) for h, k in keepers.items() if k[1] != h]
+    # 一意インデックスの一時的な衝突を避けるため、いったん NULL にしてから振り直す
+    cleared = [(k_id,) for _, k_id in stale] + [(i,) for i in unlinked_ids]
+    if cleared:
+        c.executemany("UPDATE goods_info SET url_hash = NULL WHERE id = ?", cleared)
+    if stale:
+        c.executemany("UPDATE goods_info SET url_hash = ? WHERE id = ?", stale)
+    images = [(k[2], k[0]) for k in keepers.values() if k[3]]
+    if images:
+        c.executemany("UPDATE goods_info SET image_url = ? WHERE id = ?", images)
+    if duplicate_ids:
+        rebuild_facet_counts(c)
+
+    result = {"kept": len(keepers), "deleted": len(duplicate_ids), "rehashed": len(stale) + len(unlinked_ids)}
+    print(f"[DB] 重複圧縮: {result['deleted']}件削除 / {result['kept']}件保持 / url_hash更新 {result['rehashed']}件")
+    return result
+
+def compact_duplicates(batch_size: int = 500) -> dict:
+    """compact_goods_urls を1トランザクションで実行する（マイグレーション後に手動で取り込んだ行の整理用）"""
+    return run_write(lambda conn: compact_goods_urls(conn.cursor(), batch_size))
+
+# ─── スコアの一括付与・再計算 ─────────────────────────────────
+_SCORE_COLUMNS = ("freshness_score", "rarity_score", "reliability_score", "total_score", "priority_level", "freshness_due")
+_RESCORE_UPDATE_SQL = f"UPDATE goods_info SET {', '.join(f'{k} = ?' for k in _SCORE_COLUMNS)} WHERE id = ?"
+
+def _rescore_batch(where: str, params: tuple, batch_size: int) -> int:
+    """where に合う行を最大 batch_size 件スコアリングし直して保存する。更新件数を返す。"""
+    def job(conn):
+        conn.row_factory = sqlite3.Row
+        c = conn.cursor()
+        c.execute(f"""
+            SELECT id, date, content, author, source_url, source_type FROM goods_info
+            WHERE {where} LIMIT ?
+        """, (*params, batch_size))
+        updates = []
+        for r in c.fetchall():
+            item = {k: (r[k] or "") for k in ("date", "content", "author", "source_url", "source_type")}
+            scorer.score_item(item)
+            updates.append(tuple(item[k] for k in _SCORE_COLUMNS) + (r["id"],))
+        if updates:
+            c.executemany(_RESCORE_UPDATE_SQL, updates)
+        return len(updates)
+    return run_write(job)
+
+def backfill_scores(batch_size: int = 500) -> int:
+    """
+    スコア未保存（freshness_due が NULL）の既存行にスコアを付与する（一回限りの移行用）。
+    バッチごとにコミットするので、途中で止めても再実行すれば続きから埋まる。
+    """
+    total = 0
+    while True:
+        n = _rescore_batch("freshness_due IS NULL", (), batch_size)
+        total += n
+        if n < batch_size:
+            break
+    print(f"[DB] スコア一括付与: {total}件")
+    return total
+
+def rescore_stale(batch_size: int = 500) -> int:
+    """
+    新しさの区分（7/30/90/180日）の境目を越えた行だけを再スコアする。
+    freshness_due にインデックスがあるので、対象が無ければ索引を1回引くだけで終わる。
+    再スコアした行の freshness_due は必ず今日より後になるため、同じ条件で引き直せば次のバッチになる。
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    total = 0
+    while True:
+        n = _rescore_batch("freshness_due <= ?", (today,), batch_size)
+        total += n
+        if n < batch_size:
+            break
+    if total:
+        print(f"[DB] 鮮度スコア再計算: {total}件")
+    return total
+
+# ─── Google News URL デコードキャッシュ ─────────────────────────
+def get_gnews_decoded(key: str):
+    """デコード結果 {"decoded_url", "checked_at"}（未記録なら None）。key は url_hash(gnews_url)"""
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
     try:
-        c.execute("INSERT INTO search_queue (query, status) VALUES (?, 'pending')", (query,))
-        conn.commit()
-        return True
-    except get_integrity_error():
-        # 既にキューにある場合はPENDINGに戻す
-        c.execute("UPDATE search_queue SET status='pending', created_at=CURRENT_TIMESTAMP WHERE query=?", (query,))
-        conn.commit()
-        return True
+        c = conn.cursor()
+        c.execute("SELECT decoded_url, checked_at FROM gnews_decode_cache WHERE url_hash = ?", (key,), prepare=True)
+        row = c.fetchone()
+        return dict(row) if row else None
     finally:
         conn.close()
 
-def get_next_from_queue():
-    conn = get_db_connection()
-    conn.row_factory = sqlite3.Row if getattr(conn, 'is_postgres', False) is False else None
-    c = conn.cursor()
-    c.execute("SELECT id, query FROM search_queue WHERE status='pending' ORDER BY created_at ASC LIMIT 1")
-    row = c.fetchone()
-    if row:
-        c.execute("UPDATE search_queue SET status='processing' WHERE id=?", (row['id'],))
-        conn.commit()
+def save_gnews_decoded(key: str, gnews_url: str, decoded_url: str = None):
+    """デコード結果を記録する。decoded_url が None なら失敗（checked_at から一定時間は再試行しない）"""
+    def job(conn):
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO gnews_decode_cache (url_hash, gnews_url, decoded_url, checked_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(url_hash) DO UPDATE SET
+                decoded_url = excluded.decoded_url, checked_at = excluded.checked_at
+        ''', (key, gnews_url, decoded_url, time.time()))
+    run_write(job)
+
+# ─── RSSフィードの状態（条件付きリクエスト） ──────────────────────
+_FEED_STATE_COLUMNS = ("etag", "last_modified", "items_hash", "newest_pubdate")
+
+def get_feed_state(feed_key: str) -> dict:
+    """
+    フィード（検索クエリ）ごとの前回の状態。未取得なら各値が空の dict を返す。
+    etag/last_modified: 条件付きリクエスト用、items_hash: 記事リンク集合のハッシュ、
+    newest_pubdate: これまでに見た最新の公開日時（YYYY-MM-DD HH:MM:SS）
+    """
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute("SELECT * FROM feed_state WHERE feed_key = ?", (feed_key,), prepare=True)
+        row = c.fetchone()
+    finally:
         conn.close()
-        return row['query']
-    conn.close()
-    return None
+    state = {"feed_key": feed_key}
+    for k in _FEED_STATE_COLUMNS:
+        state[k] = (row[k] if row else None) or ""
+    return state
 
-def mark_queue_done(query: str):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("UPDATE search_queue SET status='completed' WHERE query=?", (query,))
-    conn.commit()
-    conn.close()
+def save_feed_state(state: dict):
+    now = time.time()
+    def job(conn):
+        c = conn.cursor()
+        c.execute(f'''
+            INSERT INTO feed_state (feed_key, {', '.join(_FEED_STATE_COLUMNS)}, checked_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(feed_key) DO UPDATE SET
+                {', '.join(f'{k} = excluded.{k}' for k in _FEED_STATE_COLUMNS)},
+                checked_at = excluded.checked_at
+        ''', (state["feed_key"], *(state.get(k) or "" for k in _FEED_STATE_COLUMNS), now))
+    run_write(job)
+
+# ─── OGP画像キャッシュ・ドメイン統計 ─────────────────────────────
+def get_ogp_cached(key: str, now: float):
+    """有効期限内のOGP取得結果 {"image_url", "strategy"}（無ければ None）。key は url_hash(記事URL)"""
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute("SELECT image_url, strategy, expires_at FROM ogp_cache WHERE url_hash = ? AND expires_at > ?",
+                  (key, now), prepare=True)
+        row = c.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def get_ogp_domain(domain: str):
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute("SELECT * FROM ogp_domain_stats WHERE domain = ?", (domain,), prepare=True)
+        row = c.fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+def save_ogp_result(entries: list, domain: str, image_url: str, strategy: str, elapsed_ms: float,
+                    ttl: float, skip_after_failures: int, skip_seconds: float):
+    """
+    OGP取得結果をキャッシュに保存し、ドメイン統計を更新する（1トランザクション）。
+    entries: [(url_hash, url), ...]  リクエストしたURLとリダイレクト後のURLの両方で引けるようにする
+    連続失敗が skip_after_failures 回に達したドメインは skip_seconds 秒だけ取得を見合わせる。
+    """
+    now = time.time()
+    ok = 1 if image_url else 0
+    def job(conn):
+        c = conn.cursor()
+        c.executemany('''
+            INSERT INTO ogp_cache (url_hash, url, image_url, strategy, fetched_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url_hash) DO UPDATE SET
+                url = excluded.url, image_url = excluded.image_url, strategy = excluded.strategy,
+                fetched_at = excluded.fetched_at, expires_at = excluded.expires_at
+        ''', [(key, url, image_url or "", strategy or "", now, now + ttl) for key, url in entries])
+        c.execute('''
+            INSERT INTO ogp_domain_stats (domain, attempts, successes, consecutive_failures, total_ms,
+                                          og_hits, twitter_hits, img_hits, last_attempt, skip_until)
+            VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?, 0)
+            ON CONFLICT(domain) DO UPDATE SET
+                attempts = ogp_domain_stats.attempts + 1,
+                successes = ogp_domain_stats.successes + excluded.successes,
+                consecutive_failures = CASE WHEN excluded.successes = 1 THEN 0
+                                            ELSE ogp_domain_stats.consecutive_failures + 1 END,
+                total_ms = ogp_domain_stats.total_ms + excluded.total_ms,
+                og_hits = ogp_domain_stats.og_hits + excluded.og_hits,
+                twitter_hits = ogp_domain_stats.twitter_hits + excluded.twitter_hits,
+                img_hits = ogp_domain_stats.img_hits + excluded.img_hits,
+                last_attempt = excluded.last_attempt
+        ''', (domain, ok, 1 - ok, elapsed_ms,
+              int(strategy == "og"), int(strategy == "twitter"), int(strategy == "img"), now))
+        c.execute('''
+            UPDATE ogp_domain_stats SET skip_until = ?
+            WHERE domain = ? AND consecutive_failures >= ?
+        ''', (now + skip_seconds, domain, skip_after_failures))
+    run_write(job)
+
+def get_ogp_stats(limit: int = 30) -> dict:
+    """キャッシュ件数とドメイン別統計（試行回数の多い順）"""
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute('''
+            SELECT COUNT(*) AS entries,
+                   SUM(CASE WHEN image_url <> '' THEN 1 ELSE 0 END) AS with_image,
+                   SUM(CASE WHEN expires_at <= ? THEN 1 ELSE 0 END) AS expired
+            FROM ogp_cache
+        ''', (time.time(),))
+        cache = dict(c.fetchone())
+        c.execute("SELECT * FROM ogp_domain_stats ORDER BY attempts DESC, domain LIMIT ?", (limit,))
+        domains = [dict(r) for r in c.fetchall()]
+        return {"cache": cache, "domains": domains}
+    finally:
+        conn.close()
+
+# ─── 通知アウトボックス ───────────────────────────────────────
+# 新着1件 × お気に入りユーザー1人 につき1行。notifier.py がユーザーごとにまとめて送る。
+# 状態遷移: pending → sent / 失敗 → pending（再試行） / dead（NOTIFY_MAX_ATTEMPTS 回失敗）
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "5"))
+
+def _enqueue_notifications(c, anime_title: str, item_ids: list, created_at: str):
+    """お気に入りユーザーへの通知を積む（idx_favorites_anime_title で1作品につき索引1回）"""
+    if not item_ids:
+        return
+    c.executemany('''
+        INSERT INTO notification_outbox (user_id, item_id, anime_title, created_at)
+        SELECT user_id, ?, anime_title, ? FROM favorites WHERE anime_title = ?
+    ''', [(item_id, created_at, anime_title) for item_id in item_ids])
+
+def get_pending_notifications(limit: int = 500) -> list:
+    """
+    未送信の通知を古い順に最大 limit 件、宛先メールアドレスと記事の内容付きで返す。
+    記事が重複圧縮などで消えていても通知自体は送れるよう LEFT JOIN にしている。
+    """
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute('''
+            SELECT o.id, o.user_id, o.anime_title, o.attempts, u.email,
+                   g.title, g.content, g.source_url, g.date, g.image_url
+            FROM notification_outbox o
+            JOIN users u ON u.id = o.user_id
+            LEFT JOIN goods_info g ON g.id = o.item_id
+            WHERE o.status = 'pending'
+            ORDER BY o.id
+            LIMIT ?
+        ''', (limit,))
+        return [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
+
+def mark_notifications_sent(ids: list):
+    if not ids:
+        return
+    sent_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    def job(conn):
+        c = conn.cursor()
+        for i in range(0, len(ids), EXPORT_CHUNK_SIZE):
+            chunk = ids[i:i + EXPORT_CHUNK_SIZE]
+            c.execute(f"""
+                UPDATE notification_outbox SET status = 'sent', sent_at = ?, last_error = NULL
+                WHERE id IN ({','.join('?' * len(chunk))})
+            """, (sent_at, *chunk))
+    run_write(job)
+
+def mark_notifications_failed(ids: list, error: str):
+    """送信失敗。試行回数が上限に達した行は dead にして以後送らない"""
+    if not ids:
+        return
+    def job(conn):
+        c = conn.cursor()
+        for i in range(0, len(ids), EXPORT_CHUNK_SIZE):
+            chunk = ids[i:i + EXPORT_CHUNK_SIZE]
+            c.execute(f"""
+                UPDATE notification_outbox
+                SET attempts = attempts + 1, last_error = ?,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'dead' ELSE 'pending' END
+                WHERE id IN ({','.join('?' * len(chunk))}) AND status = 'pending'
+            """, ((error or "")[:500], NOTIFY_MAX_ATTEMPTS, *chunk))
+    run_write(job)
+
+# ─── 巡回スケジュール（anime_targets, scheduler.py） ──────────────
+# 確保したターゲットの next_due_at をこの秒数だけ先に進めておく（巡回途中で落ちたらその後に再巡回）
+TARGET_CLAIM_SECONDS = int(os.environ.get("TARGET_CLAIM_SECONDS", "900"))
+
+def _mod_sql(expr: str) -> str:
+    """expr % ? のSQL（psycopg では % がプレースホルダの記号になるので %% と書く）"""
+    return f"({expr} {'%%' if DATABASE_URL else '%'} ?)"
+
+def _shard_filter(shards) -> tuple:
+    """担当シャード（id % CLUSTER_SHARDS）に属するターゲットだけに絞る条件（shards=None なら全件）"""
+    if shards is None:
+        return "", ()
+    shards = list(shards) or [-1]
+    return (f" AND {_mod_sql('id')} IN ({', '.join('?' * len(shards))})",
+            (CLUSTER_SHARDS, *shards))
+
+_TARGET_CLAIM_COLUMNS = "name_ja, name_en, yield_ewma, crawl_count"
+
+def claim_due_targets(limit: int = 1, claim_seconds: int = None, shards=None, batchable: bool = False) -> list:
+    """
+    巡回予定時刻を過ぎた有効ターゲットを期限の早い順に最大 limit 件確保し、
+    [{"name_ja", "name_en", "yield_ewma", "crawl_count"}] を返す。
+    shards を渡すとそのシャード（id % CLUSTER_SHARDS）のターゲットだけを対象にする（クラスタモード）。
+    batchable=True ならまとめ検索に回せる（scheduler.is_batchable と同じ条件の）ターゲットだけを対象にする。
+    PostgreSQL: FOR UPDATE SKIP LOCKED / SQLite: next_due_at を条件にした UPDATE の更新件数で判定
+    """
+    claim_seconds = claim_seconds or TARGET_CLAIM_SECONDS
+    shard_sql, shard_params = _shard_filter(shards)
+    if batchable:
+        shard_sql += " AND yield_ewma <= ? AND crawl_count >= ?"
+        shard_params += (scheduler.BATCH_YIELD_MAX, scheduler.BATCH_MIN_CRAWLS)
+
+    def job(conn):
+        conn.row_factory = sqlite3.Row
+        c = conn.cursor()
+        now = time.time()
+        if conn.is_postgres:
+            c.execute(f'''
+                UPDATE anime_targets SET next_due_at = ?
+                WHERE id IN (
+                    SELECT id FROM anime_targets WHERE enabled = 1 AND next_due_at <= ?{shard_sql}
+                    ORDER BY next_due_at LIMIT ? FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {_TARGET_CLAIM_COLUMNS}
+            ''', (now + claim_seconds, now, *shard_params, limit))
+            return [dict(r) for r in c.fetchall()]
+        c.execute(f'''
+            SELECT id, next_due_at, {_TARGET_CLAIM_COLUMNS} FROM anime_targets
+            WHERE enabled = 1 AND next_due_at <= ?{shard_sql} ORDER BY next_due_at LIMIT ?
+        ''', (now, *shard_params, limit))
+        claimed = []
+        for row in c.fetchall():
+            c.execute("UPDATE anime_targets SET next_due_at = ? WHERE id = ? AND next_due_at = ?",
+                      (now + claim_seconds, row["id"], row["next_due_at"]))
+            if c.cursor.rowcount == 1:
+                claimed.append({k: row[k] for k in ("name_ja", "name_en", "yield_ewma", "crawl_count")})
+        return claimed
+
+    return run_write(job)
+
+def record_target_crawl(title: str, new_items: int):
+    """
+    巡回結果（新規保存件数）を履歴に反映し、次回の巡回予定時刻（UNIX秒）を返す。
+    ターゲット以外のクエリ（ユーザー検索）なら何もせず None を返す。
+    """
+    def job(conn):
+        conn.row_factory = sqlite3.Row
+        c = conn.cursor()
+        c.execute("SELECT id, yield_ewma, crawl_count FROM anime_targets WHERE name_ja = ?", (title,), prepare=True)
+        row = c.fetchone()
+        if not row:
+            return None
+        c.execute("SELECT COUNT(*) AS n FROM favorites WHERE anime_title = ?", (title,), prepare=True)
+        favorites = c.fetchone()["n"]
+        ewma = scheduler.update_yield(row["yield_ewma"], new_items, row["crawl_count"])
+        now = time.time()
+        due = now + scheduler.next_interval(ewma, favorites)
+        c.execute('''
+            UPDATE anime_targets
+            SET last_crawled_at = ?, next_due_at = ?, crawl_count = crawl_count + 1,
+                last_new_items = ?, total_new_items = total_new_items + ?,
+                yield_ewma = ?, favorites_count = ?
+            WHERE id = ?
+        ''', (now, due, new_items, new_items, ewma, favorites, row["id"]))
+        return due
+
+    return run_write(job)
+
+def defer_targets(titles: list, delay: float) -> float:
+    """
+    取得に失敗したターゲットを delay 秒後に巡回し直す（確保中のリースを短い再試行時刻で置き換える）。
+    巡回履歴（新規件数EWMA・巡回回数・最終巡回時刻）は変えないので、障害で間隔が伸びたりまとめ検索に回ったりしない。
+    Returns: 次回の巡回予定時刻（UNIX秒）
+    """
+    due = time.time() + delay
+    def job(conn):
+        c = conn.cursor()
+        c.executemany("UPDATE anime_targets SET next_due_at = ? WHERE name_ja = ?", [(due, t) for t in titles])
+    if titles:
+        run_write(job)
+    return due
+
+def get_schedule_stats(limit: int = 20) -> dict:
+    """巡回スケジュールの概況（期限切れ件数・SLA超過件数・新規件数/リクエスト）と新着の多い作品"""
+    now = time.time()
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute('''
+            SELECT COUNT(*) AS targets,
+                   SUM(CASE WHEN next_due_at <= ? THEN 1 ELSE 0 END) AS due,
+                   SUM(CASE WHEN last_crawled_at IS NULL OR last_crawled_at < ? THEN 1 ELSE 0 END) AS over_sla,
+                   SUM(crawl_count) AS requests, SUM(total_new_items) AS new_items
+            FROM anime_targets WHERE enabled = 1
+        ''', (now, now - scheduler.CRAWL_SLA_SECONDS))
+        summary = dict(c.fetchone())
+        c.execute('''
+            SELECT name_ja, yield_ewma, favorites_count, crawl_count, total_new_items, last_crawled_at, next_due_at
+            FROM anime_targets WHERE enabled = 1 ORDER BY yield_ewma DESC LIMIT ?
+        ''', (limit,))
+        return {"summary": summary, "targets": [dict(r) for r in c.fetchall()]}
+    finally:
+        conn.close()
+
+# ─── クローラクラスタ（シャードのリース） ──────────────────────
+# anime_targets を id % CLUSTER_SHARDS でシャードに分け、各シャードを1ワーカーだけがリースして巡回する。
+# ハートビートのたびに「生存ワーカー数で割った取り分」に合わせてシャードを返却・取得するので、
+# ワーカーの追加・停止に合わせて自動的に再配分される。
+CLUSTER_SHARDS = int(os.environ.get("CLUSTER_SHARDS", "32"))
+CLUSTER_LEASE_SECONDS = int(os.environ.get("CLUSTER_LEASE_SECONDS", "60"))
+
+def cluster_heartbeat(worker_id: str, lease_seconds: int = None) -> list:
+    """
+    生存を記録し、リース切れのワーカーを除いたうえで担当シャードを更新する。担当シャード番号のリストを返す。
+    取り分 = ceil(シャード数 / 生存ワーカー数)。多すぎれば番号の大きい方から返し、
+    足りなければ空き（またはリース切れ）のシャードを条件付き UPDATE で取る。
+    """
+    lease_seconds = lease_seconds or CLUSTER_LEASE_SECONDS
+
+    def job(conn):
+        conn.row_factory = sqlite3.Row
+        c = conn.cursor()
+        now = time.time()
+        c.execute('''
+            INSERT INTO crawler_workers (worker_id, started_at, heartbeat_at) VALUES (?, ?, ?)
+            ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+        ''', (worker_id, now, now))
+        # ハートビートが途絶えたワーカーを外し、そのシャードを空きに戻す
+        c.execute("DELETE FROM crawler_workers WHERE heartbeat_at < ?", (now - lease_seconds,))
+        if c.cursor.rowcount and c.cursor.rowcount > 0:
+            print(f"[DB] クラスタ: 応答のないワーカー {c.cursor.rowcount}台を除外")
+        c.execute('''
+            UPDATE crawl_shards SET worker_id = NULL, lease_expires = NULL
+            WHERE worker_id IS NOT NULL AND worker_id NOT IN (SELECT worker_id FROM crawler_workers)
+        ''')
+        c.executemany("INSERT INTO crawl_shards (shard) VALUES (?) ON CONFLICT(shard) DO NOTHING",
+                      [(i,) for i in range(CLUSTER_SHARDS)])
+
+        c.execute("SELECT COUNT(*) AS n FROM crawler_workers")
+        share = -(-CLUSTER_SHARDS // max(1, c.fetchone()["n"]))
+        c.execute("UPDATE crawl_shards SET lease_expires = ? WHERE worker_id = ?", (now + lease_seconds, worker_id))
+        c.execute("SELECT shard FROM crawl_shards WHERE worker_id = ? AND shard < ? ORDER BY shard",
+                  (worker_id, CLUSTER_SHARDS))
+        mine = [r["shard"] for r in c.fetchall()]
+        if len(mine) > share:
+            c.executemany("UPDATE crawl_shards SET worker_id = NULL, lease_expires = NULL WHERE shard = ? AND worker_id = ?",
+                          [(s, worker_id) for s in mine[share:]])
+            mine = mine[:share]
+        elif len(mine) < share:
+            c.execute('''
+                SELECT shard FROM crawl_shards
+                WHERE shard < ? AND (worker_id IS NULL OR lease_expires < ?) ORDER BY shard
+            ''', (CLUSTER_SHARDS, now))
+            for r in c.fetchall():
+                if len(mine) >= share:
+                    break
+                c.execute('''
+                    UPDATE crawl_shards SET worker_id = ?, lease_expires = ?
+                    WHERE shard = ? AND (worker_id IS NULL OR lease_expires < ?)
+                ''', (worker_id, now + lease_seconds, r["shard"], now))
+                if c.cursor.rowcount == 1:
+                    mine.append(r["shard"])
+        return sorted(mine)
+
+    return run_write(job)
+
+def cluster_leave(worker_id: str):
+    """停止時に担当シャードを手放す（他のワーカーが次のハートビートで引き継ぐ）"""
+    def job(conn):
+        c = conn.cursor()
+        c.execute("UPDATE crawl_shards SET worker_id = NULL, lease_expires = NULL WHERE worker_id = ?", (worker_id,))
+        c.execute("DELETE FROM crawler_workers WHERE worker_id = ?", (worker_id,))
+    run_write(job)
+
+def get_cluster_status() -> list:
+    """ワーカーごとのハートビート時刻と担当シャード数"""
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute('''
+            SELECT w.worker_id, w.started_at, w.heartbeat_at, COUNT(s.shard) AS shards
+            FROM crawler_workers w LEFT JOIN crawl_shards s ON s.worker_id = w.worker_id
+            GROUP BY w.worker_id, w.started_at, w.heartbeat_at ORDER BY w.worker_id
+        ''')
+        return [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
+
+# ─── メトリクス ───────────────────────────────────────────
+def register_metric_gauges():
+    """検索キューの深さ・巡回期限を過ぎたターゲット数・接続プールの統計を /metrics の出力時に取る"""
+    import metrics
+    metrics.QUEUE_DEPTH.set_function(lambda: {(k,): v for k, v in get_queue_stats().items()})
+    metrics.TARGETS_DUE.set_function(lambda: get_schedule_stats(0)["summary"]["due"] or 0)
+    metrics.DB_POOL.set_function(_pool_gauges)
+
+def _pool_gauges() -> dict:
+    """get_pool_stats() のうち数値の項目（writer_alive は 0/1）だけを {(backend, 項目名): 値} にする"""
+    stats = get_pool_stats()
+    return {(stats["backend"], k): float(v) for k, v in stats.items() if isinstance(v, (int, float))}
+
+# ─── 検索キュー機能 ──────────────────────────────────────────
+# 状態遷移: pending → processing（リース付き） → completed
+#                          └ 失敗・リース切れ → pending（再試行） / dead（QUEUE_MAX_ATTEMPTS 回失敗）
+QUEUE_LEASE_SECONDS = int(os.environ.get("QUEUE_LEASE_SECONDS", "600"))
+QUEUE_MAX_ATTEMPTS  = int(os.environ.get("QUEUE_MAX_ATTEMPTS", "3"))
+
+def default_worker_id() -> str:
+    import socket
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def add_to_search_queue(query: str):
+    """
+    キューに追加する。既にあれば pending に戻して再試行回数もリセットする（dead からの復帰を含む）。
+    処理中（リース保持中）の行はそのままにして、二重実行させない。
+    """
+    def job(conn):
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO search_queue (query, status) VALUES (?, 'pending')
+            ON CONFLICT(query) DO UPDATE SET
+                status = 'pending', created_at = datetime('now','localtime'), attempts = 0, last_error = NULL
+            WHERE search_queue.status <> 'processing'
+        ''', (query,))
+    run_write(job)
+    return True
+
+def _requeue_expired(c, now: float) -> int:
+    """リース切れの processing 行を pending（試行回数を使い切っていれば dead）に戻す"""
+    c.execute('''
+        UPDATE search_queue
+        SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END,
+            worker_id = NULL, lease_expires = NULL,
+            last_error = COALESCE(last_error, 'lease expired')
+        WHERE status = 'processing' AND lease_expires < ?
+    ''', (QUEUE_MAX_ATTEMPTS, now))
+    n = c.cursor.rowcount
+    if n and n > 0:
+        print(f"[DB] 検索キュー: リース切れ {n}件を再投入")
+    return n
+
+def get_next_from_queue(worker_id: str = None, lease_seconds: int = None):
+    """
+    pending の先頭を1件、worker_id のリース付きで原子的に確保してクエリ文字列を返す（無ければ None）。
+    PostgreSQL: FOR UPDATE SKIP LOCKED で他ワーカーがロック中の行を飛ばす
+    SQLite: status='pending' を条件にした UPDATE の更新件数で確保できたかを判定する（負けたら次の行）
+    """
+    worker_id = worker_id or default_worker_id()
+    lease_seconds = lease_seconds or QUEUE_LEASE_SECONDS
+
+    def job(conn):
+        conn.row_factory = sqlite3.Row
+        c = conn.cursor()
+        now = time.time()
+        _requeue_expired(c, now)
+        if conn.is_postgres:
+            c.execute('''
+                UPDATE search_queue
+                SET status = 'processing', worker_id = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM search_queue WHERE status = 'pending'
+                    ORDER BY created_at, id LIMIT 1 FOR UPDATE SKIP LOCKED
+                )
+                RETURNING query
+            ''', (worker_id, now + lease_seconds))
+            row = c.fetchone()
+            return row["query"] if row else None
+        for _ in range(5):
+            c.execute("SELECT id, query FROM search_queue WHERE status = 'pending' ORDER BY created_at, id LIMIT 1")
+            row = c.fetchone()
+            if not row:
+                return None
+            c.execute('''
+                UPDATE search_queue
+                SET status = 'processing', worker_id = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE id = ? AND status = 'pending'
+            ''', (worker_id, now + lease_seconds, row["id"]))
+            if c.cursor.rowcount == 1:
+                return row["query"]
+        return None
+
+    return run_write(job)
+
+def mark_queue_done(query: str, worker_id: str = None):
+    """処理完了。リースを他のワーカーに取られていた場合は何もしない"""
+    worker_id = worker_id or default_worker_id()
+    def job(conn):
+        c = conn.cursor()
+        c.execute('''
+            UPDATE search_queue SET status = 'completed', worker_id = NULL, lease_expires = NULL, last_error = NULL
+            WHERE query = ? AND status = 'processing' AND worker_id = ?
+        ''', (query, worker_id))
+    run_write(job)
+
+def mark_queue_failed(query: str, error: str, worker_id: str = None):
+    """処理失敗。試行回数が上限に達していれば dead、そうでなければ pending に戻して再試行させる"""
+    worker_id = worker_id or default_worker_id()
+    def job(conn):
+        c = conn.cursor()
+        c.execute('''
+            UPDATE search_queue
+            SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'pending' END,
+                worker_id = NULL, lease_expires = NULL, last_error = ?
+            WHERE query = ? AND status = 'processing' AND worker_id = ?
+        ''', (QUEUE_MAX_ATTEMPTS, (error or "")[:500], query, worker_id))
+    run_write(job)
+
+def defer_queue(query: str, error: str, delay: float, worker_id: str = None):
+    """
+    送らずに終わった処理（回路オープン中など）を試行回数に数えずに delay 秒後へ回す。
+    リースを delay 秒後までに縮め、リース切れの回収で pending に戻す（すぐに同じワーカーが取り直さないように）。
+    """
+    worker_id = worker_id or default_worker_id()
+    def job(conn):
+        c = conn.cursor()
+        c.execute('''
+            UPDATE search_queue
+            SET attempts = CASE WHEN attempts > 0 THEN attempts - 1 ELSE 0 END, lease_expires = ?, last_error = ?
+            WHERE query = ? AND status = 'processing' AND worker_id = ?
+        ''', (time.time() + delay, (error or "")[:500], query, worker_id))
+    run_write(job)
+
+def get_queue_stats() -> dict:
+    """状態ごとの件数（dead の溜まり具合の確認用）"""
+    conn = get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute("SELECT status, COUNT(*) AS n FROM search_queue GROUP BY status")
+        return {r["status"]: r["n"] for r in c.fetchall()}
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
+    import sys
     init_db()
-    print("[DB] テスト完了")
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        # python database.py compact  … 重複URL行を圧縮（既存DBの分は init_db のマイグレーションで済んでいる）
+        compact_duplicates()
+    elif len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        # python database.py backfill  … スコア未保存の既存行にスコアを付与（init_db でも行う）
+        backfill_scores()
+        rescore_stale()
+    elif len(sys.argv) > 1 and sys.argv[1] == "queue":
+        # python database.py queue  … 検索キューの状態ごとの件数
+        print(f"[DB] 検索キュー: {get_queue_stats()}")
+    elif len(sys.argv) > 1 and sys.argv[1] == "schedule":
+        # python database.py schedule  … 巡回スケジュールの概況と新着の多い作品
+        stats = get_schedule_stats()
+        s = stats["summary"]
+        per_request = (s["new_items"] or 0) / s["requests"] if s["requests"] else 0
+        print(f"[DB] 巡回ターゲット {s['targets']}件: 期限到来 {s['due'] or 0}件 / SLA超過 {s['over_sla'] or 0}件 / "
+              f"新規 {per_request:.2f}件/リクエスト")
+        now = time.time()
+        for t in stats["targets"]:
+            print(f"  {t['name_ja'][:24]:<24} 新規EWMA {t['yield_ewma'] or 0:5.2f}  お気に入り {t['favorites_count'] or 0:>4}  "
+                  f"巡回 {t['crawl_count'] or 0:>4}回  次回まで {max(0, (t['next_due_at'] or 0) - now) / 60:6.0f}分")
+    elif len(sys.argv) > 1 and sys.argv[1] == "cluster":
+        # python database.py cluster  … クラスタモードの稼働ワーカーと担当シャード数
+        for w in get_cluster_status():
+            print(f"[DB] {w['worker_id']}: シャード {w['shards']}個 / 最終ハートビート {time.time() - w['heartbeat_at']:.0f}秒前")
+    elif len(sys.argv) > 1 and sys.argv[1] == "rescore":
+        # python database.py rescore  … 鮮度区分の境目を越えた行だけ再スコア
+        rescore_stale()
+    else:
+        print("[DB] テスト完了")
@@ -2,6 +2,8 @@ import re
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
 
+from urlnorm import canonicalize_url
+
 # 転売・個人感想関連の除外キーワード
 EXCLUDE_KEYWORDS = [
     "メルカリ", "ラクマ", "フリマ", "ヤフオク", "転売", "出品中", "売ります",
@@ -96,10 +98,11 @@ def filter_items(items: list) -> list:
         content = item.get("content", "")
         date_str = item.get("date", "")
 
-        # 重複URL除去
-        if url in seen_urls or not url:
+        # 重複URL除去（トラッキングパラメータ等の違いは同一URLとみなす）
+        canonical = canonicalize_url(url)
+        if canonical in seen_urls or not url:
             continue
-        seen_urls.add(url)
+        seen_urls.add(canonical)
 
         # 転売・個人感想の除外
         if has_exclude_keywords(content):
@@ -0,0 +1,399 @@
+"""
+http_client.py — クローラ共通のHTTPクライアント
+- 接続プール付きの requests.Session をプロセス全体で共有（Keep-Alive で TLS ハンドシェイクを使い回す）
+- ホストごとのトークンバケットで送信レートを制限（news.google.com と記事配信元で別々の枠）
+- 全体の同時リクエスト数をセマフォで制限
+- ホストごとの再試行（ジッター付き指数バックオフ）・サーキットブレーカー・Retry-After の尊重
+  （落ちているサイトへのリクエストは早々に打ち切り、他のホストへのリクエストは止めない）
+スレッドセーフなので、asyncio モードのワーカースレッドからもそのまま呼べる。
+"""
+
+import os
+import random
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import metrics
+
+try:
+    import requests as req_lib
+    from requests.adapters import HTTPAdapter
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+# 再試行する例外（接続の確立に失敗したもの。requests の ConnectTimeout は ConnectionError に含まれる）。
+# 読み込みのタイムアウトは再試行しない（応答しないページに timeout × 回数 の時間を使わないように）
+RETRYABLE_ERRORS = (urllib.error.URLError, ConnectionError)
+# 上のうち再試行しても結果が変わらないもの（証明書・TLSの失敗、プロキシの設定誤り）
+PERMANENT_ERRORS = (ssl.SSLError,)
+if HAS_REQUESTS:
+    RETRYABLE_ERRORS += (req_lib.ConnectionError,)
+    PERMANENT_ERRORS += (req_lib.exceptions.SSLError, req_lib.exceptions.ProxyError)
+
+def is_retryable(exc: BaseException) -> bool:
+    """接続の確立に失敗した例外か（urllib は TLS の失敗を URLError.reason に包んで送出する）"""
+    if isinstance(exc, PERMANENT_ERRORS):
+        return False
+    if isinstance(exc, urllib.error.URLError) and isinstance(exc.reason, PERMANENT_ERRORS):
+        return False
+    return isinstance(exc, RETRYABLE_ERRORS)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Accept-Language': 'ja,en;q=0.9',
+}
+
+# 全体の同時リクエスト数の上限
+HTTP_MAX_CONCURRENCY = int(os.environ.get("HTTP_MAX_CONCURRENCY", "16"))
+# 接続プール（ホストごとの保持接続数）
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "32"))
+
+GNEWS_HOST = "news.google.com"
+
+# ホストごとのレート制限 (1秒あたりのリクエスト数, バースト)
+# Google News は同一IPからの連続アクセスで弾かれやすいので控えめにする
+HOST_RATE_LIMITS = {
+    GNEWS_HOST: (float(os.environ.get("GNEWS_RATE", "1.0")), 3),
+}
+DEFAULT_RATE_LIMIT = (float(os.environ.get("PUBLISHER_RATE", "2.0")), 4)
+
+# 接続確立のタイムアウト（読み込みのタイムアウトは呼び出し側の timeout）。落ちたサイトで長く待たない
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3"))
+# 再試行回数とバックオフ（attempt 回目の待ち = 0〜min(MAX, BASE × 2^attempt) 秒の一様乱数）
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", "8"))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# 連続でこの回数失敗したホストは BREAKER_COOLDOWN 秒のあいだ呼び出さずに CircuitOpenError にする
+BREAKER_FAILURES = int(os.environ.get("HTTP_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("HTTP_BREAKER_COOLDOWN", "60"))
+# Retry-After がこれ以下なら待ってから送る。長ければ待たずに CircuitOpenError にする
+RETRY_AFTER_MAX_WAIT = float(os.environ.get("HTTP_RETRY_AFTER_MAX_WAIT", "30"))
+
+# ─── トークンバケット ────────────────────────────────────────
+class TokenBucket:
+    """rate 個/秒で補充され、最大 burst 個まで貯まるトークンバケット（スレッドセーフ）"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取る。足りなければ補充されるまで待つ"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_global_slots = threading.BoundedSemaphore(HTTP_MAX_CONCURRENCY)
+
+def host_of(url: str) -> str:
+    host = (urlsplit(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+def _bucket_for(host: str) -> TokenBucket:
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            rate, burst = HOST_RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT)
+            bucket = _buckets[host] = TokenBucket(rate, burst)
+        return bucket
+
+@contextmanager
+def throttle(host: str):
+    """
+    ホストのレート制限と全体の同時実行数制限を通してから処理を行う。
+    requests を経由しない外部ライブラリ（googlenewsdecoder など）の呼び出しもこれで囲む。
+    """
+    _bucket_for(host).acquire()
+    with _global_slots:
+        yield
+
+@contextmanager
+def _measure(host: str):
+    """
+    応答秒数とステータスごとの件数を記録する。with の中で record(status) を呼ぶ。
+    record されずに例外で抜けたら status="error" として数える。
+    """
+    status = []
+    started = time.perf_counter()
+    try:
+        yield status.append
+    finally:
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - started, host=host)
+        metrics.HTTP_REQUESTS.inc(host=host, status=status[0] if status else "error")
+
+# ─── サーキットブレーカー ─────────────────────────────────────
+class CircuitOpenError(RuntimeError):
+    """ホストが連続で失敗している（または Retry-After で待たされている）ため送らなかった"""
+
+    def __init__(self, host: str, remaining: float):
+        super().__init__(f"{host}: 回路オープン中（あと{remaining:.0f}秒）")
+        self.host = host
+        self.remaining = remaining
+
+class CircuitBreaker:
+    """
+    ホストごとの状態。closed（通常）→ 連続 BREAKER_FAILURES 回失敗で open（cooldown 秒は即エラー）
+    → cooldown 後は half-open（1件だけ試しに送り、成功すれば closed、失敗すればまた open）。
+    Retry-After を受け取ったら、その時刻まではこのホストへの送信を全スレッドで控える。
+    """
+
+    def __init__(self, host: str, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.host = host
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.paused_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """送ってよければ戻る。open 中なら CircuitOpenError、Retry-After の待ちが短ければ待つ"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.open_until > now:
+                    raise CircuitOpenError(self.host, self.open_until - now)
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.failures >= self.threshold:
+                        # half-open: 試しに送るのは1件だけ
+                        if self.probing:
+                            raise CircuitOpenError(self.host, 0)
+                        self.probing = True
+                    return
+                if wait > RETRY_AFTER_MAX_WAIT:
+                    raise CircuitOpenError(self.host, wait)
+            time.sleep(wait)
+
+    def record_success(self):
+        with self.lock:
+            if self.failures >= self.threshold:
+                print(f"[HTTP] {self.host}: 回復しました")
+            self.failures = 0
+            self.open_until = 0.0
+            self.probing = False
+
+    def record_failure(self, retry_after: float = None):
+        with self.lock:
+            now = time.monotonic()
+            self.failures += 1
+            self.probing = False
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if self.failures >= self.threshold:
+                if self.open_until <= now:
+                    print(f"[HTTP] {self.host}: {self.failures}回連続で失敗したため {self.cooldown:.0f}秒間送信を止めます")
+                self.open_until = now + self.cooldown
+
+_breakers = {}
+
+def breaker_for(host: str) -> CircuitBreaker:
+    with _buckets_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+        return breaker
+
+def backoff_delay(attempt: int) -> float:
+    """ジッター付き指数バックオフ（full jitter）"""
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+def _retry_after(response) -> float:
+    """Retry-After ヘッダ（秒数または HTTP 日付）を秒数にする。無ければ None"""
+    value = (response.headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _send_with_retry(host: str, send, hold_slot: bool = False):
+    """
+    send() を再試行・サーキットブレーカー付きで呼ぶ。send は応答（status_code, headers, close を持つ）を返す。
+    - 接続失敗・429/5xx は失敗として数え、HTTP_RETRIES 回まで待ってから再送
+    - 読み込みのタイムアウト・証明書エラーなどその他の例外は失敗として数えるが、再送せずにそのまま送出する
+    - 429/503 の Retry-After はホスト全体の待ち時間として扱う（長すぎれば再送せずに応答を返す）
+    - 再試行を使い切った 429/5xx はそのまま応答を返す（判定は呼び出し側）
+    hold_slot=True なら応答を返すときに同時実行数の枠を持ったまま戻る（本文を読み終えたら release_slot() で返す）。
+    """
+    breaker = breaker_for(host)
+    attempt = 0
+    while True:
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            metrics.HTTP_SHORT_CIRCUITS.inc(host=host)
+            raise
+        _bucket_for(host).acquire()
+        _global_slots.acquire()
+        keep_slot = False
+        try:
+            with _measure(host) as record:
+                r = send()
+                record(r.status_code)
+        except Exception as e:
+            breaker.record_failure()
+            if attempt >= HTTP_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            if r.status_code not in RETRYABLE_STATUS:
+                # 4xx もホストとしては応答しているので成功扱い
+                breaker.record_success()
+                keep_slot = hold_slot
+                return r
+            retry_after = _retry_after(r)
+            breaker.record_failure(retry_after)
+            if attempt >= HTTP_RETRIES or (retry_after or 0) > RETRY_AFTER_MAX_WAIT:
+                keep_slot = hold_slot
+                return r
+            r.close()
+            # Retry-After があれば before_call がその時刻まで待つ
+            delay = 0 if retry_after else backoff_delay(attempt)
+        finally:
+            if not keep_slot:
+                _global_slots.release()
+        attempt += 1
+        metrics.HTTP_RETRIES.inc(host=host)
+        # 待つのはこのリクエストだけ（レート制限の枠・同時実行数の枠は手放している）
+        time.sleep(delay)
+
+def release_slot():
+    """_send_with_retry(hold_slot=True) で持ったままにした同時実行数の枠を返す"""
+    _global_slots.release()
+
+def _timeouts(timeout: float):
+    """requests 用の (接続, 読み込み) タイムアウト"""
+    return (min(HTTP_CONNECT_TIMEOUT, timeout), timeout)
+
+# ─── セッション ─────────────────────────────────────────────
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """プロセス共有の requests.Session（requests が無い環境では None）"""
+    global _session
+    if not HAS_REQUESTS:
+        return None
+    with _session_lock:
+        if _session is None:
+            s = req_lib.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update(DEFAULT_HEADERS)
+            _session = s
+        return _session
+
+class _UrllibResponse:
+    """requests 未インストール時のフォールバック（requests.Response と同じ属性名だけ持つ）"""
+
+    def __init__(self, resp):
+        self.status_code = resp.status
+        self.url = resp.url
+        self.headers = resp.headers
+        self.content = resp.read()
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="ignore")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _UrllibStream:
+    """requests 未インストール時の stream() 用（iter_content だけ requests と同じ使い方ができる）"""
+
+    def __init__(self, resp):
+        self.resp = resp
+        self.status_code = resp.status
+        self.url = resp.url
+        self.headers = resp.headers
+
+    def close(self):
+        self.resp.close()
+
+    def iter_content(self, chunk_size: int = 16384):
+        while True:
+            chunk = self.resp.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+@contextmanager
+def stream(url: str, headers: dict = None, timeout: float = 10):
+    """
+    レート制限付きのストリーミング GET。本文は iter_content(chunk_size) で少しずつ読む。
+    途中で読むのをやめてもよい（with を抜けると接続を閉じる）。
+    応答ヘッダを受け取るまでは get() と同じく再試行・サーキットブレーカーの対象になる。
+    全体の同時実行数の枠は、本文を読み終えて with を抜けるまで持ち続ける。
+    """
+    def send():
+        session = get_session()
+        if session is not None:
+            return session.get(url, headers=headers, timeout=_timeouts(timeout), stream=True)
+        req = urllib.request.Request(url, headers={**DEFAULT_HEADERS, **(headers or {})})
+        try:
+            return _UrllibStream(urllib.request.urlopen(req, timeout=timeout))
+        except urllib.error.HTTPError as e:
+            return _UrllibStream(e)
+
+    r = _send_with_retry(host_of(url), send, hold_slot=True)
+    try:
+        yield r
+    finally:
+        try:
+            r.close()
+        finally:
+            release_slot()
+
+def get(url: str, headers: dict = None, timeout: float = 10, allow_redirects: bool = True):
+    """
+    レート制限付きの GET。戻り値は requests.Response（またはそれと同じ属性を持つオブジェクト）。
+    ステータスコードの判定は呼び出し側で行う。
+    接続失敗・429/5xx はホストごとに再試行し（読み込みのタイムアウトは再試行しない）、
+    連続で失敗しているホストには送らず CircuitOpenError を送出する。
+    """
+    def send():
+        session = get_session()
+        if session is not None:
+            return session.get(url, headers=headers, timeout=_timeouts(timeout), allow_redirects=allow_redirects)
+        req = urllib.request.Request(url, headers={**DEFAULT_HEADERS, **(headers or {})})
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                return _UrllibResponse(resp)
+        except urllib.error.HTTPError as e:
+            # requests と同じく 4xx/5xx も応答として返す
+            return _UrllibResponse(e)
+
+    return _send_with_retry(host_of(url), send)
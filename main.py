@@ -18,8 +18,9 @@ import time
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # ── 内部モジュール ─────────────────────────────────────────────
-from database import init_db, insert_item
+from database import init_db, insert_items
 from filter   import filter_items
+import metrics
 
 CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
 
@@ -56,16 +57,18 @@ def run_pipeline(raw_items: list):
         return 0
 
     print(f"[MAIN] フィルタリング開始: {len(raw_items)} 件")
-    filtered = filter_items(raw_items)
+    metrics.ITEMS.inc(len(raw_items), result="fetched")
+    with metrics.stage("filter"):
+        filtered = filter_items(raw_items)
     print(f"[MAIN] フィルタ通過: {len(filtered)} 件")
+    metrics.ITEMS.inc(len(raw_items) - len(filtered), result="filtered_out")
 
-    saved = 0
-    skipped = 0
-    for item in filtered:
-        if insert_item(item):
-            saved += 1
-        else:
-            skipped += 1
+    # 1トランザクションで一括保存
+    with metrics.stage("db_insert"):
+        saved = len(insert_items(filtered))
+    skipped = len(filtered) - saved
+    metrics.ITEMS.inc(saved, result="saved")
+    metrics.ITEMS.inc(skipped, result="duplicate")
 
     print(f"[MAIN] DB保存完了: {saved} 件保存 / {skipped} 件重複スキップ")
     return saved
@@ -87,3 +90,5 @@ if __name__ == "__main__":
         saved = run_pipeline(raw_items)
         print(f"\n[MAIN] 完了! {saved} 件を新たにDBに保存しました")
         print("[MAIN] 次: python server.py → http://localhost:5000")
+    # METRICS_TEXTFILE を指定していれば処理時間・件数を書き出す
+    metrics.write_textfile()
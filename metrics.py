@@ -0,0 +1,248 @@
+"""
+metrics.py — 処理段階ごとの計測と Prometheus テキスト形式での出力
+- Counter / Gauge / Histogram（ラベル付き）をプロセス内のレジストリに登録し、render() でまとめて出力する
+- crawler.py は start_http_server() で /metrics を公開し（CRAWLER_METRICS_PORT 設定時のみ。既定は 127.0.0.1 だけで待ち受け）、
+  server.py は /metrics ルートで返す（METRICS_TOKEN 必須）
+- main.py や update_images*.py のような単発スクリプトは write_textfile() で
+  node_exporter の textfile collector 向けにファイルへ書き出す（METRICS_TEXTFILE 未設定なら何もしない）
+外部ライブラリには依存しない。値はプロセスごと（gunicorn ならワーカーごと）に集計される。
+
+使い方:
+  with metrics.stage("rss_fetch"):
+      ...
+  metrics.ITEMS.inc(len(items), result="fetched")
+"""
+
+import hmac
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_TEXTFILE = os.environ.get("METRICS_TEXTFILE", "")
+# /metrics の取得に必要なトークン（Authorization: Bearer <METRICS_TOKEN>）。server.py と start_http_server で共通
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒単位のヒストグラムの既定の区切り（RSS取得〜記事ページ取得まで収まる範囲）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+# ─── メトリクス ─────────────────────────────────────────────
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if len(labels) != len(self.labelnames) or any(n not in labels for n in self.labelnames):
+            raise ValueError(f"{self.name}: ラベルは {self.labelnames} を指定してください")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> list:
+        """[(名前の接尾辞, ラベルの組, 値)]"""
+        with self.lock:
+            return [("", tuple(zip(self.labelnames, key)), v) for key, v in self.values.items()]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, pairs, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(pairs)} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    """増えるだけの件数"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """
+    現在値。set_function() で関数を登録すると出力のたびに呼び出して値を取る
+    （関数はラベル値のタプル → 値 の dict、ラベルなしなら数値を返す）。
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        self.function = function
+
+    def _samples(self) -> list:
+        if self.function is None:
+            return super()._samples()
+        try:
+            result = self.function()
+        except Exception as e:
+            print(f"[Metrics] {self.name} の取得に失敗: {e}")
+            return []
+        if not isinstance(result, dict):
+            result = {(): result}
+        return [("", tuple(zip(self.labelnames, key)), v) for key, v in result.items()]
+
+class Histogram(_Metric):
+    """値の分布（処理時間など）。time() で囲んだ処理の秒数を記録できる"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # [区切りごとの件数..., 上限超えの件数], 合計, 件数
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list:
+        samples = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                pairs = tuple(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    samples.append(("_bucket", pairs + (("le", _format_value(bound)),), cumulative))
+                samples.append(("_sum", pairs, total))
+                samples.append(("_count", pairs, count))
+        return samples
+
+# ─── 共通のメトリクス（crawler.py / main.py / update_images*.py で共有） ─────
+STAGE_SECONDS = Histogram("crawler_stage_seconds", "処理段階ごとの所要秒数", ["stage"])
+ITEMS = Counter("crawler_items_total", "記事の件数（fetched/known/filtered_out/saved/duplicate）", ["result"])
+TARGETS = Counter("crawler_targets_total", "処理したターゲット・検索クエリの件数", ["result"])
+HTTP_REQUESTS = Counter("http_client_requests_total", "外部へのHTTPリクエスト数（status=error は接続失敗等）",
+                        ["host", "status"])
+HTTP_SECONDS = Histogram("http_client_request_seconds", "外部へのHTTPリクエストの応答秒数", ["host"])
+HTTP_RETRIES = Counter("http_client_retries_total", "外部へのHTTPリクエストの再試行回数", ["host"])
+HTTP_SHORT_CIRCUITS = Counter("http_client_short_circuits_total", "サーキットブレーカーで送らなかったリクエスト数", ["host"])
+GNEWS_DECODE = Counter("gnews_decode_total", "Google News URL のデコード（hit/negative/miss）", ["result"])
+OGP_FETCH = Counter("ogp_fetch_total", "記事ページからの画像取得（cache_hit/skipped/og/twitter/img/none/error）",
+                    ["result"])
+IMAGE_UPDATES = Counter("image_updates_total", "update_images の画像更新件数（updated/failed）", ["result"])
+QUEUE_DEPTH = Gauge("search_queue_depth", "検索キューの状態ごとの件数", ["status"])
+TARGETS_DUE = Gauge("crawl_targets_due", "巡回予定時刻を過ぎたターゲット数")
+DB_POOL = Gauge("db_pool", "DB接続プールの統計（PostgreSQL: in_use/idle/created/reused など、SQLite: created/reused/nested など）",
+                ["backend", "stat"])
+
+def stage(name: str):
+    """with metrics.stage("filter"): … の処理時間を crawler_stage_seconds に記録する"""
+    return STAGE_SECONDS.time(stage=name)
+
+# ─── 出力 ──────────────────────────────────────────────────
+def render() -> str:
+    with _registry_lock:
+        registered = list(_registry)
+    lines = []
+    for metric in registered:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path: str = None):
+    """textfile collector 向けに書き出す（書きかけを読まれないよう一時ファイルから置き換える）"""
+    path = path or METRICS_TEXTFILE
+    if not path:
+        return
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+def authorized(auth_header: str, token: str) -> bool:
+    """Authorization ヘッダが Bearer <token> と一致するか（タイミング差の出ない比較）"""
+    return bool(token) and hmac.compare_digest((auth_header or "").encode("utf-8"), f"Bearer {token}".encode("utf-8"))
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        token = self.server.metrics_token
+        if token and not authorized(self.headers.get("Authorization"), token):
+            self.send_error(401)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_http_server(port: int, host: str = "127.0.0.1", token: str = None):
+    """
+    別スレッドで /metrics を公開する（ポートが使用中なら警告だけ出して続行）。
+    token（省略時は METRICS_TOKEN）が設定されていれば Bearer トークン付きのリクエストにだけ返す。
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        print(f"[Metrics] ポート {port} で公開できません: {e}")
+        return None
+    server.metrics_token = METRICS_TOKEN if token is None else token
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    auth = "（トークン必須）" if server.metrics_token else ""
+    print(f"[Metrics] http://{host}:{server.server_address[1]}/metrics で公開中{auth}")
+    return server
@@ -0,0 +1,435 @@
+"""
+migrations.py — スキーマ・マイグレーション
+schema_version テーブルに適用済みバージョンを記録し、未適用のステップだけを順に実行する。
+各ステップは SQLite / PostgreSQL の両方で何度実行しても安全（冪等）に書くこと。
+新しいスキーマ変更は MIGRATIONS の末尾に追加する。
+"""
+
+import database
+
+# 複数のgunicornワーカー/クローラが同時に起動しても1プロセスだけが適用するためのロックキー
+PG_ADVISORY_LOCK_KEY = 72610401
+
+# ─── ヘルパー ──────────────────────────────────────────────
+def _column_exists(c, table: str, column: str) -> bool:
+    if c.is_postgres:
+        c.execute(
+            "SELECT 1 FROM information_schema.columns"
+            " WHERE table_schema = current_schema() AND table_name = ? AND column_name = ?",
+            (table, column),
+        )
+        return c.fetchone() is not None
+    c.execute(f"PRAGMA table_info({table})")
+    return any(row[1] == column for row in c.fetchall())
+
+def add_column(c, table: str, column: str, ddl: str):
+    """カラムが無ければ追加する（ddl 例: "INTEGER DEFAULT 0"）"""
+    if not _column_exists(c, table, column):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+# ─── マイグレーション本体 ──────────────────────────────────
+def m001_baseline_tables(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS goods_info (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT, content TEXT, author TEXT, source_url TEXT,
+            source_type TEXT, category TEXT, date TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            freshness_score INTEGER DEFAULT 0, rarity_score INTEGER DEFAULT 0,
+            reliability_score INTEGER DEFAULT 0, total_score INTEGER DEFAULT 0,
+            priority_level TEXT DEFAULT '', image_url TEXT DEFAULT '',
+            url_hash TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS search_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            query TEXT UNIQUE, status TEXT DEFAULT 'pending',
+            created_at TEXT DEFAULT (datetime('now','localtime'))
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE, password_hash TEXT,
+            created_at TEXT DEFAULT (datetime('now','localtime'))
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS favorites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER, anime_title TEXT,
+            created_at TEXT DEFAULT (datetime('now','localtime')),
+            UNIQUE(user_id, anime_title)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS push_subscriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER, subscription_json TEXT,
+            created_at TEXT DEFAULT (datetime('now','localtime')),
+            UNIQUE(user_id, subscription_json)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS anime_targets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name_ja TEXT UNIQUE, name_en TEXT, genre TEXT, reason TEXT,
+            enabled INTEGER DEFAULT 1,
+            added_at TEXT DEFAULT (datetime('now','localtime'))
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS social_accounts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            provider TEXT NOT NULL,
+            provider_user_id TEXT NOT NULL,
+            display_name TEXT,
+            UNIQUE(provider, provider_user_id)
+        )
+    ''')
+
+def m002_backfill_columns(c):
+    # 旧バージョンで作られたテーブルに後から追加されたカラム
+    # （旧 init_db / setup_targets.upgrade_goods_table の ALTER TABLE をここに集約）
+    add_column(c, "goods_info", "freshness_score", "INTEGER DEFAULT 0")
+    add_column(c, "goods_info", "rarity_score", "INTEGER DEFAULT 0")
+    add_column(c, "goods_info", "reliability_score", "INTEGER DEFAULT 0")
+    add_column(c, "goods_info", "total_score", "INTEGER DEFAULT 0")
+    add_column(c, "goods_info", "priority_level", "TEXT DEFAULT ''")
+    add_column(c, "goods_info", "image_url", "TEXT DEFAULT ''")
+    add_column(c, "goods_info", "url_hash", "TEXT")
+    add_column(c, "anime_targets", "enabled", "INTEGER DEFAULT 1")
+    add_column(c, "anime_targets", "added_at", "TEXT")
+    # URL重複排除用（既存行の url_hash は m015 で埋める）
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_goods_info_url_hash ON goods_info(url_hash)")
+
+def m003_secondary_indexes(c):
+    # 一覧: ORDER BY date DESC, created_at DESC（id はページングのタイブレーク用）
+    c.execute("CREATE INDEX IF NOT EXISTS idx_goods_info_date ON goods_info(date, created_at, id)")
+    # 一覧の絞り込み（作品名・ソース・カテゴリ）＋日付順
+    c.execute("CREATE INDEX IF NOT EXISTS idx_goods_info_title ON goods_info(title, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_goods_info_source_type ON goods_info(source_type, date)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_goods_info_category ON goods_info(category, date)")
+    # 新着通知: 作品名からお気に入りユーザーを引く（user_id 側は UNIQUE(user_id, anime_title) で引ける）
+    c.execute("CREATE INDEX IF NOT EXISTS idx_favorites_anime_title ON favorites(anime_title)")
+    # 検索キュー: status='pending' を古い順に取り出す
+    c.execute("CREATE INDEX IF NOT EXISTS idx_search_queue_status ON search_queue(status, created_at)")
+    # クローラ巡回対象・/api/targets
+    c.execute("CREATE INDEX IF NOT EXISTS idx_anime_targets_enabled ON anime_targets(enabled, name_ja)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_social_accounts_user ON social_accounts(user_id)")
+
+def m004_keyset_pagination(c):
+    # キーセットページングの比較 (date, created_at, id) < (...) は NULL を含むと行が落ちるため空文字に揃える
+    c.execute("UPDATE goods_info SET date = '' WHERE date IS NULL")
+    c.execute("UPDATE goods_info SET created_at = '' WHERE created_at IS NULL")
+    c.execute("UPDATE goods_info SET total_score = 0 WHERE total_score IS NULL")
+    # sort=score のページング用
+    c.execute("CREATE INDEX IF NOT EXISTS idx_goods_info_score ON goods_info(total_score, date, created_at, id)")
+
+def m005_full_text_search(c):
+    """
+    title/content/author の全文検索インデックス（日本語は分かち書きせず3文字n-gramで引く）。
+    SQLite: FTS5 trigram の外部コンテンツテーブル＋トリガーで goods_info と同期
+    PostgreSQL: pg_trgm の GIN インデックス（通常インデックスなので同期は不要）
+    拡張が使えない環境ではスキップし、検索は LIKE にフォールバックする。
+    """
+    if c.is_postgres:
+        c.cursor.execute("SAVEPOINT fts")
+        try:
+            c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            c.execute(f"CREATE INDEX IF NOT EXISTS idx_goods_info_trgm ON goods_info USING gin (({database.PG_SEARCH_EXPR}) gin_trgm_ops)")
+            c.cursor.execute("RELEASE SAVEPOINT fts")
+        except Exception as e:
+            c.cursor.execute("ROLLBACK TO SAVEPOINT fts")
+            print(f"[DB] pg_trgm を利用できないため全文検索インデックスをスキップ: {e}")
+        return
+    try:
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS goods_fts USING fts5(
+                title, content, author,
+                content='goods_info', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+    except Exception as e:
+        print(f"[DB] FTS5(trigram) を利用できないため全文検索インデックスをスキップ: {e}")
+        return
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_fts_ai AFTER INSERT ON goods_info BEGIN
+            INSERT INTO goods_fts(rowid, title, content, author) VALUES (new.id, new.title, new.content, new.author);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_fts_ad AFTER DELETE ON goods_info BEGIN
+            INSERT INTO goods_fts(goods_fts, rowid, title, content, author) VALUES ('delete', old.id, old.title, old.content, old.author);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_fts_au AFTER UPDATE OF title, content, author ON goods_info BEGIN
+            INSERT INTO goods_fts(goods_fts, rowid, title, content, author) VALUES ('delete', old.id, old.title, old.content, old.author);
+            INSERT INTO goods_fts(rowid, title, content, author) VALUES (new.id, new.title, new.content, new.author);
+        END
+    ''')
+    # 既存行をインデックスに取り込む
+    c.execute("INSERT INTO goods_fts(goods_fts) VALUES ('rebuild')")
+
+def m006_persisted_scores(c):
+    """
+    スコアを挿入時に保存し、鮮度の再計算が必要な行だけを拾えるようにする。
+    freshness_due: 新しさスコアが次に下がる日（NULL は未スコア → 次の database.init_db() で埋める）
+    """
+    add_column(c, "goods_info", "freshness_due", "TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_goods_info_freshness_due ON goods_info(freshness_due)")
+
+def m007_facet_counts(c):
+    """
+    作品名・カテゴリごとの件数を保持する集計テーブル。
+    insert_items が挿入と同じトランザクションで加算するので、一覧APIは goods_info を走査しない。
+    """
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS facet_counts (
+            facet TEXT NOT NULL,
+            value TEXT NOT NULL,
+            item_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (facet, value)
+        )
+    ''')
+    database.rebuild_facet_counts(c)
+
+def m008_queue_leases(c):
+    """
+    search_queue を複数クローラで安全に取り合えるようにリース列を追加する。
+    lease_expires はエポック秒。旧実装で processing のまま残った行は pending に戻す。
+    """
+    add_column(c, "search_queue", "worker_id", "TEXT")
+    add_column(c, "search_queue", "lease_expires", "REAL")
+    add_column(c, "search_queue", "attempts", "INTEGER DEFAULT 0")
+    add_column(c, "search_queue", "last_error", "TEXT")
+    c.execute("UPDATE search_queue SET attempts = 0 WHERE attempts IS NULL")
+    c.execute("UPDATE search_queue SET status = 'pending' WHERE status = 'processing' AND lease_expires IS NULL")
+    # リース切れの回収: status='processing' AND lease_expires < now
+    c.execute("CREATE INDEX IF NOT EXISTS idx_search_queue_lease ON search_queue(status, lease_expires)")
+
+def m009_notification_outbox(c):
+    """
+    新着通知のアウトボックス。insert_items が記事の挿入と同じトランザクションで積み、
+    notifier.py がユーザーごとのダイジェストにまとめて送る。
+    favorites(anime_title) の索引は m003 で作成済み。
+    """
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            anime_title TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            last_error TEXT,
+            created_at TEXT DEFAULT (datetime('now','localtime')),
+            sent_at TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_notification_outbox_status ON notification_outbox(status, id)")
+
+def m010_gnews_decode_cache(c):
+    """
+    Google News の中間URL → 元記事URL の対応表（caches.GnewsDecodeCache が使う）。
+    url_hash は正規化後の Google News URL のハッシュ。decoded_url が NULL の行はデコード失敗。
+    """
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS gnews_decode_cache (
+            url_hash TEXT PRIMARY KEY,
+            gnews_url TEXT,
+            decoded_url TEXT,
+            checked_at REAL
+        )
+    ''')
+
+def m011_ogp_cache(c):
+    """
+    記事URLごとのOGP画像取得結果（期限付き。画像なしも image_url='' として記録）と、
+    ドメインごとの成功率・所要時間・効いた取得方法の統計。
+    """
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ogp_cache (
+            url_hash TEXT PRIMARY KEY,
+            url TEXT,
+            image_url TEXT,
+            strategy TEXT,
+            fetched_at REAL,
+            expires_at REAL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ogp_domain_stats (
+            domain TEXT PRIMARY KEY,
+            attempts INTEGER DEFAULT 0,
+            successes INTEGER DEFAULT 0,
+            consecutive_failures INTEGER DEFAULT 0,
+            total_ms REAL DEFAULT 0,
+            og_hits INTEGER DEFAULT 0,
+            twitter_hits INTEGER DEFAULT 0,
+            img_hits INTEGER DEFAULT 0,
+            last_attempt REAL,
+            skip_until REAL DEFAULT 0
+        )
+    ''')
+
+def m012_feed_state(c):
+    """
+    Google News RSS の検索クエリごとの状態（ETag/Last-Modified、記事リンク集合のハッシュ、
+    これまでに見た最新の公開日時）。変化のないフィードはフィルタ・DB処理を丸ごと省く。
+    """
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS feed_state (
+            feed_key TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            items_hash TEXT,
+            newest_pubdate TEXT,
+            checked_at REAL
+        )
+    ''')
+
+def m013_target_schedule(c):
+    """
+    巡回ターゲットの適応スケジュール（scheduler.py）。巡回履歴と次回の巡回予定時刻を持たせ、
+    ORDER BY RANDOM() の全件ソートを (enabled, next_due_at) のインデックス読みに置き換える。
+    既存のターゲットは next_due_at = 0（すぐに巡回対象）から始める。
+    """
+    add_column(c, "anime_targets", "next_due_at", "REAL DEFAULT 0")
+    add_column(c, "anime_targets", "last_crawled_at", "REAL")
+    add_column(c, "anime_targets", "crawl_count", "INTEGER DEFAULT 0")
+    add_column(c, "anime_targets", "last_new_items", "INTEGER DEFAULT 0")
+    add_column(c, "anime_targets", "total_new_items", "INTEGER DEFAULT 0")
+    add_column(c, "anime_targets", "yield_ewma", "REAL DEFAULT 0")
+    add_column(c, "anime_targets", "favorites_count", "INTEGER DEFAULT 0")
+    c.execute("UPDATE anime_targets SET next_due_at = 0 WHERE next_due_at IS NULL")
+    c.execute('''
+        UPDATE anime_targets SET favorites_count = (
+            SELECT COUNT(*) FROM favorites WHERE favorites.anime_title = anime_targets.name_ja
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_anime_targets_due ON anime_targets(enabled, next_due_at)")
+
+def m014_crawler_cluster(c):
+    """
+    クラスタモードのクローラ（crawler.py --cluster）。
+    crawler_workers: 稼働中のワーカーとハートビート時刻
+    crawl_shards: anime_targets を id % CLUSTER_SHARDS で分けたシャードごとの担当ワーカーとリース期限
+    """
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS crawler_workers (
+            worker_id TEXT PRIMARY KEY,
+            started_at REAL,
+            heartbeat_at REAL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_shards (
+            shard INTEGER PRIMARY KEY,
+            worker_id TEXT,
+            lease_expires REAL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_crawl_shards_worker ON crawl_shards(worker_id)")
+
+def m015_backfill_url_hash(c):
+    """
+    url_hash 導入前の行に url_hash を埋める。同じ正規化URLの行は最も古い id だけを残す
+    （埋めないと一意インデックスにも filter_unknown_items にも既存行が掛からない）。
+    URLの無い行に入っていた空文字列のハッシュは NULL に戻す。
+    """
+    database.compact_goods_urls(c)
+
+def m016_blank_null_dates(c):
+    """m004 の後に date=None のアイテムから保存された NULL をもう一度空文字に揃える（キーセットページング用）"""
+    c.execute("UPDATE goods_info SET date = '' WHERE date IS NULL")
+
+MIGRATIONS = [
+    (1, "baseline tables", m001_baseline_tables),
+    (2, "backfill columns added after baseline", m002_backfill_columns),
+    (3, "secondary indexes for list/filter/favorites/queue queries", m003_secondary_indexes),
+    (4, "keyset pagination keys and score index", m004_keyset_pagination),
+    (5, "full-text search index (FTS5 trigram / pg_trgm)", m005_full_text_search),
+    (6, "persisted scores and freshness_due index", m006_persisted_scores),
+    (7, "facet_counts aggregate for titles/categories", m007_facet_counts),
+    (8, "search_queue leases, retry counts and dead-letter state", m008_queue_leases),
+    (9, "notification outbox", m009_notification_outbox),
+    (10, "Google News URL decode cache", m010_gnews_decode_cache),
+    (11, "OGP image cache and per-domain stats", m011_ogp_cache),
+    (12, "RSS feed validators, items hash and pubDate watermark", m012_feed_state),
+    (13, "Adaptive crawl schedule for anime_targets", m013_target_schedule),
+    (14, "Crawler cluster workers and shard leases", m014_crawler_cluster),
+    (15, "Backfill url_hash and merge duplicate URLs", m015_backfill_url_hash),
+    (16, "Blank out NULL dates stored after v4", m016_blank_null_dates),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# ─── ランナー ──────────────────────────────────────────────
+def _read_version(c) -> int:
+    c.execute("SELECT MAX(version) AS v FROM schema_version")
+    row = c.fetchone()
+    if row is None:
+        return 0
+    return (row["v"] if c.is_postgres else row[0]) or 0
+
+def current_version(conn) -> int:
+    """適用済みの最新バージョン（schema_version が無ければ 0）"""
+    try:
+        return _read_version(conn.cursor())
+    except Exception:
+        conn.rollback()
+        return 0
+
+def migrate() -> list:
+    """
+    未適用のマイグレーションを1トランザクションで適用し、適用したバージョン番号のリストを返す。
+    バージョンが最新なら schema_version を1回読むだけでDDLは一切実行しない。
+    """
+    conn = database.get_db_connection()
+    try:
+        if current_version(conn) >= LATEST_VERSION:
+            return []
+
+        c = conn.cursor()
+        # 同時起動したプロセス間で直列化する（PostgreSQL: アドバイザリロック / SQLite: 書き込みロック）
+        if conn.is_postgres:
+            c.execute("SELECT pg_advisory_xact_lock(?)", (PG_ADVISORY_LOCK_KEY,))
+        else:
+            conn.conn.execute("BEGIN IMMEDIATE")
+        try:
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # ロック待ちの間に他プロセスが適用済みの可能性があるので、ロック取得後に読み直す
+            version = _read_version(c)
+            ph = "%s" if conn.is_postgres else "?"
+            applied = []
+            for number, description, step in MIGRATIONS:
+                if number <= version:
+                    continue
+                step(c)
+                c.cursor.execute(
+                    f"INSERT INTO schema_version (version, description) VALUES ({ph}, {ph})",
+                    (number, description),
+                )
+                applied.append(number)
+                print(f"[DB] マイグレーション適用: v{number} {description}")
+            conn.commit()
+            return applied
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    applied = migrate()
+    print(f"[DB] schema_version = {LATEST_VERSION}（今回適用: {applied or 'なし'}）")
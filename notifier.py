@@ -0,0 +1,206 @@
+"""
+notifier.py — 新着通知の送信ワーカー
+crawler.py が notification_outbox に積んだ通知をユーザーごとのダイジェストにまとめ、
+SMTP接続を使い回しながら同時送信数を絞って送る。クロールとは別プロセスで動かす。
+
+実行方法:
+  python notifier.py          … 常駐（NOTIFY_POLL_INTERVAL 秒ごとにアウトボックスを確認）
+  python notifier.py --once   … 溜まっている分を1回だけ送って終了
+"""
+
+import os
+import sys
+import time
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+import database
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+NOTIFY_BATCH_SIZE    = int(os.environ.get("NOTIFY_BATCH_SIZE", "500"))
+NOTIFY_CONCURRENCY   = int(os.environ.get("NOTIFY_CONCURRENCY", "4"))
+NOTIFY_POLL_INTERVAL = int(os.environ.get("NOTIFY_POLL_INTERVAL", "10"))
+DIGEST_MAX_ENTRIES   = 20   # 1通のダイジェストに本文として載せる件数
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+# これより長く使っていない接続は NOOP で生存確認してから使う
+SMTP_IDLE_CHECK = 30
+
+# ─── 送信手段 ─────────────────────────────────────────────
+class SMTPSender:
+    """1スレッド1接続で使い回すSMTPクライアント（切れていたら1回だけ張り直して再送）"""
+
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+        self.server = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        self.close()
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        server.starttls()
+        server.login(self.username, self.password)
+        self.server = server
+
+    def _ensure_connected(self):
+        if self.server is None:
+            self._connect()
+        elif time.time() - self.last_used > SMTP_IDLE_CHECK:
+            try:
+                self.server.noop()
+            except smtplib.SMTPException:
+                self._connect()
+
+    def send(self, to_email: str, subject: str, body: str):
+        msg = MIMEText(body, "plain", "utf-8")
+        msg["From"] = self.username
+        msg["To"] = to_email
+        msg["Subject"] = subject
+        self._ensure_connected()
+        try:
+            self.server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._connect()
+            self.server.send_message(msg)
+        self.last_used = time.time()
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+class LogSender:
+    """SMTP未設定時のモック（ログ出力のみ）"""
+
+    def send(self, to_email: str, subject: str, body: str):
+        print(f"   📧 [Email Sent to {to_email}] {subject}")
+
+    def close(self):
+        pass
+
+def _smtp_configured() -> bool:
+    password = os.getenv("MAIL_PASSWORD") or ""
+    return bool(os.getenv("MAIL_USERNAME") and password and "ここ" not in password)
+
+class SenderPool:
+    """ワーカースレッドごとに送信クライアントを1つ持たせて接続を使い回す"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.senders = []
+
+    def get(self):
+        sender = getattr(self.local, "sender", None)
+        if sender is None:
+            if _smtp_configured():
+                sender = SMTPSender(os.getenv("MAIL_USERNAME"), os.getenv("MAIL_PASSWORD"))
+            else:
+                sender = LogSender()
+            self.local.sender = sender
+            with self.lock:
+                self.senders.append(sender)
+        return sender
+
+    def close_all(self):
+        with self.lock:
+            senders, self.senders = self.senders, []
+        for s in senders:
+            s.close()
+
+# ─── ダイジェスト作成 ─────────────────────────────────────────
+def build_digest(rows: list) -> tuple:
+    """同じユーザー宛ての通知行をまとめて (件名, 本文) を作る"""
+    titles = []
+    for r in rows:
+        if r["anime_title"] not in titles:
+            titles.append(r["anime_title"])
+    head = f"『{titles[0]}』" + (f"ほか{len(titles) - 1}作品" if len(titles) > 1 else "")
+    subject = f"{head}の新しいグッズ情報が{len(rows)}件届きました！"
+
+    lines = ["お気に入り作品の新着グッズ情報です。", ""]
+    for r in rows[:DIGEST_MAX_ENTRIES]:
+        lines.append(f"■ [{r['anime_title']}] {r.get('title') or ''}")
+        if r.get("date"):
+            lines.append(f"  {r['date']}")
+        if r.get("source_url"):
+            lines.append(f"  {r['source_url']}")
+        lines.append("")
+    if len(rows) > DIGEST_MAX_ENTRIES:
+        lines.append(f"ほか {len(rows) - DIGEST_MAX_ENTRIES} 件")
+    return subject, "\n".join(lines)
+
+# ─── 送信処理 ─────────────────────────────────────────────
+def _send_digest(pool: SenderPool, email: str, rows: list):
+    subject, body = build_digest(rows)
+    pool.get().send(email, subject, body)
+
+def run_once(executor: ThreadPoolExecutor, pool: SenderPool) -> int:
+    """
+    溜まっている通知を1バッチ送る。送った通知行の件数を返す。
+    ユーザー単位で成功/失敗を記録するので、失敗したユーザーの分だけが再送対象に残る。
+    """
+    rows = database.get_pending_notifications(NOTIFY_BATCH_SIZE)
+    if not rows:
+        return 0
+
+    by_user = {}
+    for r in rows:
+        by_user.setdefault((r["user_id"], r["email"]), []).append(r)
+
+    futures = {
+        key: executor.submit(_send_digest, pool, key[1], user_rows)
+        for key, user_rows in by_user.items()
+    }
+    sent_ids = []
+    for key, future in futures.items():
+        ids = [r["id"] for r in by_user[key]]
+        try:
+            future.result()
+            sent_ids.extend(ids)
+        except Exception as e:
+            print(f"[Notifier] 送信失敗 {key[1]}: {e}")
+            database.mark_notifications_failed(ids, str(e))
+    database.mark_notifications_sent(sent_ids)
+    print(f"[Notifier] {len(by_user)}人に {len(sent_ids)}件分のダイジェストを送信")
+    return len(sent_ids)
+
+def run_notifier(once: bool = False):
+    print(f"[Notifier] 起動（同時送信数 {NOTIFY_CONCURRENCY}）")
+    pool = SenderPool()
+    with ThreadPoolExecutor(max_workers=NOTIFY_CONCURRENCY, thread_name_prefix="notifier") as executor:
+        try:
+            while True:
+                try:
+                    n = run_once(executor, pool)
+                except Exception as e:
+                    print(f"[Notifier Exception] {e}")
+                    n = 0
+                if once and n < NOTIFY_BATCH_SIZE:
+                    break
+                # バッチが満杯だった場合はまだ残っているので待たずに続ける
+                if n < NOTIFY_BATCH_SIZE:
+                    time.sleep(NOTIFY_POLL_INTERVAL)
+        except KeyboardInterrupt:
+            print("\n[Notifier] 終了します。")
+        finally:
+            pool.close_all()
+
+if __name__ == "__main__":
+    database.init_db()
+    sys.stdout.reconfigure(encoding='utf-8')
+    run_notifier(once="--once" in sys.argv)
@@ -0,0 +1,163 @@
+"""
+ogp.py — 記事ページからのサムネイル画像URL抽出
+ページ全体を取得して正規表現を何度も掛ける代わりに、
+- 本文はチャンク単位で読み、</head> まで（または上限バイト数まで）で打ち切る
+- meta タグは HTMLParser で1回走査するだけで og:image / twitter:image を拾う
+- <head> で見つからなかったときだけ本文の <img> まで読み進める
+"""
+
+import codecs
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+import http_client
+
+CHUNK_SIZE = 16 * 1024
+# <head> を読む上限（これを超えたら head は終わったものとして扱う）
+HEAD_MAX_BYTES = 256 * 1024
+# 本文の <img> まで読む場合の上限
+BODY_MAX_BYTES = 1024 * 1024
+
+OG_KEYS = {"og:image", "og:image:url", "og:image:secure_url"}
+TWITTER_KEYS = {"twitter:image", "twitter:image:src"}
+
+# 本文 <img> の除外条件: トラッキングピクセル・アイコン・google系
+IMG_SKIP_WORDS = ['google', 'gstatic', 'doubleclick', 'adsystem',
+                  'blank', 'spacer', 'pixel', '1x1', 'icon',
+                  'favicon', 'logo', 'avatar', 'gravatar']
+IMG_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.webp', '.gif']
+# 拡張子がなくても画像ホスティングサービスのURLはOK
+IMG_HOST_HINTS = ['images.', 'img.', 'cdn.', 'media.', 'assets.',
+                  'photo', 'image', 'pics', 'static']
+
+CHARSET_RE = re.compile(r"charset=([\w-]+)", re.IGNORECASE)
+
+def normalize_img_url(img_url: str, base_url: str) -> str:
+    """画像URLを正規化（相対URLを絶対URLに変換）"""
+    img_url = img_url.strip()
+    if img_url.startswith('http'):
+        return img_url
+    elif img_url.startswith('//'):
+        return 'https:' + img_url
+    elif img_url.startswith('/') and base_url:
+        return base_url + img_url
+    return ""
+
+def _is_content_image(img_url: str) -> bool:
+    lower = img_url.lower()
+    if any(skip in lower for skip in IMG_SKIP_WORDS):
+        return False
+    # 拡張子チェック（画像らしいURLを優先）
+    if any(lower.endswith(ext) for ext in IMG_EXTENSIONS):
+        return True
+    return any(host in lower for host in IMG_HOST_HINTS)
+
+class MetaImageParser(HTMLParser):
+    """
+    og:image / twitter:image / 本文の最初の画像らしい <img> を1回の走査で拾う。
+    done が True になったら以降を読む必要はない。
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.og = ""
+        self.twitter = ""
+        self.img = ""
+        self.head_done = False
+        self.done = False
+
+    def _accept_meta(self, value: str) -> str:
+        img_url = normalize_img_url(value or "", self.base_url)
+        return img_url if img_url and "google.com" not in img_url else ""
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "meta":
+            a = dict(attrs)
+            key = (a.get("property") or a.get("name") or "").strip().lower()
+            if key in OG_KEYS and not self.og:
+                self.og = self._accept_meta(a.get("content"))
+                if self.og:
+                    # og:image が最優先なので、見つかった時点で終了
+                    self.done = True
+            elif key in TWITTER_KEYS and not self.twitter:
+                self.twitter = self._accept_meta(a.get("content"))
+        elif tag == "body":
+            self.end_head()
+        elif tag == "img" and self.head_done and not self.img:
+            src = dict(attrs).get("src")
+            img_url = normalize_img_url(src, self.base_url) if src else ""
+            if img_url and _is_content_image(img_url):
+                self.img = img_url
+                self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.end_head()
+
+    def end_head(self):
+        if self.head_done:
+            return
+        self.head_done = True
+        # <head> に meta 画像があれば本文は読まない
+        if self.og or self.twitter:
+            self.done = True
+
+    def result(self) -> tuple:
+        """(画像URL, 取得方法) 取得方法は og / twitter / img / ''"""
+        if self.og:
+            return self.og, "og"
+        if self.twitter:
+            return self.twitter, "twitter"
+        if self.img:
+            return self.img, "img"
+        return "", ""
+
+def _charset_of(content_type: str) -> str:
+    m = CHARSET_RE.search(content_type or "")
+    if m:
+        try:
+            return codecs.lookup(m.group(1)).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+def extract_image(chunks, base_url: str, charset: str = "utf-8") -> dict:
+    """
+    HTMLのバイト列チャンクから画像URLを探す。必要な所まで読んだら残りのチャンクは読まない。
+    Returns: {"image_url", "strategy", "bytes"}
+    """
+    parser = MetaImageParser(base_url)
+    decoder = codecs.getincrementaldecoder(charset)(errors="ignore")
+    read = 0
+    for chunk in chunks:
+        read += len(chunk)
+        parser.feed(decoder.decode(chunk))
+        if parser.done:
+            break
+        if not parser.head_done and read >= HEAD_MAX_BYTES:
+            parser.end_head()
+            if parser.done:
+                break
+        if read >= BODY_MAX_BYTES:
+            break
+    image_url, strategy = parser.result()
+    return {"image_url": image_url, "strategy": strategy, "bytes": read}
+
+def fetch_ogp(url: str, headers: dict = None, timeout: float = 8) -> dict:
+    """
+    記事ページを必要な所まで読み、サムネイル画像URLを返す。
+    フォールバック順: og:image → twitter:image → 記事内最初のimgタグ
+    Returns: {"image_url", "strategy", "bytes", "final_url", "status"}
+    """
+    with http_client.stream(url, headers=headers, timeout=timeout) as r:
+        # 実際のリダイレクト先URLを取得（相対URL解決に使う）
+        final_url = r.url
+        parsed = urlsplit(final_url)
+        base_url = f"{parsed.scheme}://{parsed.netloc}" if parsed.netloc else ""
+        result = extract_image(r.iter_content(CHUNK_SIZE), base_url,
+                               _charset_of(r.headers.get("Content-Type", "")))
+    result["final_url"] = final_url
+    result["status"] = r.status_code
+    return result
@@ -0,0 +1,57 @@
+"""
+scheduler.py — 巡回ターゲットの適応スケジューラ
+作品ごとの巡回履歴（最終巡回時刻・1回あたりの新規件数の指数移動平均・お気に入り数）から
+次回の巡回予定時刻 next_due_at を決める。新着が多い作品・お気に入りの多い作品ほど間隔を短くし、
+何も出てこない作品は CRAWL_SLA_SECONDS まで間隔を伸ばす（それより長くは空けない）。
+
+巡回する側は next_due_at の早い順（idx_anime_targets_due）に取るだけでよい。
+期限を過ぎたターゲットほど先に取られるので、処理能力が足りている限り SLA 内に必ず1回は巡回される。
+最近ほとんど新着のない作品（is_batchable）は、crawler.py が複数まとめて1回の OR 検索で巡回する。
+"""
+
+import math
+import os
+import random
+
+# 1作品あたりの巡回間隔の下限と上限（上限 = どの作品も最低これだけの間隔で1回は巡回する）
+CRAWL_MIN_INTERVAL = int(os.environ.get("CRAWL_MIN_INTERVAL", str(30 * 60)))
+CRAWL_SLA_SECONDS  = int(os.environ.get("CRAWL_SLA_SECONDS", str(24 * 3600)))
+
+# 新規件数の指数移動平均の重み（大きいほど直近の巡回結果を重視）
+YIELD_EWMA_ALPHA = 0.3
+# 優先度 = 1 + YIELD_WEIGHT × 新規件数EWMA + FAVORITE_WEIGHT × log(1 + お気に入り数)
+YIELD_WEIGHT    = 4.0
+FAVORITE_WEIGHT = 1.0
+# 同じ時刻に期限が集中しないよう、間隔を最大 JITTER の割合だけ短くする
+JITTER = 0.1
+# RSSを取得できなかった（Google News の障害・回路オープン中）ターゲットを巡回し直すまでの秒数。
+# 失敗は巡回履歴（新規件数EWMA・巡回回数）には入れない
+CRAWL_RETRY_INTERVAL = int(os.environ.get("CRAWL_RETRY_INTERVAL", str(5 * 60)))
+# 新規件数EWMAがこれ以下で、巡回実績が BATCH_MIN_CRAWLS 回以上ある作品は
+# 他の作品とまとめて1回の RSS 検索で巡回する（crawler.CRAWL_BATCH_MAX）
+BATCH_YIELD_MAX  = float(os.environ.get("CRAWL_BATCH_YIELD_MAX", "0.5"))
+BATCH_MIN_CRAWLS = 3
+
+def update_yield(ewma: float, new_items: int, crawl_count: int) -> float:
+    """今回の新規件数を移動平均に反映する（初回はその値をそのまま使う）"""
+    if not crawl_count:
+        return float(new_items)
+    return YIELD_EWMA_ALPHA * new_items + (1 - YIELD_EWMA_ALPHA) * (ewma or 0.0)
+
+def priority(yield_ewma: float, favorites: int) -> float:
+    return 1 + YIELD_WEIGHT * (yield_ewma or 0.0) + FAVORITE_WEIGHT * math.log1p(favorites or 0)
+
+def next_interval(yield_ewma: float, favorites: int) -> float:
+    """次回巡回までの秒数。新着もお気に入りも無い作品は CRAWL_SLA_SECONDS"""
+    interval = CRAWL_SLA_SECONDS / priority(yield_ewma, favorites)
+    interval *= 1 - random.uniform(0, JITTER)
+    return max(CRAWL_MIN_INTERVAL, min(CRAWL_SLA_SECONDS, interval))
+
+def retry_interval() -> float:
+    """取得に失敗したターゲットを巡回し直すまでの秒数（一斉に再送しないよう JITTER の割合だけずらす）"""
+    return CRAWL_RETRY_INTERVAL * (1 - random.uniform(0, JITTER))
+
+def is_batchable(target: dict) -> bool:
+    """最近ほとんど新着がない作品か（まとめ検索に回してリクエスト数を減らす）"""
+    return ((target.get("crawl_count") or 0) >= BATCH_MIN_CRAWLS
+            and (target.get("yield_ewma") or 0.0) <= BATCH_YIELD_MAX)
@@ -36,30 +36,50 @@ OFFICIAL_X_KEYWORDS = [
     "aniplex", "ジャンプ", "jump", "ローソン", "lawson"
 ]
 
+# ── 新しさの区分（経過日数の上限, 点数）。超えたら次の区分に落ちる ──
+FRESHNESS_BUCKETS = [(7, 40), (30, 30), (90, 20), (180, 10)]
+FRESHNESS_STALE  = 3   # 180日超
+FRESHNESS_NODATE = 5   # 日付不明
+# これ以上新しさスコアが変わらない行の freshness_due（再スコア対象から外すための番兵）
+FRESHNESS_DUE_NEVER = "9999-12-31"
+
+def _parse_date(date_str: str):
+    if not date_str:
+        return None
+    for fmt in ["%Y-%m-%d", "%Y/%m/%d"]:
+        try:
+            return datetime.strptime(date_str[:10], fmt)
+        except ValueError:
+            continue
+    return None
+
 def score_freshness(date_str: str) -> int:
     """
     新しさスコア (0-40 点)
-    直近7日:40 / 30日:30 / 90日:20 / 180日:10 / それ以上:0
+    直近7日:40 / 30日:30 / 90日:20 / 180日:10 / それ以上:3
     """
-    if not date_str:
-        return 5  # 日付不明は低め
-    try:
-        for fmt in ["%Y-%m-%d", "%Y/%m/%d"]:
-            try:
-                dt = datetime.strptime(date_str[:10], fmt)
-                break
-            except ValueError:
-                continue
-        else:
-            return 5
-        delta = (datetime.now() - dt).days
-        if delta <= 7:   return 40
-        if delta <= 30:  return 30
-        if delta <= 90:  return 20
-        if delta <= 180: return 10
-        return 3
-    except Exception:
-        return 5
+    dt = _parse_date(date_str)
+    if dt is None:
+        return FRESHNESS_NODATE  # 日付不明は低め
+    delta = (datetime.now() - dt).days
+    for limit, points in FRESHNESS_BUCKETS:
+        if delta <= limit:
+            return points
+    return FRESHNESS_STALE
+
+def freshness_due(date_str: str) -> str:
+    """
+    新しさスコアが次に下がる日（YYYY-MM-DD）。この日以降に再スコアが必要になる。
+    180日を超えた行や日付不明の行は以後変わらないので FRESHNESS_DUE_NEVER を返す。
+    """
+    dt = _parse_date(date_str)
+    if dt is None:
+        return FRESHNESS_DUE_NEVER
+    delta = (datetime.now() - dt).days
+    for limit, _ in FRESHNESS_BUCKETS:
+        if delta <= limit:
+            return (dt + timedelta(days=limit + 1)).strftime("%Y-%m-%d")
+    return FRESHNESS_DUE_NEVER
 
 def score_rarity(content: str) -> int:
     """
@@ -115,7 +135,7 @@ def score_item(item: dict) -> dict:
     """
     1件のアイテムにスコアを付与して返す。
     追加フィールド: freshness_score, rarity_score, reliability_score,
-                   total_score, priority_level
+                   total_score, priority_level, freshness_due
     """
     content = item.get("content", "")
     fresh   = score_freshness(item.get("date", ""))
@@ -128,6 +148,7 @@ def score_item(item: dict) -> dict:
     item["reliability_score"] = trust
     item["total_score"]       = total
     item["priority_level"]    = compute_priority_level(total)
+    item["freshness_due"]     = freshness_due(item.get("date", ""))
     return item
 
 def score_all(items: list) -> list:
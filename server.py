@@ -2,13 +2,14 @@ import os
 import sys
 import sqlite3
 import csv
-from flask import Flask, jsonify, request, send_from_directory, Response, send_file, redirect, session
+from flask import Flask, jsonify, request, send_from_directory, Response, send_file, redirect, session, g
 from flask_cors import CORS
 import uuid
 import hashlib
 import time
 import random
 import urllib.parse
+import zlib
 
 # メール配信用モジュール
 import smtplib
@@ -21,7 +22,7 @@ load_dotenv()
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, BASE_DIR)
 import database
-from scorer import score_all
+import metrics
 
 # DATABASE_URL確認（デバッグ用）
 _db_url = os.getenv("DATABASE_URL", "")
@@ -40,6 +41,31 @@ CORS(app, supports_credentials=True)
 # ブラウザの強力なキャッシュを回避
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
 
+# ─── メトリクス（/metrics） ────────────────────────────────────
+# gunicorn ではワーカープロセスごとの値になる
+SERVER_REQUESTS = metrics.Counter("http_server_requests_total", "APIリクエスト数", ["endpoint", "method", "status"])
+SERVER_SECONDS = metrics.Histogram("http_server_request_seconds", "APIの応答秒数", ["endpoint"])
+# /metrics の取得に必要なトークン（未設定なら /metrics は公開しない）
+METRICS_TOKEN = metrics.METRICS_TOKEN
+database.register_metric_gauges()
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(r):
+    # 静的ファイルはパスごとにラベルが増えないよう1つにまとめる
+    if request.endpoint == "static_files":
+        endpoint = "static"
+    else:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    SERVER_REQUESTS.inc(endpoint=endpoint, method=request.method, status=r.status_code)
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        SERVER_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+    return r
+
 @app.after_request
 def add_header(r):
     r.headers["Cache-Control"] = "no-cache, no-store, must-revalidate, public, max-age=0"
@@ -114,10 +140,12 @@ def api_auth_register():
         return jsonify({"status": "error", "message": "Email and Password are required"}), 400
 
     conn = database.get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id FROM users WHERE email=?", (email,))
-    existing = c.fetchone()
-    conn.close()
+    try:
+        c = conn.cursor()
+        c.execute("SELECT id FROM users WHERE email=?", (email,))
+        existing = c.fetchone()
+    finally:
+        conn.close()
     
     if existing:
         return jsonify({"status": "error", "message": "Email already exists"}), 400
@@ -157,7 +185,7 @@ def api_auth_verify_registration():
         conn = database.get_db_connection()
         c = conn.cursor()
         try:
-            c.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (email, reg_data["password_hash"]))
+            c.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (email, reg_data["password_hash"]), return_id=True)
             conn.commit()
             user_id = c.lastrowid
             
@@ -178,11 +206,13 @@ def api_auth_login():
     email = data.get("email", "").strip()
     password = data.get("password", "").strip()
     
-    conn = database.get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, password_hash FROM users WHERE email=?", (email,))
-    user = c.fetchone()
-    conn.close()
+    conn = database.get_db_connection(readonly=True)
+    try:
+        c = conn.cursor()
+        c.execute("SELECT id, password_hash FROM users WHERE email=?", (email,))
+        user = c.fetchone()
+    finally:
+        conn.close()
     
     if user and user[1] == hash_password(password):
         # 2FA: トークンを即座に発行せず、OTPを生成して保持する
@@ -256,7 +286,7 @@ def social_login():
             # ユーザーが存在しない場合は自動作成
             random_password_hash = hash_password(str(uuid.uuid4())) # Generate a random password hash for social users
             try:
-                c.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (email, random_password_hash))
+                c.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (email, random_password_hash), return_id=True)
                 conn.commit()
                 new_user_id = c.lastrowid
                 
@@ -349,7 +379,7 @@ def _mock_social_login_redirect(provider: str):
             SESSION_STORE[token] = user[0]
         else:
             pw_hash = hash_password(str(uuid.uuid4()))
-            c.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (mock_email, pw_hash))
+            c.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (mock_email, pw_hash), return_id=True)
             conn.commit()
             SESSION_STORE[token] = c.lastrowid
     except Exception:
@@ -447,19 +477,6 @@ def social_callback(provider):
         conn = database.get_db_connection()
         c = conn.cursor()
         try:
-            # social_accountsテーブルがなければ作成
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS social_accounts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    provider TEXT NOT NULL,
-                    provider_user_id TEXT NOT NULL,
-                    display_name TEXT,
-                    UNIQUE(provider, provider_user_id)
-                )
-            ''')
-            conn.commit()
-
             # 1. provider_user_id で既存紐付けを探す
             user_id_db = None
             if provider_user_id:
@@ -479,7 +496,7 @@ def social_callback(provider):
             # 3. 全く新規ならユーザー作成
             if user_id_db is None:
                 pw_hash = hash_password(str(uuid.uuid4()))
-                c.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (sns_email, pw_hash))
+                c.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)", (sns_email, pw_hash), return_id=True)
                 conn.commit()
                 user_id_db = c.lastrowid
 
@@ -517,11 +534,13 @@ def api_auth_me():
     if not user_id:
         return jsonify({"status": "error", "message": "Unauthorized"}), 401
     
-    conn = database.get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT email FROM users WHERE id=?", (user_id,))
-    user = c.fetchone()
-    conn.close()
+    conn = database.get_db_connection(readonly=True)
+    try:
+        c = conn.cursor()
+        c.execute("SELECT email FROM users WHERE id=?", (user_id,))
+        user = c.fetchone()
+    finally:
+        conn.close()
     return jsonify({"status": "ok", "email": user[0]})
 
 # ─── API: Favorites ──────────────────────────────────────────
@@ -533,33 +552,30 @@ def api_favorites():
         
     conn = database.get_db_connection()
     c = conn.cursor()
-    
-    if request.method == "GET":
-        c.execute("SELECT anime_title FROM favorites WHERE user_id=?", (user_id,))
-        favs = [row[0] for row in c.fetchall()]
-        conn.close()
-        return jsonify({"status": "ok", "favorites": favs})
-        
-    if request.method == "POST":
-        title = request.json.get("anime_title", "").strip()
-        if not title:
-            conn.close()
-            return jsonify({"status": "error", "message": "Title required"}), 400
-        try:
-            c.execute("INSERT INTO favorites (user_id, anime_title) VALUES (?, ?)", (user_id, title))
+    try:
+        if request.method == "GET":
+            c.execute("SELECT anime_title FROM favorites WHERE user_id=?", (user_id,))
+            favs = [row[0] for row in c.fetchall()]
+            return jsonify({"status": "ok", "favorites": favs})
+
+        if request.method == "POST":
+            title = request.json.get("anime_title", "").strip()
+            if not title:
+                return jsonify({"status": "error", "message": "Title required"}), 400
+            try:
+                c.execute("INSERT INTO favorites (user_id, anime_title) VALUES (?, ?)", (user_id, title))
+                conn.commit()
+                return jsonify({"status": "ok", "message": f"Added {title} to favorites"})
+            except database.get_integrity_error():
+                return jsonify({"status": "ok", "message": "Already in favorites"})
+
+        if request.method == "DELETE":
+            title = request.json.get("anime_title", "").strip()
+            c.execute("DELETE FROM favorites WHERE user_id=? AND anime_title=?", (user_id, title))
             conn.commit()
-            return jsonify({"status": "ok", "message": f"Added {title} to favorites"})
-        except database.get_integrity_error():
-            return jsonify({"status": "ok", "message": "Already in favorites"})
-        finally:
-            conn.close()
-            
-    if request.method == "DELETE":
-        title = request.json.get("anime_title", "").strip()
-        c.execute("DELETE FROM favorites WHERE user_id=? AND anime_title=?", (user_id, title))
-        conn.commit()
+            return jsonify({"status": "ok", "message": f"Removed {title} from favorites"})
+    finally:
         conn.close()
-        return jsonify({"status": "ok", "message": f"Removed {title} from favorites"})
 
 # ─── API: 情報一覧 ─────────────────────────────────────────────
 @app.route("/api/items", methods=["GET"])
@@ -568,67 +584,69 @@ def api_items():
     source_filter   = request.args.get("source")
     category_filter = request.args.get("category")
     sort_by         = request.args.get("sort", "date")  # date | score
-    items = database.get_all_items(title_filter, source_filter, category_filter)
-
-    # スコアが未設定のアイテムにリアルタイムスコアリング
-    for item in items:
-        if not item.get("total_score"):
-            from scorer import score_item
-            scored = score_item(dict(item))
-            item.update(scored)
-
-    # スコア順ソート
-    if sort_by == "score":
-        items.sort(key=lambda x: x.get("total_score", 0), reverse=True)
-
-    return jsonify({"status": "ok", "count": len(items), "items": items})
+    limit           = request.args.get("limit", type=int)
+    cursor          = request.args.get("cursor")
+    try:
+        items, next_cursor = database.get_items_page(
+            title_filter, source_filter, category_filter,
+            sort=sort_by, limit=limit, cursor=cursor
+        )
+    except database.InvalidCursor:
+        return jsonify({"status": "error", "message": "Invalid cursor"}), 400
+    # スコアは挿入時とクローラの定期再計算で保存済みなので、ここでは読むだけ
+    return jsonify({"status": "ok", "count": len(items), "items": items, "next_cursor": next_cursor})
+
+# ─── API: 全文検索 ─────────────────────────────────────────────
+@app.route("/api/items/search", methods=["GET"])
+def api_items_search():
+    """title/content/author を全文検索して関連度順に返す（DB側で検索・ページング）"""
+    q      = request.args.get("q", "").strip()
+    limit  = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor")
+    if not q:
+        return jsonify({"status": "error", "message": "q is required"}), 400
+    try:
+        items, next_cursor = database.search_items(q, limit=limit, cursor=cursor)
+    except database.InvalidCursor:
+        return jsonify({"status": "error", "message": "Invalid cursor"}), 400
+    return jsonify({"status": "ok", "query": q, "count": len(items), "items": items, "next_cursor": next_cursor})
 
 # ─── API: 作品名一覧 ────────────────────────────────────────────
 @app.route("/api/titles", methods=["GET"])
 def api_titles():
-    conn = database.get_db_connection()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT title FROM goods_info ORDER BY title")
-    titles = [r["title"] for r in c.fetchall()]
-    conn.close()
-    return jsonify({"titles": titles})
+    # facet_counts は挿入時に更新される集計テーブル（作品数に比例、記事数には比例しない）
+    facets = database.get_facet_counts("title")
+    return jsonify({"titles": [f["value"] for f in facets], "counts": facets})
 
 # ─── API: カテゴリ一覧 ──────────────────────────────────────────
 @app.route("/api/categories", methods=["GET"])
 def api_categories():
-    conn = database.get_db_connection()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT category FROM goods_info ORDER BY category")
-    cats = [r["category"] for r in c.fetchall()]
-    conn.close()
-    return jsonify({"categories": cats})
+    facets = database.get_facet_counts("category")
+    return jsonify({"categories": [f["value"] for f in facets], "counts": facets})
 
 # ─── API: 追跡作品数（anime_targetsテーブル） ──────────────────
 @app.route("/api/targets", methods=["GET"])
 def api_targets():
-    conn = database.get_db_connection()
+    conn = database.get_db_connection(readonly=True)
+    conn.row_factory = sqlite3.Row
     c = conn.cursor()
     try:
-        c.execute("SELECT COUNT(*) FROM anime_targets WHERE enabled=1")
-        count = c.fetchone()[0]
+        # idx_anime_targets_enabled(enabled, name_ja) を順に読むだけの1クエリ（件数は一覧から数える）
         c.execute("SELECT name_ja, genre FROM anime_targets WHERE enabled=1 ORDER BY name_ja")
-        rows = c.fetchall()
-        targets = [{"name": r[0], "genre": r[1]} for r in rows]
+        targets = [{"name": r["name_ja"], "genre": r["genre"]} for r in c.fetchall()]
     except sqlite3.OperationalError:
-        count = 0
         targets = []
-    conn.close()
-    return jsonify({"count": count, "targets": targets})
+    finally:
+        conn.close()
+    return jsonify({"count": len(targets), "targets": targets})
 
 # ─── API: 優先度上位のみ取得 ───────────────────────────────────
 @app.route("/api/urgent", methods=["GET"])
 def api_urgent():
-    items = database.get_all_items()
-    scored = score_all(items)
-    urgent = [i for i in scored if i.get("total_score", 0) >= 55]
-    return jsonify({"status": "ok", "count": len(urgent), "items": urgent})
+    limit     = request.args.get("limit", type=int)
+    threshold = request.args.get("threshold", database.URGENT_SCORE_DEFAULT, type=int)
+    urgent = database.get_urgent_items(limit=limit, threshold=threshold)
+    return jsonify({"status": "ok", "count": len(urgent), "threshold": threshold, "items": urgent})
 
 # ─── API: 新規検索・自動追加リクエスト ───────────────────────
 @app.route("/api/search", methods=["POST"])
@@ -660,16 +678,47 @@ def api_search():
 # ─── CSVエクスポート ──────────────────────────────────────
 @app.route("/api/export", methods=["GET"])
 def api_export():
-    export_path = os.path.join(BASE_DIR, "export.csv")
-    database.export_csv(export_path)
-    with open(export_path, "r", encoding="utf-8-sig") as f:
-        content = f.read()
+    """
+    CSVをストリーミングで返す（/api/items と同じ title/source/category で絞り込み可）。
+    ?gzip=1 なら gzip 圧縮した goods_info.csv.gz を返す。
+    """
+    chunks = database.iter_csv(
+        request.args.get("title"),
+        request.args.get("source"),
+        request.args.get("category"),
+    )
+    filename = "goods_info.csv"
+    mimetype = "text/csv"
+    if request.args.get("gzip") == "1":
+        chunks = _gzip_stream(chunks)
+        filename += ".gz"
+        mimetype = "application/gzip"
     return Response(
-        content,
-        mimetype="text/csv",
-        headers={"Content-Disposition": "attachment; filename=goods_info.csv"}
+        chunks,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+# ─── メトリクス（DB接続プールの統計は db_pool として出力） ──────────────
+@app.route("/metrics", methods=["GET"])
+def api_metrics():
+    # 外部へのリクエスト数やキューの深さを含むので、METRICS_TOKEN を設定したときだけ
+    # Authorization: Bearer <METRICS_TOKEN> 付きのリクエストに返す（Prometheus の authorization 設定で送る）
+    auth_header = request.headers.get("Authorization", "")
+    if not METRICS_TOKEN:
+        return jsonify({"status": "error", "message": "Not Found"}), 404
+    if not metrics.authorized(auth_header, METRICS_TOKEN):
+        return jsonify({"status": "error", "message": "Unauthorized"}), 401
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 # ─── 静的ファイル ──────────────────────────────────────────────
 @app.route("/")
 def index():
@@ -687,12 +736,6 @@ if __name__ == "__main__":
         except Exception:
             pass
             
-    database.init_db()
-    # DB拡張（スコアカラムが未追加の場合に追加）
-    try:
-        from setup_targets import upgrade_goods_table
-        upgrade_goods_table()
-    except Exception as e:
-        print(f"[Server] DBアップグレードをスキップ: {e}")
+    # スキーマはモジュール読み込み時の database.init_db()（マイグレーション）で最新化済み
     print("[Server] http://localhost:5000 で起動中...")
     app.run(host="0.0.0.0", port=5000, debug=False)
@@ -9,76 +9,40 @@ DB_PATH     = os.path.join(BASE_DIR, "goods_info.db")
 TARGETS_FILE = os.path.join(BASE_DIR, "anime_targets.json")
 
 def setup_targets_table():
-    conn = database.get_db_connection()
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS anime_targets (
-            id       INTEGER PRIMARY KEY AUTOINCREMENT,
-            name_ja  TEXT UNIQUE,
-            name_en  TEXT,
-            genre    TEXT,
-            reason   TEXT,
-            enabled  INTEGER DEFAULT 1,
-            added_at TEXT DEFAULT (datetime('now','localtime'))
-        )
-    """)
-    conn.commit()
-
+    # テーブル作成はマイグレーション（migrations.py）で行う
+    database.init_db()
     with open(TARGETS_FILE, "r", encoding="utf-8") as f:
         targets = json.load(f)
 
-    inserted = 0
-    is_postgres = bool(os.getenv("DATABASE_URL"))
-    for t in targets:
-        try:
-            if is_postgres:
-                c.cursor.execute("SAVEPOINT sp1")
-            c.execute("""
-                INSERT INTO anime_targets (name_ja, name_en, genre, reason)
-                VALUES (?, ?, ?, ?)
-            """, (t["name_ja"], t["name_en"], t["genre"], t["reason"]))
-            if is_postgres:
-                c.cursor.execute("RELEASE SAVEPOINT sp1")
-            inserted += 1
-        except Exception:
-            if is_postgres:
-                c.cursor.execute("ROLLBACK TO SAVEPOINT sp1")
+    conn = database.get_db_connection()
+    try:
+        c = conn.cursor()
+        inserted = 0
+        is_postgres = bool(os.getenv("DATABASE_URL"))
+        for t in targets:
+            try:
+                if is_postgres:
+                    c.cursor.execute("SAVEPOINT sp1")
+                c.execute("""
+                    INSERT INTO anime_targets (name_ja, name_en, genre, reason)
+                    VALUES (?, ?, ?, ?)
+                """, (t["name_ja"], t["name_en"], t["genre"], t["reason"]))
+                if is_postgres:
+                    c.cursor.execute("RELEASE SAVEPOINT sp1")
+                inserted += 1
+            except Exception:
+                if is_postgres:
+                    c.cursor.execute("ROLLBACK TO SAVEPOINT sp1")
 
-    conn.commit()
-    conn.close()
+        conn.commit()
+    finally:
+        conn.close()
     print(f"[TARGETS] {inserted}/{len(targets)} 件を登録しました。")
 
 # goods_info テーブルに score/priority カラムを追加
 def upgrade_goods_table():
-    conn = database.get_db_connection()
-    c = conn.cursor()
-    try:
-        c.execute("ALTER TABLE goods_info ADD COLUMN freshness_score INTEGER DEFAULT 0")
-        print("[DB] freshness_score カラムを追加")
-    except Exception:
-        pass
-    try:
-        c.execute("ALTER TABLE goods_info ADD COLUMN rarity_score INTEGER DEFAULT 0")
-        print("[DB] rarity_score カラムを追加")
-    except Exception:
-        pass
-    try:
-        c.execute("ALTER TABLE goods_info ADD COLUMN reliability_score INTEGER DEFAULT 0")
-        print("[DB] reliability_score カラムを追加")
-    except Exception:
-        pass
-    try:
-        c.execute("ALTER TABLE goods_info ADD COLUMN total_score INTEGER DEFAULT 0")
-        print("[DB] total_score カラムを追加")
-    except Exception:
-        pass
-    try:
-        c.execute("ALTER TABLE goods_info ADD COLUMN priority_level TEXT DEFAULT ''")
-        print("[DB] priority_level カラムを追加")
-    except Exception:
-        pass
-    conn.commit()
-    conn.close()
+    # スコア系カラムはマイグレーション v2 で追加される（旧来の呼び出し元との互換用）
+    database.init_db()
 
 if __name__ == "__main__":
     setup_targets_table()
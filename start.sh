@@ -3,7 +3,9 @@
 python3 -c "import database; database.init_db()"
 # アニメターゲット登録（重複自動スキップ）
 python3 setup_targets.py
-# クローラーをバックグラウンドで起動
-python3 crawler.py &
+# クローラーをバックグラウンドで起動（Webを複数台に増やしても同じターゲットを重複して巡回しないようクラスタモードで動かす）
+python3 crawler.py --cluster &
+# 新着通知の送信ワーカーをバックグラウンドで起動
+python3 notifier.py &
 # Webサーバー起動
 gunicorn server:app --bind 0.0.0.0:${PORT:-5000}
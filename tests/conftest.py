@@ -0,0 +1,71 @@
+"""
+テスト共通のフィクスチャ。DBはテストごとに一時ディレクトリの SQLite を作り直す
+（DATABASE_URL が設定されていても PostgreSQL には接続しない）。
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_URL", None)
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "goods_info.db"))
+    database.init_db()
+    return database
+
+
+@pytest.fixture
+def baseline_db(tmp_path, monkeypatch):
+    """
+    マイグレーション導入前の init_db が作っていた goods_info だけがあるDB（url_hash も schema_version も無い）。
+    legacy_rows で行を入れてから、テスト側で init_db() を呼ぶ
+    """
+    monkeypatch.setattr(database, "DATABASE_URL", None)
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "goods_info.db"))
+    with sqlite3.connect(database.DB_PATH) as conn:
+        conn.execute("""
+            CREATE TABLE goods_info (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT, content TEXT, author TEXT, source_url TEXT,
+                source_type TEXT, category TEXT, date TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                freshness_score INTEGER DEFAULT 0, rarity_score INTEGER DEFAULT 0,
+                reliability_score INTEGER DEFAULT 0, total_score INTEGER DEFAULT 0,
+                priority_level TEXT DEFAULT '', image_url TEXT DEFAULT ''
+            )
+        """)
+    conn.close()
+    return database
+
+
+def legacy_rows(rows):
+    """baseline_db に旧コードと同じ形で行を入れる。rows: [{"source_url": ..., "date": ..., ...}]"""
+    conn = sqlite3.connect(database.DB_PATH)
+    try:
+        for row in rows:
+            row = {"title": "テスト作品", "content": "予約開始", "source_type": "Google",
+                   "category": "その他", "date": "2026-10-01 12:00:00", **row}
+            conn.execute(f"INSERT INTO goods_info ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                         tuple(row.values()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def query_all(sql: str, params=()) -> list:
+    """読み取り専用接続で SELECT して dict のリストを返す"""
+    conn = database.get_db_connection(readonly=True)
+    conn.row_factory = database.sqlite3.Row
+    try:
+        c = conn.cursor()
+        c.execute(sql, params)
+        return [dict(r) for r in c.fetchall()]
+    finally:
+        conn.close()
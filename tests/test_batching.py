@@ -0,0 +1,68 @@
+"""まとめ検索: クエリ長での組分けと、記事の別名一致による作品ごとの振り分け"""
+
+import pytest
+
+import crawler
+
+
+def _targets(*names):
+    return [{"name_ja": n} for n in names]
+
+
+# ─── build_search_query / pack_batches ─────────────────────────
+def test_build_search_query():
+    assert crawler.build_search_query(["呪術廻戦"]) == f'"呪術廻戦" {crawler.SEARCH_KEYWORDS}'
+    assert crawler.build_search_query(["A作品", "B作品"]) == f'("A作品" OR "B作品") {crawler.SEARCH_KEYWORDS}'
+
+
+def test_pack_batches_respects_query_length(monkeypatch):
+    names = [c * 60 for c in "あいうえ"]
+    # 3作品までは収まり、4作品目で溢れる長さにする
+    monkeypatch.setattr(crawler, "GNEWS_QUERY_MAX_CHARS", len(crawler.build_search_query(names[:3])))
+    batches = crawler.pack_batches(_targets(*names))
+    assert [len(b) for b in batches] == [3, 1]
+    assert [t["name_ja"] for b in batches for t in b] == names
+    for b in batches:
+        assert len(crawler.build_search_query([t["name_ja"] for t in b])) <= crawler.GNEWS_QUERY_MAX_CHARS
+
+
+def test_pack_batches_keeps_oversized_target_alone(monkeypatch):
+    monkeypatch.setattr(crawler, "GNEWS_QUERY_MAX_CHARS", 80)
+    batches = crawler.pack_batches(_targets("短い", "長" * 100, "短い2"))
+    assert [[t["name_ja"] for t in b] for b in batches] == [["短い"], ["長" * 100], ["短い2"]]
+
+
+# ─── normalize_alias / demux_items ─────────────────────────────
+@pytest.mark.parametrize("text, expected", [
+    ("ＡＢＣ", "abc"),
+    ("Blue Lock", "bluelock"),
+    ("ｶﾞﾝﾀﾞﾑ", "ガンダム"),
+    (None, ""),
+])
+def test_normalize_alias(text, expected):
+    assert crawler.normalize_alias(text) == expected
+
+
+def test_demux_matches_name_ja_and_name_en():
+    targets = [
+        {"name_ja": "ブルーロック", "name_en": "Blue Lock"},
+        {"name_ja": "ＡＢＣ物語", "name_en": None},
+    ]
+    items = [
+        {"title": "BLUE LOCK POP UP STORE 開催", "content": ""},
+        {"title": "ABC物語 一番くじ", "content": ""},
+        {"title": "新作グッズ", "content": "ブルーロックとABC物語のコラボカフェ"},
+        {"title": "無関係な記事", "content": "フィギュア予約開始"},
+    ]
+    assert crawler.demux_items(items, targets) == [
+        ["ブルーロック"],
+        ["ＡＢＣ物語"],
+        ["ブルーロック", "ＡＢＣ物語"],
+        [],
+    ]
+
+
+def test_short_aliases_are_ignored():
+    target = {"name_ja": "ハイキュー!!", "name_en": "A"}
+    assert crawler.target_aliases(target) == ["ハイキュー!!"]
+    assert crawler.demux_items([{"title": "A賞 フィギュア"}], [target]) == [[]]
@@ -0,0 +1,68 @@
+"""クラスタモード: シャードによるターゲットの絞り込みと、ハートビートでのシャードの配分・引き継ぎ"""
+
+import time
+
+from conftest import query_all
+
+
+def _add_targets(db, count):
+    db.run_write(lambda conn: conn.cursor().executemany(
+        "INSERT INTO anime_targets (name_ja) VALUES (?)", [(f"作品{i:03d}",) for i in range(count)]))
+    return {r["name_ja"]: r["id"] for r in query_all("SELECT id, name_ja FROM anime_targets")}
+
+
+def test_claim_is_limited_to_owned_shards(db):
+    ids = _add_targets(db, 100)
+    shards = [0, 5, 31]
+    claimed = db.claim_due_targets(100, shards=shards)
+    assert claimed
+    assert all(ids[t["name_ja"]] % db.CLUSTER_SHARDS in shards for t in claimed)
+    assert len(claimed) == sum(1 for i in ids.values() if i % db.CLUSTER_SHARDS in shards)
+
+
+def test_claim_with_no_shards_returns_nothing(db):
+    _add_targets(db, 10)
+    assert db.claim_due_targets(10, shards=[]) == []
+    assert len(db.claim_due_targets(10, shards=None)) == 10
+
+
+def test_shards_are_split_between_workers_without_overlap(db):
+    a = db.cluster_heartbeat("worker-a")
+    assert a == list(range(db.CLUSTER_SHARDS))
+    # b が参加すると、a は次のハートビートで取り分を超えた分を返し、b がそれを取る
+    db.cluster_heartbeat("worker-b")
+    a = db.cluster_heartbeat("worker-a")
+    b = db.cluster_heartbeat("worker-b")
+    assert len(a) == len(b) == db.CLUSTER_SHARDS // 2
+    assert not set(a) & set(b)
+    assert sorted(a + b) == list(range(db.CLUSTER_SHARDS))
+
+
+def test_shards_of_a_leaving_worker_are_taken_over(db):
+    db.cluster_heartbeat("worker-a")
+    db.cluster_heartbeat("worker-b")
+    db.cluster_heartbeat("worker-a")
+    db.cluster_heartbeat("worker-b")
+    db.cluster_leave("worker-a")
+    assert db.cluster_heartbeat("worker-b") == list(range(db.CLUSTER_SHARDS))
+
+
+def test_shards_of_a_dead_worker_are_taken_over(db):
+    db.cluster_heartbeat("worker-a", lease_seconds=1)
+    db.cluster_heartbeat("worker-b", lease_seconds=1)
+    db.cluster_heartbeat("worker-a", lease_seconds=1)
+    assert len(db.cluster_heartbeat("worker-b", lease_seconds=1)) == db.CLUSTER_SHARDS // 2
+    # a はハートビートを送らなくなる
+    time.sleep(1.2)
+    assert db.cluster_heartbeat("worker-b", lease_seconds=1) == list(range(db.CLUSTER_SHARDS))
+    assert [w["worker_id"] for w in db.get_cluster_status()] == ["worker-b"]
+
+
+def test_shard_filter_sql(db, monkeypatch):
+    assert db._shard_filter(None) == ("", ())
+    assert db._shard_filter([3, 7]) == (" AND (id % ?) IN (?, ?)", (db.CLUSTER_SHARDS, 3, 7))
+    # psycopg に渡すときは % をエスケープする
+    monkeypatch.setattr(db, "DATABASE_URL", "postgresql://example/db")
+    sql, params = db._shard_filter([])
+    assert db.to_postgres_sql(sql) == " AND (id %% %s) IN (%s)"
+    assert params == (db.CLUSTER_SHARDS, -1)
@@ -0,0 +1,96 @@
+"""重複圧縮: 同じ正規化URLの行は最も古い id だけを残し、url_hash を振り直すこと（既存DBは init_db で）"""
+
+from conftest import legacy_rows, query_all
+from urlnorm import url_hash
+
+ARTICLE = "https://natalie.mu/comic/news/12345"
+
+
+def _insert_legacy(db, rows):
+    """url_hash 導入前の行として url_hash を NULL のまま入れる。Returns: 挿入順の id"""
+    def job(conn):
+        c = conn.cursor()
+        ids = []
+        for source_url, image_url in rows:
+            c.execute("""
+                INSERT INTO goods_info (date, title, content, source_url, source_type, category, image_url)
+                VALUES ('2026-10-01 12:00:00', 'テスト作品', '予約開始', ?, 'Google', 'その他', ?)
+            """, (source_url, image_url))
+            ids.append(c.lastrowid)
+        return ids
+    return db.run_write(job)
+
+
+def test_keeps_oldest_row_and_inherits_image(db):
+    ids = _insert_legacy(db, [
+        (ARTICLE, None),
+        ("http://www.natalie.mu/comic/news/12345/?utm_source=twitter#top", "https://img.example.com/a.jpg"),
+        (f"{ARTICLE}?fbclid=abc", "https://img.example.com/b.jpg"),
+        ("https://natalie.mu/comic/news/99999", None),
+    ])
+    result = db.compact_duplicates(batch_size=1)
+    assert result == {"kept": 2, "deleted": 2, "rehashed": 2}
+
+    rows = query_all("SELECT id, source_url, url_hash, image_url FROM goods_info ORDER BY id")
+    assert [r["id"] for r in rows] == [ids[0], ids[3]]
+    assert rows[0]["source_url"] == ARTICLE
+    assert rows[0]["url_hash"] == url_hash(ARTICLE)
+    # 最初に見つかった重複側の画像を引き継ぐ
+    assert rows[0]["image_url"] == "https://img.example.com/a.jpg"
+    assert rows[1]["url_hash"] == url_hash("https://natalie.mu/comic/news/99999")
+    assert db.get_facet_counts("category") == [{"value": "その他", "count": 2}]
+
+
+def test_keeper_image_is_not_overwritten(db):
+    ids = _insert_legacy(db, [
+        (ARTICLE, "https://img.example.com/original.jpg"),
+        (f"{ARTICLE}/", "https://img.example.com/other.jpg"),
+    ])
+    db.compact_duplicates()
+    rows = query_all("SELECT id, image_url FROM goods_info")
+    assert rows == [{"id": ids[0], "image_url": "https://img.example.com/original.jpg"}]
+
+
+def test_is_idempotent(db):
+    _insert_legacy(db, [(ARTICLE, None), (f"{ARTICLE}?utm_medium=social", None)])
+    db.compact_duplicates()
+    assert db.compact_duplicates() == {"kept": 1, "deleted": 0, "rehashed": 0}
+
+
+# ─── 既存DBの移行（migrations.m015） ─────────────────────────
+def test_init_db_backfills_url_hash_on_baseline_db(baseline_db):
+    db = baseline_db
+    legacy_rows([
+        {"source_url": "https://example.com/a?utm_source=z"},
+        {"source_url": "https://example.com/a", "image_url": "https://img.example.com/a.jpg"},
+        {"source_url": ""},
+        {"source_url": None},
+    ])
+    db.init_db()
+
+    rows = query_all("SELECT id, url_hash, image_url FROM goods_info ORDER BY id")
+    assert [r["id"] for r in rows] == [1, 3, 4]
+    assert rows[0]["url_hash"] == url_hash("https://example.com/a")
+    assert rows[0]["image_url"] == "https://img.example.com/a.jpg"
+    assert rows[1]["url_hash"] is None and rows[2]["url_hash"] is None
+    # 既存行と同じ記事は一意インデックスで弾かれる
+    assert db.insert_items([{"source_url": "https://example.com/a", "title": "テスト作品"}]) == []
+
+
+def test_items_without_url_do_not_collide(db):
+    saved = db.insert_items([{"title": "リンクなし1", "source_url": ""},
+                             {"title": "リンクなし2", "source_url": "  "},
+                             {"title": "リンクなし3"}])
+    assert len(saved) == 3
+    assert [r["url_hash"] for r in query_all("SELECT url_hash FROM goods_info")] == [None] * 3
+    # 圧縮でもまとめない
+    assert db.compact_duplicates() == {"kept": 0, "deleted": 0, "rehashed": 0}
+    assert len(query_all("SELECT id FROM goods_info")) == 3
+
+
+def test_compact_clears_empty_url_hash(db):
+    _insert_legacy(db, [("", None), ("", None)])
+    db.run_write(lambda conn: conn.cursor().execute(
+        "UPDATE goods_info SET url_hash = ? WHERE id = 1", (url_hash(""),)))
+    assert db.compact_duplicates()["rehashed"] == 1
+    assert [r["url_hash"] for r in query_all("SELECT url_hash FROM goods_info")] == [None, None]
@@ -0,0 +1,27 @@
+"""DB接続: close() / with で返却され、close() し忘れは警告だけで返却しないこと"""
+
+import gc
+
+import pytest
+
+
+def test_close_returns_thread_local_connection(db):
+    conn = db.get_db_connection(readonly=True)
+    raw = conn.conn
+    conn.close()
+    with db.get_db_connection(readonly=True) as again:
+        assert again.conn is raw
+
+
+def test_unclosed_connection_only_warns(db):
+    conn = db.get_db_connection(readonly=True)
+    raw = conn.conn
+    with pytest.warns(ResourceWarning):
+        del conn
+        gc.collect()
+    # 返却されていないので、このスレッドの接続は使用中のまま（次は使い捨ての接続になる）
+    other = db.get_db_connection(readonly=True)
+    try:
+        assert other.conn is not raw
+    finally:
+        other.close()
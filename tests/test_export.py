@@ -0,0 +1,58 @@
+"""CSVエクスポート: chunk_size 行ずつの bytes として順に返し、つなげると全件のCSVになること"""
+
+import csv
+import io
+
+
+def _insert(db, n):
+    db.insert_items([{
+        "date": f"2026-10-{1 + i:02d} 12:00:00",
+        "title": "テスト作品",
+        "content": f"第{i}弾, \"限定\"\n予約開始",
+        "source_url": f"https://example.com/export/{i}",
+        "source_type": "Google",
+        "category": "一番くじ" if i % 2 else "その他",
+    } for i in range(n)])
+
+
+def _parse(data: bytes) -> list:
+    text = data.decode("utf-8")
+    assert text.startswith("﻿")
+    return list(csv.DictReader(io.StringIO(text[1:])))
+
+
+def test_iter_csv_yields_chunks(db):
+    _insert(db, 7)
+    chunks = list(db.iter_csv(chunk_size=3))
+    assert len(chunks) == 3
+    # ヘッダとBOMは最初のチャンクだけ
+    assert chunks[0].startswith("﻿".encode("utf-8"))
+    assert not any(c.startswith("﻿".encode("utf-8")) for c in chunks[1:])
+    rows = _parse(b"".join(chunks))
+    assert [r["source_url"] for r in rows] == [f"https://example.com/export/{i}" for i in reversed(range(7))]
+    assert rows[0]["content"] == "第6弾, \"限定\"\n予約開始"
+
+
+def test_iter_csv_is_lazy(db):
+    _insert(db, 5)
+    chunks = db.iter_csv(chunk_size=2)
+    assert len(_parse(next(chunks))) == 2   # 最初の2行だけで返る
+    assert True in db._sqlite_local.in_use  # 読み取り接続はまだ使用中
+    chunks.close()                          # 途中で打ち切っても接続は返却される
+    assert db._sqlite_local.in_use == set()
+
+
+def test_iter_csv_with_filter_and_empty(db):
+    _insert(db, 6)
+    rows = _parse(b"".join(db.iter_csv(category_filter="一番くじ")))
+    assert {r["category"] for r in rows} == {"一番くじ"} and len(rows) == 3
+    assert list(db.iter_csv(category_filter="存在しない")) == []
+
+
+def test_export_csv_writes_file(db, tmp_path):
+    path = tmp_path / "export.csv"
+    db.export_csv(str(path))
+    assert not path.exists()   # 0件ならファイルを残さない
+    _insert(db, 4)
+    db.export_csv(str(path))
+    assert len(_parse(path.read_bytes())) == 4
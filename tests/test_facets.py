@@ -0,0 +1,64 @@
+"""facet_counts: 挿入・重複圧縮・マイグレーションの後も goods_info の GROUP BY と一致すること"""
+
+import pytest
+
+from conftest import legacy_rows, query_all
+
+
+def _actual(facet):
+    return [{"value": r["value"], "count": r["n"]} for r in query_all(
+        f"SELECT COALESCE({facet}, '') AS value, COUNT(*) AS n FROM goods_info GROUP BY 1 ORDER BY 1")]
+
+
+def _assert_consistent(db):
+    for facet in db.FACETS:
+        assert db.get_facet_counts(facet) == _actual(facet)
+
+
+def _items(*specs):
+    return [{"title": title, "category": category, "source_url": f"https://example.com/{path}"}
+            for path, title, category in specs]
+
+
+@pytest.mark.parametrize("writer", [False, True])
+def test_counts_follow_inserts(db, writer):
+    if writer:
+        db.start_sqlite_writer()
+    try:
+        db.insert_items(_items(("1", "作品A", "一番くじ"), ("2", "作品A", "フィギュア"), ("3", "作品B", "一番くじ")))
+        # 重複で挿入されなかった行は数えない
+        db.insert_items(_items(("1", "作品A", "一番くじ"), ("4", "作品B", "")))
+    finally:
+        db.stop_sqlite_writer()
+    _assert_consistent(db)
+    assert db.get_facet_counts("title") == [{"value": "作品A", "count": 2}, {"value": "作品B", "count": 2}]
+
+
+def test_failed_insert_leaves_counts_unchanged(db, monkeypatch):
+    db.insert_items(_items(("1", "作品A", "一番くじ")))
+    insert_rows = db._insert_goods_rows
+    def fail_after_insert(conn, rows):
+        insert_rows(conn, rows)
+        raise RuntimeError("boom")
+    monkeypatch.setattr(db, "_insert_goods_rows", fail_after_insert)
+    with pytest.raises(RuntimeError):
+        db.insert_items(_items(("2", "作品A", "一番くじ")))
+    assert db.get_facet_counts("title") == [{"value": "作品A", "count": 1}]
+
+
+def test_counts_follow_compaction(baseline_db):
+    db = baseline_db
+    legacy_rows([
+        {"source_url": "https://example.com/a", "title": "作品A", "category": "一番くじ"},
+        {"source_url": "https://example.com/a?utm_source=x", "title": "作品A", "category": "一番くじ"},
+        {"source_url": "https://example.com/b", "title": "作品B", "category": None},
+    ])
+    db.init_db()   # m007 で集計、m015 で重複を消して作り直す
+    _assert_consistent(db)
+    assert db.get_facet_counts("title") == [{"value": "作品A", "count": 1}, {"value": "作品B", "count": 1}]
+
+    db.insert_items(_items(("c", "作品B", "フィギュア")))
+    db.run_write(lambda conn: conn.cursor().execute(
+        "UPDATE goods_info SET url_hash = NULL, source_url = 'https://example.com/c/' WHERE id = 1"))
+    db.compact_duplicates()
+    _assert_consistent(db)
@@ -0,0 +1,104 @@
+"""条件付きRSS取得: 304 と記事リンクが前回と同じフィードはフィルタ以降の処理を丸ごと省くこと"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+import crawler
+import http_client
+from conftest import query_all
+
+
+def _rss(items):
+    entries = "".join(
+        f"<item><title>{title}</title><link>https://example.com/{path}</link>"
+        f"<pubDate>{pub}</pubDate><source>テスト</source></item>"
+        for path, title, pub in items)
+    return f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>{entries}</channel></rss>'.encode("utf-8")
+
+
+@pytest.fixture
+def feed(db, monkeypatch):
+    """ETag 付きでRSSを返すスタブ。feed.etag / feed.items を書き換えると次の応答が変わる"""
+    state = SimpleNamespace(etag='"v1"', items=[], requests=[], filtered=[], enriched=[])
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state.requests.append(self.headers.get("If-None-Match"))
+            if self.headers.get("If-None-Match") == state.etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = _rss(state.items)
+            self.send_response(200)
+            self.send_header("ETag", state.etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    monkeypatch.setattr(crawler, "GNEWS_RSS_URL", f"http://127.0.0.1:{srv.server_address[1]}/rss/search")
+    monkeypatch.setattr(http_client, "_breakers", {})
+    monkeypatch.setattr(http_client, "_buckets", {})
+    # フィルタ・画像取得に渡った記事を記録する（呼ばれなければ処理を省けている）
+    monkeypatch.setattr(crawler.goods_filter, "filter_items", lambda items: state.filtered.append(items) or items)
+    monkeypatch.setattr(crawler, "enrich_images", lambda items: state.enriched.append(items) or items)
+    yield state
+    srv.shutdown()
+    srv.server_close()
+
+
+def _urls(batch):
+    return [i["source_url"].rsplit("/", 1)[1] for i in batch]
+
+
+def test_not_modified_and_unchanged_feeds_skip_the_pipeline(feed):
+    feed.items = [("a", "作品 一番くじ", "Fri, 16 Oct 2026 09:00:00 GMT"),
+                  ("b", "作品 フィギュア", "Fri, 16 Oct 2026 10:00:00 GMT")]
+    assert crawler.process_target("作品")["saved"] == 2
+    assert [_urls(b) for b in feed.filtered] == [["a", "b"]]
+
+    # 304: 前回の ETag を送り、記事の解析もしない
+    assert crawler.process_target("作品") == {"fetched": 0, "saved": 0, "per_title": {"作品": 0}}
+    assert feed.requests == [None, '"v1"']
+
+    # ETag は変わったが記事リンクの集合は同じ（並び替えだけ）
+    feed.etag = '"v2"'
+    feed.items = feed.items[::-1]
+    assert crawler.process_target("作品")["saved"] == 0
+    assert len(feed.filtered) == 1 and len(feed.enriched) == 1
+
+    state = crawler.database.get_feed_state(crawler.build_search_query(["作品"]))
+    assert state["etag"] == '"v2"'
+    assert state["newest_pubdate"] == "2026-10-16 10:00:00"
+
+
+def test_only_new_articles_reach_the_filter(feed):
+    feed.items = [("a", "作品 一番くじ", "Fri, 16 Oct 2026 09:00:00 GMT")]
+    crawler.process_target("作品")
+    feed.etag = '"v2"'
+    feed.items += [("old", "作品 古い記事", "Thu, 01 Oct 2026 09:00:00 GMT"),
+                   ("c", "作品 新作", "Sat, 17 Oct 2026 09:00:00 GMT")]
+    assert crawler.process_target("作品")["saved"] == 1
+    # 保存済みの a と、前回の最新日時より古い old はフィルタに渡らない
+    assert [_urls(b) for b in feed.filtered] == [["a"], ["c"]]
+    assert sorted(r["source_url"] for r in query_all("SELECT source_url FROM goods_info")) == \
+        ["https://example.com/a", "https://example.com/c"]
+
+
+def test_state_is_not_saved_when_insert_fails(feed, monkeypatch):
+    feed.items = [("a", "作品 一番くじ", "Fri, 16 Oct 2026 09:00:00 GMT")]
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("db down")
+    monkeypatch.setattr(crawler.database, "insert_items", fail)
+    with pytest.raises(RuntimeError):
+        crawler.process_target("作品")
+    # ETag を保存していないので、次回は条件なしで取り直す
+    assert crawler.database.get_feed_state(crawler.build_search_query(["作品"]))["etag"] == ""
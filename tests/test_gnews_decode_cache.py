@@ -0,0 +1,67 @@
+"""Google News URL デコードキャッシュ: 成功は永続、失敗は GNEWS_NEGATIVE_TTL の間だけ再試行しないこと"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import caches
+import crawler
+
+GNEWS = "https://news.google.com/rss/articles/AU_yqLNewArticleId"
+ARTICLE = "https://natalie.mu/comic/news/12345"
+
+
+@pytest.fixture
+def decoder(db, monkeypatch):
+    """デコードの呼び出し回数を数える。results に入れた結果を順に返す（None は失敗）"""
+    monkeypatch.setattr(caches, "gnews_decode", caches.GnewsDecodeCache(negative_ttl=0.3))
+    calls = []
+    results = []
+
+    def decode(url):
+        calls.append(url)
+        result = results.pop(0) if results else ARTICLE
+        return result or url   # 失敗時は元のURLを返す
+    monkeypatch.setattr(crawler, "_decode_google_news_url_uncached", decode)
+    return SimpleNamespace(calls=calls, results=results)
+
+
+def test_success_is_decoded_once(decoder):
+    assert crawler.decode_google_news_url(GNEWS) == ARTICLE
+    assert crawler.decode_google_news_url(GNEWS + "?oc=5") == ARTICLE   # 正規化後のハッシュが同じ
+    assert len(decoder.calls) == 1
+
+
+def test_success_survives_restart(decoder, monkeypatch):
+    crawler.decode_google_news_url(GNEWS)
+    # プロセスを起動し直してメモリ上のLRUが空でも、DBから引ける
+    monkeypatch.setattr(caches, "gnews_decode", caches.GnewsDecodeCache(negative_ttl=0.3))
+    assert crawler.decode_google_news_url(GNEWS) == ARTICLE
+    assert len(decoder.calls) == 1
+
+
+def test_failure_is_retried_after_negative_ttl(decoder, monkeypatch):
+    decoder.results.append(None)
+    assert crawler.decode_google_news_url(GNEWS) == GNEWS
+    assert crawler.decode_google_news_url(GNEWS) == GNEWS
+    # 別プロセス（LRUが空）でも、DBの checked_at から期限内なら再試行しない
+    monkeypatch.setattr(caches, "gnews_decode", caches.GnewsDecodeCache(negative_ttl=0.3))
+    assert caches.gnews_decode.get(GNEWS) is None
+    assert len(decoder.calls) == 1
+
+    time.sleep(0.35)
+    assert crawler.decode_google_news_url(GNEWS) == ARTICLE
+    assert len(decoder.calls) == 2
+
+
+def test_lru_entry_expires():
+    lru = caches.LRUCache(2)
+    lru.put("a", 1, ttl=0.1)
+    lru.put("b", 2)
+    lru.put("c", 3)            # 上限超過で最も古い a を追い出す
+    assert lru.get("a") is caches.MISS
+    lru.put("d", 4, ttl=0.1)
+    time.sleep(0.15)
+    assert lru.get("d") is caches.MISS
+    assert lru.get("c") == 3
@@ -0,0 +1,203 @@
+"""http_client: 再試行の対象・同時実行数の枠・サーキットブレーカー・Retry-After"""
+
+import ssl
+import threading
+import time
+import urllib.error
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import http_client
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    # ブレーカー・レート制限はホスト単位のプロセス共有状態なので、テストごとに作り直す
+    monkeypatch.setattr(http_client, "_breakers", {})
+    monkeypatch.setattr(http_client, "_buckets", {})
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_BASE", 0.01)
+
+
+@pytest.fixture
+def server():
+    """
+    /slow は応答ヘッダを返す前に 1 秒待つ。/busy-<秒数> は初回だけ Retry-After 付きの 503 を返す。
+    それ以外はすぐ 200 を返す。パスごとのリクエスト数を数える
+    """
+    hits = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits[self.path] = hits.get(self.path, 0) + 1
+            if self.path == "/slow":
+                time.sleep(1)
+            if self.path.startswith("/busy-") and hits[self.path] == 1:
+                self.send_response(503)
+                self.send_header("Retry-After", self.path[len("/busy-"):])
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = b"ok" * 1000
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    srv.hits = hits
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}"
+    yield srv
+    srv.shutdown()
+
+
+def test_read_timeout_is_not_retried(server):
+    with pytest.raises(Exception) as excinfo:
+        http_client.get(f"{server.url}/slow", timeout=0.3)
+    assert not isinstance(excinfo.value, http_client.CircuitOpenError)
+    assert server.hits["/slow"] == 1
+    # 失敗としてはブレーカーに数える
+    assert http_client.breaker_for("127.0.0.1").failures == 1
+
+
+def test_connect_error_is_retried():
+    # 使われていないポートへの接続は即座に拒否される
+    with pytest.raises(Exception):
+        http_client.get("http://127.0.0.1:9/", timeout=1)
+    assert http_client.breaker_for("127.0.0.1").failures == http_client.HTTP_RETRIES + 1
+
+
+def test_tls_failure_is_not_retried(server):
+    # 平文のサーバーに https で接続すると TLS ハンドシェイクで失敗する（証明書エラーと同じく再送しても変わらない）
+    with pytest.raises(Exception) as excinfo:
+        http_client.get(server.url.replace("http://", "https://") + "/", timeout=2)
+    assert not http_client.is_retryable(excinfo.value)
+    assert http_client.breaker_for("127.0.0.1").failures == 1
+
+
+def test_is_retryable():
+    assert http_client.is_retryable(ConnectionRefusedError())
+    assert http_client.is_retryable(urllib.error.URLError(ConnectionRefusedError()))
+    assert not http_client.is_retryable(urllib.error.URLError(ssl.SSLCertVerificationError()))
+    assert not http_client.is_retryable(TimeoutError())
+    if http_client.HAS_REQUESTS:
+        assert http_client.is_retryable(http_client.req_lib.ConnectionError())
+        assert http_client.is_retryable(http_client.req_lib.ConnectTimeout())
+        assert not http_client.is_retryable(http_client.req_lib.exceptions.SSLError())
+        assert not http_client.is_retryable(http_client.req_lib.exceptions.ProxyError())
+
+
+def test_stream_holds_the_concurrency_slot_until_closed(server, monkeypatch):
+    monkeypatch.setattr(http_client, "_global_slots", threading.BoundedSemaphore(1))
+    done = threading.Event()
+
+    with http_client.stream(f"{server.url}/a") as r:
+        worker = threading.Thread(target=lambda: (http_client.get(f"{server.url}/b"), done.set()))
+        worker.start()
+        # 本文を読み終えるまでは枠が空かないので、他のリクエストは送られない
+        assert not done.wait(0.3)
+        assert b"".join(r.iter_content(1024))
+    assert done.wait(5)
+    worker.join()
+    # 枠はすべて返却されている
+    assert http_client._global_slots.acquire(blocking=False)
+
+
+# ─── サーキットブレーカー ─────────────────────────────────────
+def test_breaker_opens_after_consecutive_failures():
+    breaker = http_client.CircuitBreaker("example.com", failures=3, cooldown=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    breaker.before_call()
+    breaker.record_success()   # 成功で連続失敗数は数え直し
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record_failure()
+    with pytest.raises(http_client.CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert 0 < excinfo.value.remaining <= 60
+
+
+def test_half_open_allows_one_probe_then_closes_on_success():
+    breaker = http_client.CircuitBreaker("example.com", failures=2, cooldown=0.2)
+    breaker.record_failure()
+    breaker.record_failure()
+    with pytest.raises(http_client.CircuitOpenError):
+        breaker.before_call()
+    time.sleep(0.25)
+    breaker.before_call()             # half-open: 1件だけ通す
+    with pytest.raises(http_client.CircuitOpenError):
+        breaker.before_call()         # 試し送信の結果が出るまで他は通さない
+    breaker.record_success()
+    assert breaker.failures == 0
+    for _ in range(3):
+        breaker.before_call()         # closed に戻る
+
+
+def test_failed_probe_reopens():
+    breaker = http_client.CircuitBreaker("example.com", failures=2, cooldown=0.2)
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(0.25)
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(http_client.CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.remaining > 0.1
+
+
+# ─── Retry-After ─────────────────────────────────────────────
+class _Headers:
+    def __init__(self, retry_after=None):
+        self.headers = {"Retry-After": retry_after} if retry_after is not None else {}
+
+
+def test_retry_after_parsing():
+    assert http_client._retry_after(_Headers("5")) == 5.0
+    assert http_client._retry_after(_Headers()) is None
+    assert http_client._retry_after(_Headers("soon")) is None
+    in_ten = http_client._retry_after(_Headers(formatdate(time.time() + 10, usegmt=True)))
+    assert 8 <= in_ten <= 10
+    assert http_client._retry_after(_Headers(formatdate(time.time() - 60, usegmt=True))) == 0.0
+
+
+def test_short_retry_after_waits_then_sends():
+    breaker = http_client.CircuitBreaker("example.com", failures=5, cooldown=60)
+    breaker.record_failure(retry_after=0.3)
+    started = time.monotonic()
+    breaker.before_call()
+    assert time.monotonic() - started >= 0.25
+
+
+def test_long_retry_after_short_circuits():
+    breaker = http_client.CircuitBreaker("example.com", failures=5, cooldown=60)
+    breaker.record_failure(retry_after=http_client.RETRY_AFTER_MAX_WAIT + 60)
+    with pytest.raises(http_client.CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.remaining > http_client.RETRY_AFTER_MAX_WAIT
+
+
+def test_get_honours_short_retry_after(server):
+    started = time.monotonic()
+    r = http_client.get(f"{server.url}/busy-1")
+    assert r.status_code == 200
+    assert server.hits["/busy-1"] == 2
+    assert time.monotonic() - started >= 0.9
+
+
+def test_get_returns_503_on_long_retry_after_and_then_short_circuits(server):
+    r = http_client.get(f"{server.url}/busy-3600")
+    assert r.status_code == 503
+    assert server.hits["/busy-3600"] == 1
+    with pytest.raises(http_client.CircuitOpenError):
+        http_client.get(f"{server.url}/other")
+    assert "/other" not in server.hits
@@ -0,0 +1,43 @@
+"""insert_items: 1トランザクションでまとめて挿入し、重複は読み飛ばし、失敗時は1件も残さないこと"""
+
+import pytest
+
+from conftest import query_all
+
+
+def _items(*paths):
+    return [{"title": "テスト作品", "content": "予約開始", "source_url": f"https://example.com/{p}",
+             "source_type": "Google", "category": "その他"} for p in paths]
+
+
+@pytest.mark.parametrize("writer", [False, True])
+def test_inserts_new_rows_and_skips_duplicates(db, writer):
+    if writer:
+        db.start_sqlite_writer()
+    try:
+        first = db.insert_items(_items("a", "b"))
+        # 既存の a と、同じバッチ内で重複する c は1件だけ保存される
+        second = db.insert_items(_items("a", "c", "c?utm_source=x"))
+    finally:
+        db.stop_sqlite_writer()
+    assert [i["source_url"] for i in first] == ["https://example.com/a", "https://example.com/b"]
+    assert [i["source_url"] for i in second] == ["https://example.com/c"]
+    rows = query_all("SELECT id, source_url FROM goods_info ORDER BY id")
+    assert [r["id"] for r in rows] == [i["id"] for i in first + second]
+
+
+def test_failure_rolls_back_the_whole_batch(db, monkeypatch):
+    db.insert_items(_items("a"))
+
+    def fail(c, new_rows):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(db, "_bump_facet_counts", fail)
+    with pytest.raises(RuntimeError):
+        db.insert_items(_items("b", "c"))
+    assert [r["source_url"] for r in query_all("SELECT source_url FROM goods_info")] == ["https://example.com/a"]
+
+
+def test_empty_batch(db):
+    assert db.insert_items([]) == []
+    assert db.insert_item(_items("a")[0]) is True
+    assert db.insert_item(_items("a")[0]) is False
@@ -0,0 +1,26 @@
+"""保存済みURLの判定: 既存DBの行も init_db 後は「既知」として取得・画像解決を省けること"""
+
+from conftest import legacy_rows
+
+
+def test_baseline_rows_are_known_after_init_db(baseline_db):
+    db = baseline_db
+    legacy_rows([
+        {"source_url": "https://example.com/a?utm_source=z"},
+        {"source_url": "http://www.example.com/b/"},
+    ])
+    db.init_db()
+
+    items = [
+        {"source_url": "https://example.com/a"},
+        {"source_url": "https://example.com/b?fbclid=x"},
+        {"source_url": "https://example.com/c"},
+        {"source_url": ""},
+    ]
+    unknown = db.filter_unknown_items(items)
+    assert [i["source_url"] for i in unknown] == ["https://example.com/c", ""]
+
+
+def test_newly_inserted_rows_are_known(db):
+    db.insert_items([{"title": "テスト作品", "source_url": "https://example.com/a"}])
+    assert db.filter_unknown_items([{"source_url": "https://EXAMPLE.com/a#top"}]) == []
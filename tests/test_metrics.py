@@ -0,0 +1,53 @@
+"""metrics.start_http_server: 既定はローカルだけで待ち受け、トークン設定時は Bearer 認証を求めること"""
+
+import urllib.error
+import urllib.request
+
+import pytest
+
+import metrics
+
+
+def _get(server, token=None):
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=5) as r:
+        return r.status
+
+
+@pytest.fixture
+def start():
+    servers = []
+
+    def _start(**kwargs):
+        server = metrics.start_http_server(0, **kwargs)
+        servers.append(server)
+        return server
+    yield _start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_binds_to_localhost_by_default(start, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "")
+    server = start()
+    assert server.server_address[0] == "127.0.0.1"
+    assert _get(server) == 200
+
+
+def test_token_is_required_when_set(start, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "s3cret")
+    server = start()
+    for token in (None, "wrong"):
+        with pytest.raises(urllib.error.HTTPError) as excinfo:
+            _get(server, token)
+        assert excinfo.value.code == 401
+    assert _get(server, "s3cret") == 200
+
+
+def test_authorized():
+    assert metrics.authorized("Bearer abc", "abc")
+    assert not metrics.authorized("Bearer abc", "")
+    assert not metrics.authorized(None, "abc")
+    assert not metrics.authorized("abc", "abc")
@@ -0,0 +1,80 @@
+"""新着通知: 挿入と同じトランザクションでアウトボックスに積み、notifier が sent / dead に進めること"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import notifier
+from conftest import query_all
+
+
+@pytest.fixture
+def favorite(db):
+    def job(conn):
+        c = conn.cursor()
+        c.execute("INSERT INTO users (email, password_hash) VALUES ('fan@example.com', 'x')")
+        c.execute("INSERT INTO favorites (user_id, anime_title) VALUES (?, 'テスト作品')", (c.lastrowid,))
+    db.run_write(job)
+    return db
+
+
+def _insert(db, path="a"):
+    return db.insert_items([{"title": "テスト作品 一番くじ", "source_url": f"https://example.com/{path}"}],
+                           notify_title="テスト作品")
+
+
+def _outbox():
+    return query_all("SELECT item_id, status, attempts, last_error FROM notification_outbox")
+
+
+def _run_once(monkeypatch, sender):
+    monkeypatch.setattr(notifier.SenderPool, "get", lambda self: sender)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return notifier.run_once(executor, notifier.SenderPool())
+
+
+def test_insert_enqueues_one_row_per_favorite(favorite):
+    db = favorite
+    saved = _insert(db)
+    assert [(r["item_id"], r["status"]) for r in _outbox()] == [(saved[0]["id"], "pending")]
+    # 重複で挿入されなかった記事は通知しない
+    assert _insert(db) == []
+    assert len(_outbox()) == 1
+
+
+def test_failed_insert_rolls_back_item_and_notification(favorite, monkeypatch):
+    db = favorite
+    enqueue = db._enqueue_notifications
+    def enqueue_then_fail(*args):
+        enqueue(*args)
+        raise RuntimeError("after enqueue")
+    monkeypatch.setattr(db, "_enqueue_notifications", enqueue_then_fail)
+    with pytest.raises(RuntimeError):
+        _insert(db)
+    assert _outbox() == []
+    assert query_all("SELECT id FROM goods_info") == []
+
+
+def test_run_once_marks_sent(favorite, monkeypatch):
+    _insert(favorite)
+    assert _run_once(monkeypatch, notifier.LogSender()) == 1
+    assert [r["status"] for r in _outbox()] == ["sent"]
+    assert favorite.get_pending_notifications() == []
+
+
+def test_failing_sender_marks_dead_after_max_attempts(favorite, monkeypatch):
+    db = favorite
+    monkeypatch.setattr(db, "NOTIFY_MAX_ATTEMPTS", 3)
+    _insert(db)
+
+    class BrokenSender:
+        def send(self, to_email, subject, body):
+            raise OSError("SMTP down")
+
+    for attempt in range(1, 4):
+        assert _run_once(monkeypatch, BrokenSender()) == 0
+        row = _outbox()[0]
+        assert row["attempts"] == attempt
+        assert row["last_error"] == "SMTP down"
+        assert row["status"] == ("dead" if attempt == 3 else "pending")
+    assert db.get_pending_notifications() == []
@@ -0,0 +1,75 @@
+"""OGP画像キャッシュ: 結果を期限付きで覚え、画像の取れないドメインは一定時間見送ること"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import caches
+import crawler
+import ogp
+
+
+@pytest.fixture
+def fetcher(db, monkeypatch):
+    """ogp.fetch_ogp の呼び出しを数える。results に入れた画像URLを順に返す（例外を入れるとそれを送出）"""
+    monkeypatch.setattr(caches, "ogp", caches.OgpCache())
+    calls, results = [], []
+
+    def fetch(url, timeout=None):
+        calls.append(url)
+        result = results.pop(0) if results else "https://img.example.com/og.jpg"
+        if isinstance(result, Exception):
+            raise result
+        return {"image_url": result, "strategy": "og" if result else "", "final_url": url}
+    monkeypatch.setattr(ogp, "fetch_ogp", fetch)
+    return SimpleNamespace(calls=calls, results=results)
+
+
+def test_result_is_cached_across_restarts(fetcher, monkeypatch):
+    url = "https://example.com/news/1"
+    assert crawler.fetch_ogp_image(url) == "https://img.example.com/og.jpg"
+    assert crawler.fetch_ogp_image(url + "?utm_source=x") == "https://img.example.com/og.jpg"
+    monkeypatch.setattr(caches, "ogp", caches.OgpCache())   # LRUが空でもDBから引ける
+    assert crawler.fetch_ogp_image(url) == "https://img.example.com/og.jpg"
+    assert len(fetcher.calls) == 1
+
+
+def test_negative_result_expires(fetcher, monkeypatch):
+    monkeypatch.setattr(caches, "OGP_NEGATIVE_TTL", 0.3)
+    url = "https://example.com/news/2"
+    fetcher.results.append("")
+    assert crawler.fetch_ogp_image(url) == ""
+    assert crawler.fetch_ogp_image(url) == ""      # 画像なしも覚えている
+    assert len(fetcher.calls) == 1
+    time.sleep(0.35)
+    monkeypatch.setattr(caches, "ogp", caches.OgpCache())
+    assert crawler.fetch_ogp_image(url) == "https://img.example.com/og.jpg"
+    assert len(fetcher.calls) == 2
+
+
+def test_failing_domain_is_skipped_then_retried(fetcher, monkeypatch):
+    monkeypatch.setattr(caches, "OGP_DOMAIN_SKIP_FAILURES", 3)
+    monkeypatch.setattr(caches, "OGP_DOMAIN_SKIP_SECONDS", 0.5)
+    monkeypatch.setattr(caches, "OGP_DOMAIN_STATS_TTL", 0)
+    fetcher.results.extend([OSError("reset"), "", OSError("timeout")])
+    for i in range(3):
+        assert crawler.fetch_ogp_image(f"https://broken.example.com/{i}") == ""
+    # 3回続けて取れなかったので、同じドメインの別の記事は取りに行かない
+    assert crawler.fetch_ogp_image("https://broken.example.com/3") == ""
+    assert len(fetcher.calls) == 3
+    # 他のドメインは影響を受けない
+    assert crawler.fetch_ogp_image("https://example.com/ok") == "https://img.example.com/og.jpg"
+
+    time.sleep(0.55)
+    assert crawler.fetch_ogp_image("https://broken.example.com/3") == "https://img.example.com/og.jpg"
+    stats = caches.database.get_ogp_domain("broken.example.com")
+    assert stats["consecutive_failures"] == 0 and stats["successes"] == 1 and stats["attempts"] == 4
+
+
+def test_success_resets_consecutive_failures(fetcher, monkeypatch):
+    monkeypatch.setattr(caches, "OGP_DOMAIN_SKIP_FAILURES", 2)
+    fetcher.results.extend(["", "https://img.example.com/a.jpg", ""])
+    for i in range(3):
+        crawler.fetch_ogp_image(f"https://flaky.example.com/{i}")
+    assert not caches.ogp.domain_skipped("flaky.example.com")
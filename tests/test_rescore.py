@@ -0,0 +1,63 @@
+"""保存済みスコア: 新しさの区分の境目（freshness_due）を過ぎた行だけを再スコアすること"""
+
+from datetime import datetime, timedelta
+
+import scorer
+from conftest import query_all
+
+
+def _days_ago(n):
+    return (datetime.now() - timedelta(days=n)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _insert(db, *paths, days_ago=3):
+    return db.insert_items([{"date": _days_ago(days_ago), "title": "テスト作品", "content": "予約開始",
+                             "source_url": f"https://example.com/{p}", "source_type": "Google"} for p in paths])
+
+
+def _set(db, sql, params=()):
+    db.run_write(lambda conn: conn.cursor().execute(sql, params))
+
+
+def _scores():
+    return {r["source_url"].rsplit("/", 1)[1]: r for r in query_all(
+        "SELECT source_url, freshness_score, total_score, freshness_due FROM goods_info")}
+
+
+def test_scores_are_persisted_at_insert(db):
+    _insert(db, "a")
+    row = _scores()["a"]
+    assert row["freshness_score"] == 40
+    assert row["freshness_due"] == scorer.freshness_due(_days_ago(3))
+
+
+def test_rescore_stale_only_touches_rows_past_due(db):
+    _insert(db, "stale", "fresh")
+    # stale: 保存から日が経って 7日の区分を越えた行（日付を10日前にし、freshness_due を過去にする）
+    _set(db, "UPDATE goods_info SET date = ?, freshness_due = ? WHERE source_url LIKE '%stale'",
+         (_days_ago(10), _days_ago(2)[:10]))
+    # fresh: 期限前の行は保存済みの値をそのまま使う（再計算されれば 40 に戻る）
+    _set(db, "UPDATE goods_info SET freshness_score = 0 WHERE source_url LIKE '%fresh'")
+
+    assert db.rescore_stale() == 1
+    scores = _scores()
+    assert scores["stale"]["freshness_score"] == 30
+    assert scores["stale"]["freshness_due"] > datetime.now().strftime("%Y-%m-%d")
+    assert scores["fresh"]["freshness_score"] == 0
+    # 期限が先に延びたので、もう一度呼んでも何もしない
+    assert db.rescore_stale() == 0
+
+
+def test_rescore_stale_runs_in_batches(db):
+    _insert(db, "a", "b", "c", days_ago=200)
+    _set(db, "UPDATE goods_info SET freshness_due = '2000-01-01'")
+    assert db.rescore_stale(batch_size=2) == 3
+    assert {r["freshness_due"] for r in _scores().values()} == {scorer.FRESHNESS_DUE_NEVER}
+
+
+def test_init_db_backfills_unscored_rows(db):
+    _insert(db, "a")
+    _set(db, "UPDATE goods_info SET freshness_due = NULL, total_score = 0, freshness_score = 0")
+    db.init_db()
+    row = _scores()["a"]
+    assert row["freshness_score"] == 40 and row["total_score"] > 0 and row["freshness_due"]
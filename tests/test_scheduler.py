@@ -0,0 +1,130 @@
+"""巡回スケジュール: 間隔の上下限・まとめ検索の判定・ターゲットの確保と巡回結果の記録"""
+
+import threading
+import time
+
+import pytest
+
+import crawler
+import scheduler
+from conftest import query_all
+
+
+# ─── scheduler.py ──────────────────────────────────────────────
+@pytest.mark.parametrize("yield_ewma, favorites", [(0, 0), (0.5, 0), (3, 10), (1000, 10 ** 6), (None, None)])
+def test_next_interval_stays_within_bounds(yield_ewma, favorites):
+    for _ in range(50):
+        interval = scheduler.next_interval(yield_ewma, favorites)
+        assert scheduler.CRAWL_MIN_INTERVAL <= interval <= scheduler.CRAWL_SLA_SECONDS
+
+
+def test_next_interval_shrinks_with_yield_and_favorites(monkeypatch):
+    monkeypatch.setattr(scheduler, "JITTER", 0)
+    assert scheduler.next_interval(0, 0) == scheduler.CRAWL_SLA_SECONDS
+    assert scheduler.next_interval(2, 0) < scheduler.next_interval(0.5, 0) < scheduler.CRAWL_SLA_SECONDS
+    assert scheduler.next_interval(0.5, 100) < scheduler.next_interval(0.5, 0)
+    assert scheduler.next_interval(10 ** 6, 0) == scheduler.CRAWL_MIN_INTERVAL
+
+
+def test_update_yield():
+    assert scheduler.update_yield(None, 4, 0) == 4.0
+    assert scheduler.update_yield(1.0, 0, 5) == pytest.approx(1 - scheduler.YIELD_EWMA_ALPHA)
+
+
+@pytest.mark.parametrize("target, expected", [
+    ({"crawl_count": scheduler.BATCH_MIN_CRAWLS, "yield_ewma": scheduler.BATCH_YIELD_MAX}, True),
+    ({"crawl_count": scheduler.BATCH_MIN_CRAWLS, "yield_ewma": 0.0}, True),
+    ({"crawl_count": scheduler.BATCH_MIN_CRAWLS - 1, "yield_ewma": 0.0}, False),
+    ({"crawl_count": 100, "yield_ewma": scheduler.BATCH_YIELD_MAX + 0.01}, False),
+    ({"crawl_count": None, "yield_ewma": None}, False),
+    ({}, False),
+])
+def test_is_batchable_bounds(target, expected):
+    assert scheduler.is_batchable(target) is expected
+
+
+# ─── database.claim_due_targets / record_target_crawl ───────────────
+def _add_targets(db, names, **columns):
+    cols = ["name_ja"] + list(columns)
+    def job(conn):
+        conn.cursor().executemany(
+            f"INSERT INTO anime_targets ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+            [(n, *columns.values()) for n in names])
+    db.run_write(job)
+
+
+def test_claimed_targets_are_not_claimed_again(db):
+    _add_targets(db, [f"作品{i}" for i in range(5)])
+    first = db.claim_due_targets(3)
+    second = db.claim_due_targets(10)
+    assert len(first) == 3 and len(second) == 2
+    assert not {t["name_ja"] for t in first} & {t["name_ja"] for t in second}
+    assert db.claim_due_targets(10) == []
+
+
+def test_claim_lease_expires(db):
+    _add_targets(db, ["作品"])
+    assert db.claim_due_targets(1, claim_seconds=1)
+    assert db.claim_due_targets(1) == []
+    time.sleep(1.1)
+    assert [t["name_ja"] for t in db.claim_due_targets(1)] == ["作品"]
+
+
+@pytest.mark.parametrize("writer", [False, True])   # スレッドごとの接続で同時に UPDATE / 書き込みスレッドに直列化
+def test_concurrent_claims_do_not_double_claim(db, writer):
+    _add_targets(db, [f"作品{i}" for i in range(60)])
+    if writer:
+        db.start_sqlite_writer()
+    claimed, lock = [], threading.Lock()
+
+    def worker():
+        while True:
+            targets = db.claim_due_targets(2)
+            if not targets:
+                return
+            with lock:
+                claimed.extend(t["name_ja"] for t in targets)
+
+    try:
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        db.stop_sqlite_writer()
+    assert len(claimed) == 60
+    assert len(set(claimed)) == 60
+
+
+def test_batchable_claim_only_returns_low_yield_targets(db):
+    _add_targets(db, ["静か1", "静か2"], crawl_count=5, yield_ewma=0.1)
+    _add_targets(db, ["人気"], crawl_count=5, yield_ewma=3.0)
+    _add_targets(db, ["新規"])
+    names = {t["name_ja"] for t in db.claim_due_targets(10, batchable=True)}
+    assert names == {"静か1", "静か2"}
+
+
+def test_record_target_crawl_moves_next_due(db, monkeypatch):
+    monkeypatch.setattr(scheduler, "JITTER", 0)
+    _add_targets(db, ["作品"])
+    db.claim_due_targets(1)
+    due = db.record_target_crawl("作品", 0)
+    row = query_all("SELECT crawl_count, yield_ewma, next_due_at FROM anime_targets WHERE name_ja = ?", ("作品",))[0]
+    assert row["crawl_count"] == 1 and row["yield_ewma"] == 0
+    assert row["next_due_at"] == due
+    assert due - time.time() == pytest.approx(scheduler.CRAWL_SLA_SECONDS, abs=5)
+    assert db.record_target_crawl("ターゲットではない検索", 3) is None
+
+
+def test_failed_fetch_defers_without_touching_history(db, monkeypatch):
+    def fail(*args, **kwargs):
+        raise crawler.FeedFetchError("HTTP 503")
+    monkeypatch.setattr(crawler, "fetch_google_news", fail)
+    _add_targets(db, ["作品"], crawl_count=5, yield_ewma=2.0)
+    targets = crawler.claim_next_targets()
+    with pytest.raises(crawler.FeedFetchError):
+        crawler.crawl_targets(targets)
+    row = query_all("SELECT crawl_count, yield_ewma, next_due_at FROM anime_targets")[0]
+    assert row["crawl_count"] == 5 and row["yield_ewma"] == 2.0
+    assert row["next_due_at"] - time.time() <= scheduler.CRAWL_RETRY_INTERVAL + 1
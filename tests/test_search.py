@@ -0,0 +1,46 @@
+"""全文検索: キーセットカーソルで全件を重複なく辿れ、途中で行が増えてもずれないこと"""
+
+import pytest
+
+
+def _insert(db, n, start=0, word="限定グッズ", day=10):
+    db.insert_items([{
+        "date": f"2026-10-{day + i % 5:02d} 12:00:00",
+        "title": f"{word} 第{i}弾",
+        "content": f"{word} 第{i}弾の予約開始" + " 詳細" * (i % 3),
+        "author": "テスト",
+        "source_url": f"https://example.com/search/{i}",
+        "source_type": "Google",
+    } for i in range(start, start + n)])
+
+
+@pytest.mark.parametrize("q", ["限定グッズ", "弾"])   # FTS（3文字以上）/ LIKE（短い語）
+def test_cursor_pages_cover_all_rows_once(db, q):
+    _insert(db, 11)
+    seen, cursor = [], None
+    while True:
+        items, cursor = db.search_items(q, limit=3, cursor=cursor)
+        seen.extend(i["id"] for i in items)
+        if cursor is None:
+            break
+    assert len(seen) == 11
+    assert len(set(seen)) == 11
+
+
+def test_rows_inserted_between_pages_do_not_shift_results(db):
+    _insert(db, 6)
+    first, cursor = db.search_items("弾", limit=3)
+    # 1ページ目より前に並ぶ（日付の新しい）行が増えても、2ページ目は1ページ目の続きから
+    _insert(db, 3, start=100, day=20)
+    second, _ = db.search_items("弾", limit=3, cursor=cursor)
+    assert not {i["id"] for i in first} & {i["id"] for i in second}
+    assert len(second) == 3
+
+
+def test_invalid_cursor(db):
+    with pytest.raises(db.InvalidCursor):
+        db.search_items("限定グッズ", cursor="not-a-cursor")
+    # 形式は正しいが値が配列（SQLのパラメータにできない）
+    bad = db._encode_cursor({"a": [1], "b": 2, "c": 3}, ("a", "b", "c"))
+    with pytest.raises(db.InvalidCursor):
+        db.search_items("限定グッズ", cursor=bad)
@@ -0,0 +1,55 @@
+"""検索キュー: RSS取得に失敗したユーザー検索が再試行され、上限で dead になること"""
+
+import pytest
+
+import crawler
+import http_client
+from conftest import query_all
+
+
+class _Response:
+    status_code = 503
+    headers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def _queue_row(query):
+    return query_all("SELECT status, attempts, last_error FROM search_queue WHERE query = ?", (query,))[0]
+
+
+def test_failed_fetch_is_retried_then_dead(db, monkeypatch):
+    monkeypatch.setattr(http_client, "get", lambda *args, **kwargs: _Response())
+    db.add_to_search_queue("テスト作品")
+
+    for attempt in range(1, db.QUEUE_MAX_ATTEMPTS + 1):
+        query = db.get_next_from_queue(crawler.WORKER_ID)
+        assert query == "テスト作品"
+        with pytest.raises(crawler.FeedFetchError):
+            crawler.process_queued(query)
+        row = _queue_row(query)
+        assert row["attempts"] == attempt
+        assert "HTTP 503" in row["last_error"]
+        assert row["status"] == ("dead" if attempt == db.QUEUE_MAX_ATTEMPTS else "pending")
+
+    assert db.get_next_from_queue(crawler.WORKER_ID) is None
+
+
+def test_circuit_open_does_not_use_an_attempt(db, monkeypatch):
+    def short_circuit(*args, **kwargs):
+        raise http_client.CircuitOpenError(http_client.GNEWS_HOST, 30)
+    monkeypatch.setattr(http_client, "get", short_circuit)
+    db.add_to_search_queue("テスト作品")
+
+    query = db.get_next_from_queue(crawler.WORKER_ID)
+    with pytest.raises(http_client.CircuitOpenError):
+        crawler.process_queued(query)
+    row = _queue_row(query)
+    assert row["attempts"] == 0
+    assert row["status"] == "processing"
+    # 回路が閉じる頃まではリースを持ったままなので、すぐには取り直さない
+    assert db.get_next_from_queue(crawler.WORKER_ID) is None
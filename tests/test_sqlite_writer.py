@@ -0,0 +1,79 @@
+"""SQLite書き込みスレッド: run_write の直列化と、失敗したジョブだけの巻き戻し"""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from conftest import query_all
+
+
+@pytest.fixture
+def writer(db):
+    db.run_write(lambda conn: conn.cursor().execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)"))
+    db.start_sqlite_writer()
+    yield db._sqlite_writer
+    db.stop_sqlite_writer()
+
+
+def test_concurrent_run_write_is_serialized(db, writer):
+    running, overlaps, lock = [0], [], threading.Lock()
+
+    def job(conn):
+        with lock:
+            running[0] += 1
+            overlaps.append(running[0])
+        time.sleep(0.002)
+        c = conn.cursor()
+        c.execute("INSERT INTO t (v) VALUES (?)", (threading.current_thread().name,))
+        with lock:
+            running[0] -= 1
+        return c.lastrowid
+
+    results = []
+    def worker():
+        for _ in range(10):
+            results.append(db.run_write(job))
+
+    threads = [threading.Thread(target=worker, name=f"w{i}") for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(overlaps) == 1
+    assert sorted(results) == list(range(1, 81))
+    assert len(query_all("SELECT id FROM t")) == 80
+
+
+def test_failing_job_rolls_back_only_its_savepoint(db):
+    db.run_write(lambda conn: conn.cursor().execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)"))
+
+    def insert(v, fail=False):
+        def job(conn):
+            conn.cursor().execute("INSERT INTO t (v) VALUES (?)", (v,))
+            if fail:
+                raise ValueError(v)
+            return v
+        return job
+
+    # 起動前に積んでおくと1バッチ（1トランザクション）にまとめて実行される
+    writer = db.SQLiteWriter()
+    futures = [writer.submit(insert("a")), writer.submit(insert("b", fail=True)), writer.submit(insert("c"))]
+    writer.start()
+    try:
+        assert futures[0].result(5) == "a"
+        with pytest.raises(ValueError):
+            futures[1].result(5)
+        assert futures[2].result(5) == "c"
+    finally:
+        writer.stop()
+    assert writer.batches == 1 and writer.jobs == 3
+    assert [r["v"] for r in query_all("SELECT v FROM t ORDER BY id")] == ["a", "c"]
+
+
+def test_row_factory_does_not_leak_between_jobs(db, writer):
+    def set_row(conn):
+        conn.row_factory = sqlite3.Row
+    db.run_write(set_row)
+    assert db.run_write(lambda conn: conn.row_factory) is None
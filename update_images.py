@@ -5,6 +5,7 @@ import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, BASE_DIR)
 import database
+import metrics
 from crawler import fetch_ogp_image
 
 def update_existing_images():
@@ -29,12 +30,16 @@ def update_existing_images():
                 c.execute("UPDATE goods_info SET image_url = ? WHERE id = ?", (img_url, item_id))
                 conn.commit()
                 updated += 1
+                metrics.IMAGE_UPDATES.inc(result="updated")
                 print(f" -> 成功: {img_url}")
             else:
+                metrics.IMAGE_UPDATES.inc(result="failed")
                 print(" -> 画像が見つかりませんでした")
                 
     conn.close()
     print(f"\n✅ 更新完了: {updated} 件の画像を追加しました。")
+    # METRICS_TEXTFILE を指定していれば取得時間・件数を書き出す
+    metrics.write_textfile()
 
 if __name__ == "__main__":
     update_existing_images()
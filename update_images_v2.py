@@ -12,6 +12,7 @@ import time
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, BASE_DIR)
 import database
+import metrics
 from crawler import fetch_ogp_image, decode_google_news_url
 
 # G=アイコン（Google Newsプレースホルダー）を検出するキーワード
@@ -76,15 +77,19 @@ def update_existing_images_v2():
             c.execute("UPDATE goods_info SET image_url = ? WHERE id = ?", (img_url, item_id))
             conn.commit()
             updated += 1
+            metrics.IMAGE_UPDATES.inc(result="updated")
             print(f"   -> 成功: {img_url[:80]}")
         else:
             failed += 1
+            metrics.IMAGE_UPDATES.inc(result="failed")
             print(f"   -> 取得失敗または不適切な画像（スキップ）")
 
         time.sleep(0.5)  # レートリミット対策
 
     conn.close()
     print(f"\n✅ 更新完了: {updated} 件成功 / {failed} 件失敗")
+    # METRICS_TEXTFILE を指定していれば取得時間・件数を書き出す
+    metrics.write_textfile()
 
 if __name__ == "__main__":
     sys.stdout.reconfigure(encoding='utf-8')
@@ -0,0 +1,99 @@
+"""
+urlnorm.py — URL正規化
+同じ記事を指すURLの表記ゆれ（トラッキングパラメータ、ホストの大文字小文字、
+Google News の中間URL など）を吸収し、重複判定用のハッシュを作る。
+"""
+
+import base64
+import hashlib
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# 記事の同一性に関係しないクエリパラメータ
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "yclid", "msclkid", "igshid", "dclid",
+    "mc_cid", "mc_eid", "_ga", "_gl", "ref", "ref_src", "spm",
+    "oc", "cmpid", "ncid", "ito", "from",
+}
+TRACKING_PREFIXES = ("utm_",)
+
+GNEWS_HOST = "news.google.com"
+# /rss/articles/<ID>, /articles/<ID>, /read/<ID> はすべて同じ記事を指す
+GNEWS_ARTICLE_RE = re.compile(r"^/(?:rss/)?(?:articles|read)/([A-Za-z0-9_-]+)")
+EMBEDDED_URL_RE = re.compile(rb"https?://[\x21-\x7e]+")
+
+def _unwrap_google_news(path: str) -> str:
+    """
+    Google News の記事URLを展開する。
+    旧形式(CBMi...)のIDはbase64の中に元記事URLがそのまま入っているので取り出す。
+    新形式はネットワークなしでは展開できないため、IDだけを残した正規形にする。
+    """
+    m = GNEWS_ARTICLE_RE.match(path)
+    if not m:
+        return ""
+    article_id = m.group(1)
+    try:
+        raw = base64.urlsafe_b64decode(article_id + "=" * (-len(article_id) % 4))
+        found = EMBEDDED_URL_RE.search(raw)
+        if found:
+            return found.group(0).decode("ascii")
+    except Exception:
+        pass
+    return f"https://{GNEWS_HOST}/rss/articles/{article_id}"
+
+def _is_tracking_param(key: str) -> bool:
+    key = key.lower()
+    return key in TRACKING_PARAMS or key.startswith(TRACKING_PREFIXES)
+
+def canonicalize_url(url: str, _depth: int = 0) -> str:
+    """
+    重複判定用の正規URLを返す。
+    - スキームは https に統一、ホストは小文字化して www. とデフォルトポートを除去
+    - トラッキングパラメータ・フラグメントを除去し、残りのクエリはキー順に整列
+    - Google News の中間URLは元記事URL（または記事IDのみの正規形）に展開
+    """
+    url = (url or "").strip()
+    if not url:
+        return ""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if not parts.netloc:
+        return url
+
+    host = (parts.hostname or "").rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port in (None, 80, 443) else f"{host}:{port}"
+
+    if host == GNEWS_HOST and _depth == 0:
+        unwrapped = _unwrap_google_news(parts.path)
+        if unwrapped:
+            return canonicalize_url(unwrapped, _depth + 1)
+
+    path = parts.path or "/"
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/") or "/"
+
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not _is_tracking_param(k)]
+    query.sort()
+    return urlunsplit(("https", netloc, path, urlencode(query), ""))
+
+def url_hash(url: str) -> str:
+    """正規URLのハッシュ（goods_info.url_hash に格納するキー）"""
+    return hashlib.sha1(canonicalize_url(url).encode("utf-8")).hexdigest()
+
+if __name__ == "__main__":
+    samples = [
+        "https://WWW.Natalie.mu/comic/news/12345/?utm_source=twitter&utm_medium=social#top",
+        "http://natalie.mu/comic/news/12345",
+        "https://news.google.com/rss/articles/CBMiZkFVX3lxTE9qaDZqb1Z3NVRqUWtrZmtJSjJRN3JVSGx4bm90S0JmZ2VrV2xsRTFrNjUwZkVIQTBpOFZCNmtiQldVUVRPdkQwVXZIT2tKeVZ1bGRaTTk2YmhxT3RacFFNTGtPcUFTQQ?oc=5",
+    ]
+    for s in samples:
+        print(f"{url_hash(s)[:12]}  {canonicalize_url(s)}")
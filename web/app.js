@@ -9,8 +9,13 @@ let allItems = [];
 let currentItems = []; // 表示対象となる現在のコレクション（フィルタ・検索後）
 let currentCategory = "all";
 let isSearchMode = false;
+let searchQuery = "";     // 検索モード中のキーワード（/api/items/search に渡す）
 const DISPLAY_STEP = 9;   // 1回に表示する件数
 let displayLimit = DISPLAY_STEP; // 現在の表示上限
+const PAGE_SIZE = 60;     // /api/items から1回に取得する件数
+let nextCursor = null;    // /api/items の次ページカーソル（null なら全件取得済み）
+let isFetchingPage = false;
+let listRequestId = 0;    // カテゴリ切替のたびに増やし、切替前に出したリクエストの結果を捨てる
 
 // Auth State
 let authToken = localStorage.getItem("token") || null;
@@ -115,7 +120,64 @@ function getUniqueAnimeItems(items) {
     return uniqueItems;
 }
 
+// カテゴリタブの絞り込みを反映した表示対象を作る（キーワード検索はサーバー側で済んでいる）
+function computeCurrentItems() {
+    return applyFilters(allItems);
+}
+
 // ── API Fetch ──
+// /api/items に category として渡すタブ（「全て」「お気に入り」は絞り込まずに取得する）
+function serverCategory() {
+    return (currentCategory === "all" || currentCategory === "favorites") ? null : currentCategory;
+}
+
+// 検索モード中は全文検索APIの結果（関連度順）を、それ以外はスコア順の一覧をページ単位で取得する。
+// 一覧はカテゴリタブの絞り込みもサーバー側で行う（読み込み済みのページだけを絞ると件数が足りなくなるため）
+async function fetchItemsPage(cursor) {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    if (cursor) params.set("cursor", cursor);
+    let url;
+    if (isSearchMode && searchQuery) {
+        params.set("q", searchQuery);
+        url = `${API_BASE}/api/items/search?${params}`;
+    } else {
+        params.set("sort", "score");
+        if (serverCategory()) params.set("category", serverCategory());
+        url = `${API_BASE}/api/items?${params}`;
+    }
+    const res = await fetch(url);
+    return await res.json();
+}
+
+// カテゴリタブを切り替えたときに、カーソルを捨てて1ページ目から取り直す
+async function reloadFirstPage() {
+    const requestId = ++listRequestId;
+    nextCursor = null;
+    const json = await fetchItemsPage(null);
+    if (requestId !== listRequestId) return false; // 待っている間にさらにタブが切り替わった
+    allItems = json.items || [];
+    nextCursor = json.next_cursor || null;
+    return true;
+}
+
+// 次のページを取得して allItems に追記する
+async function loadMoreItems() {
+    if (!nextCursor || isFetchingPage) return;
+    isFetchingPage = true;
+    const requestId = listRequestId;
+    try {
+        const json = await fetchItemsPage(nextCursor);
+        if (requestId !== listRequestId) return; // 切替前のカテゴリの続きは捨てる
+        allItems = allItems.concat(json.items || []);
+        nextCursor = json.next_cursor || null;
+        currentItems = computeCurrentItems();
+    } catch (e) {
+        console.error("loadMoreItems error", e);
+    } finally {
+        isFetchingPage = false;
+    }
+}
+
 async function fetchFavorites() {
     if (!authToken) return;
     try {
@@ -132,9 +194,9 @@ async function fetchFavorites() {
 async function fetchData() {
     try {
         if (authToken) await fetchFavorites();
-        const res = await fetch(`${API_BASE}/api/items?sort=score`);
-        const json = await res.json();
+        const json = await fetchItemsPage(null);
         allItems = json.items || [];
+        nextCursor = json.next_cursor || null;
 
         currentItems = applyFilters(allItems);
 
@@ -167,6 +229,7 @@ async function fetchData() {
 // ── 検索＆自動追加起動 ──
 async function onSearch(query) {
     isSearchMode = true;
+    searchQuery = query;
     displayLimit = DISPLAY_STEP;
     sectionHeading.textContent = `Results for "${query}"`;
     setLoading(true);
@@ -181,26 +244,21 @@ async function onSearch(query) {
 
         if (json.status === "ok") {
             showToast(`✨ 「${query}」を追加！クローラが情報を探し始めました`);
-
-            setTimeout(async () => {
-                const res2 = await fetch(`${API_BASE}/api/items?sort=score`);
-                const json2 = await res2.json();
-                allItems = json2.items || [];
-
-                let searched = allItems.filter(i => i.title.includes(query) || i.content.includes(query));
-                currentItems = applyFilters(searched);
-
-                setLoading(false);
-                if (currentItems.length > 0) renderHero(currentItems.slice(0, 5));
-                else renderHero([]);
-                renderItems(currentItems.slice(0, displayLimit));
-                updateShowMoreBtn(currentItems);
-            }, 3000);
-
         } else {
-            setLoading(false);
             showToast(`⚠️ エラー: ${json.message}`);
         }
+
+        // 既に集めてある情報は全文検索APIからすぐに表示する
+        const json2 = await fetchItemsPage(null);
+        allItems = json2.items || [];
+        nextCursor = json2.next_cursor || null;
+        currentItems = computeCurrentItems();
+
+        setLoading(false);
+        if (currentItems.length > 0) renderHero(currentItems.slice(0, 5));
+        else renderHero([]);
+        renderItems(currentItems.slice(0, displayLimit));
+        updateShowMoreBtn(currentItems);
     } catch (e) {
         console.error(e);
         setLoading(false);
@@ -209,10 +267,29 @@ async function onSearch(query) {
 }
 
 // ── もっと見るボタン管理 ──
+// 読み込み済みの件数を超えたらサーバーから次のページを取得する
+async function showMore() {
+    if (isFetchingPage) return;
+    displayLimit += DISPLAY_STEP;
+    if (displayLimit > currentItems.length && nextCursor) await loadMoreItems();
+    renderItems(currentItems.slice(0, displayLimit));
+    updateShowMoreBtn(currentItems);
+}
+
+// ボタンが画面に近づいたら自動で次を読み込む（無限スクロール）
+const showMoreObserver = ("IntersectionObserver" in window)
+    ? new IntersectionObserver((entries) => {
+        if (entries.some(e => e.isIntersecting)) showMore();
+    }, { rootMargin: "400px" })
+    : null;
+
 function updateShowMoreBtn(allFiltered) {
     let btn = document.getElementById('show-more-btn');
-    if (displayLimit >= allFiltered.length) {
-        if (btn) btn.remove();
+    if (displayLimit >= allFiltered.length && !nextCursor) {
+        if (btn) {
+            if (showMoreObserver) showMoreObserver.unobserve(btn);
+            btn.remove();
+        }
         return;
     }
     if (!btn) {
@@ -221,14 +298,11 @@ function updateShowMoreBtn(allFiltered) {
         btn.className = 'show-more-wrapper';
         btn.innerHTML = `<button class="show-more-btn">もっと見る <span class="show-more-count"></span></button>`;
         cardsContainer.parentNode.insertBefore(btn, cardsContainer.nextSibling);
-        btn.querySelector('button').addEventListener('click', () => {
-            displayLimit += DISPLAY_STEP;
-            renderItems(currentItems.slice(0, displayLimit));
-            updateShowMoreBtn(currentItems);
-        });
+        btn.querySelector('button').addEventListener('click', showMore);
+        if (showMoreObserver) showMoreObserver.observe(btn);
     }
     const remaining = allFiltered.length - displayLimit;
-    btn.querySelector('.show-more-count').textContent = `（残り ${remaining} 件）`;
+    btn.querySelector('.show-more-count').textContent = nextCursor ? "" : `（残り ${remaining} 件）`;
 }
 
 // ── シェア機能 ──
@@ -564,7 +638,7 @@ document.addEventListener("DOMContentLoaded", async () => {
     // カテゴリフィルタのイベント
     if (filterBtns) {
         filterBtns.forEach(btn => {
-            btn.addEventListener("click", () => {
+            btn.addEventListener("click", async () => {
                 // UIのActive状態切り替え
                 filterBtns.forEach(b => b.classList.remove("active"));
                 btn.classList.add("active");
@@ -572,16 +646,20 @@ document.addEventListener("DOMContentLoaded", async () => {
                 // 状態更新
                 currentCategory = btn.dataset.category || "all";
 
-                // 検索モードかどうかに応じて表示対象を絞り込み
-                let targetItems = allItems;
-                if (isSearchMode) {
-                    const q = searchInput ? searchInput.value.trim() : "";
-                    if (q) {
-                        targetItems = targetItems.filter(i => i.title.includes(q) || i.content.includes(q));
+                // 一覧はサーバー側で絞り込んで取り直す（検索結果は読み込み済みの分を絞り込む）
+                if (!isSearchMode) {
+                    setLoading(true);
+                    try {
+                        if (!await reloadFirstPage()) return;
+                    } catch (e) {
+                        console.error("reloadFirstPage error", e);
+                        showToast("⚠️ データ取得に失敗しました");
+                    } finally {
+                        setLoading(false);
                     }
                 }
-
-                let filtered = applyFilters(targetItems);
+                let filtered = computeCurrentItems();
+                currentItems = filtered;
                 displayLimit = DISPLAY_STEP; // カテゴリ切替時に表示件数をリセット
                 renderItems(filtered.slice(0, displayLimit));
                 updateShowMoreBtn(filtered);
@@ -3,7 +3,7 @@
    オフライン対応・キャッシュ戦略
    ============================================================ */
 
-const CACHE_NAME = "anime-goods-tracker-v4";
+const CACHE_NAME = "anime-goods-tracker-v6";
 const STATIC_ASSETS = [
     "/",
     "/index.html",